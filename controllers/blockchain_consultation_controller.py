@@ -1,7 +1,17 @@
+import json
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from dependencies.database import SessionLocal
+from dependencies.env import BULK_VERIFY_MAX_IDS
 from dependencies.get_db import get_db
-from services.blockchain_consultation_service import add_diagnosis, get_diagnosis, DiagnosisRequest
+from services.async_blockchain_client import blockchain_client
+from services.blockchain_consultation_service import DiagnosisRequest
+from services.blockchain_anchor_service import anchor_metrics
+from services.blockchain_indexer import event_indexer
+from services.integrity_service import verify_consultation_async, verify_consultations_bulk
+from schemas.blockchain_consultation_schemas import BulkIntegrityRequest
+from services.onchain_cache import onchain_cache
 from schemas.auth_schemas import User as AuthUser
 from dependencies.auth import get_current_active_user
 import models
@@ -17,7 +27,7 @@ async def add_diagnosis_blockchain(
     Adds a diagnosis to the blockchain.
     """
     try:
-        result = add_diagnosis(diagnosis)
+        result = await blockchain_client.add_diagnosis(diagnosis)
         if result["status"] == 0:
             raise HTTPException(
                 status_code=400,
@@ -35,13 +45,15 @@ async def add_diagnosis_blockchain(
 @router.get("/get-diagnosis/{diagnosis_id}")
 async def get_diagnosis_blockchain(
     diagnosis_id: int,
-    current_user: AuthUser = Depends(get_current_active_user)
+    current_user: AuthUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
     ):
     """
     Retrieves a diagnosis from the blockchain by diagnosis ID.
+    Final records are served from the on-chain cache without an RPC call.
     """
     try:
-        result = get_diagnosis(diagnosis_id)
+        result = await onchain_cache.aget_diagnosis(db, diagnosis_id)
         return {
             "message": "Diagnosis retrieved successfully",
             "diagnosis": result
@@ -70,24 +82,8 @@ async def verify_consultation_integrity(
         if not hypotheses:
             raise HTTPException(status_code=400, detail="No hypotheses found")
 
-        # Fetch diagnosis from blockchain
-        blockchain_diagnosis = get_diagnosis(consultation_id)
-
-        # Compare data
-        is_valid = (
-            consultation.diagnosis == blockchain_diagnosis["doctor_diagnosis"] and
-            consultation.patient_id == blockchain_diagnosis["patient_id"] and
-            consultation.doctor_id == blockchain_diagnosis["doctor_id"]
-        )
-
-        # Compare hypotheses (up to 3)
-        for i, hypo in enumerate(hypotheses[:3]):
-            condition_field = f"condition{i+1}"
-            confidence_field = f"confidence{i+1}"
-            if (hypo.condition != blockchain_diagnosis[condition_field] or
-                hypo.confidence != blockchain_diagnosis[confidence_field]):
-                is_valid = False
-                break
+        # Compare with the blockchain (Merkle proof for batched anchors, diagnosis record otherwise)
+        is_valid = await verify_consultation_async(db, consultation)
 
         return {
             "message": "Integrity verification completed",
@@ -98,4 +94,113 @@ async def verify_consultation_integrity(
     except HTTPException as e:
         raise e
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to verify integrity: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to verify integrity: {str(e)}")
+
+@router.post("/verify-integrity/bulk")
+async def verify_consultations_integrity_bulk(
+    request: BulkIntegrityRequest,
+    current_user: AuthUser = Depends(get_current_active_user)):
+    """
+    Verifies the integrity of many consultations and streams one JSON result per line (NDJSON).
+
+    Args:
+        request (BulkIntegrityRequest): The IDs of the consultations to verify.
+        current_user (AuthUser): The authenticated user.
+
+    Returns:
+        StreamingResponse: application/x-ndjson lines with consultation_id, is_valid and error,
+        in request order. is_valid is null when the consultation could not be verified.
+
+    Raises:
+        HTTPException: 400 if no IDs or more than BULK_VERIFY_MAX_IDS are given.
+    """
+    # Step 1: Validate the request
+    consultation_ids = list(dict.fromkeys(request.consultation_ids))
+    if not consultation_ids:
+        raise HTTPException(status_code=400, detail="No consultation IDs given")
+    if len(consultation_ids) > BULK_VERIFY_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_VERIFY_MAX_IDS} consultations can be verified per request")
+
+    # Step 2: Stream the results, the session is owned by the stream since it outlives this function
+    def stream_results():
+        db = SessionLocal()
+        try:
+            for result in verify_consultations_bulk(db, consultation_ids):
+                yield json.dumps(result) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.get("/events/{consultation_id}")
+async def get_consultation_events(
+    consultation_id: int,
+    current_user: AuthUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)):
+    """
+    Lists the contract events indexed for a consultation, read from the database instead of the blockchain.
+
+    Args:
+        consultation_id (int): The ID of the consultation.
+        current_user (AuthUser): The authenticated user.
+        db (Session): The database session.
+
+    Returns:
+        dict: The DiagnosisAdded and HashAdded events of the consultation, and the MerkleRootAnchored
+        event of its batch when it was anchored in a Merkle batch, oldest first.
+    """
+    # Step 1: Events that reference the consultation directly
+    query = db.query(models.BlockchainEvent).filter(models.BlockchainEvent.diagnosis_id == consultation_id)
+
+    # Step 2: Root anchoring event of its Merkle batch
+    proof = db.get(models.DiagnosisMerkleProof, consultation_id)
+    if proof is not None:
+        query = db.query(models.BlockchainEvent).filter(
+            (models.BlockchainEvent.diagnosis_id == consultation_id) |
+            ((models.BlockchainEvent.event_name == "MerkleRootAnchored") & (models.BlockchainEvent.batch_id == proof.batch_id))
+        )
+
+    events = query.order_by(models.BlockchainEvent.block_number, models.BlockchainEvent.log_index).all()
+    return {
+        "consultation_id": consultation_id,
+        "events": [
+            {
+                "event_name": event.event_name,
+                "block_number": event.block_number,
+                "tx_hash": event.tx_hash,
+                "log_index": event.log_index,
+                "args": json.loads(event.data)
+            }
+            for event in events
+        ]
+    }
+
+@router.get("/indexer/status")
+async def get_indexer_status(
+    current_user: AuthUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)):
+    """
+    Returns the last block indexed by the event indexer and how far it is behind the chain head.
+    """
+    try:
+        return event_indexer.lag(db, await blockchain_client.get_block_number())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read the indexer status: {str(e)}")
+
+@router.get("/metrics")
+async def get_anchor_metrics(
+    limit: int = 1000,
+    current_user: AuthUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)):
+    """
+    Returns the confirmation latency and cost of the last confirmed anchoring transactions.
+
+    Args:
+        limit (int): Number of recent confirmed transactions to aggregate.
+        current_user (AuthUser): The authenticated user.
+        db (Session): The database session.
+
+    Returns:
+        dict: Latency percentiles in seconds, fee percentiles and totals in wei, and the fee per anchored diagnosis.
+    """
+    return anchor_metrics(db, limit)
@@ -1,22 +1,31 @@
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.background import BackgroundTasks
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, joinedload, selectinload
 from dependencies.auth import RoleChecker
+from dependencies.env import DOCTOR_DASHBOARD_PENDING_LIMIT, DOCTOR_DASHBOARD_TTL, REVIEW_CLAIM_LEASE_SECONDS
 from dependencies.get_db import get_db
 import models
 from schemas.auth_schemas import User as AuthUser
-from schemas.consultation_doctor_schemas import Consultation, ConsultationDetailed, ConsultationListElement, BlockchainDiagnosisRequest, DoctorNoteUpdate, PatientInfo
+from schemas.consultation_doctor_schemas import Consultation, ConsultationDetailed, ConsultationListElement, ConsultationClaim, DoctorNoteUpdate, PatientInfo, DashboardAppointment, DoctorDashboard
 from typing import List
 
-from services.blockchain_consultation_service import add_diagnosis
+from services.availability_index import availability_index
+from services.blockchain_anchor_service import enqueue_diagnosis_anchor
+from services.chat_broker import chat_broker, message_event, etat_event
+from services.chat_history_cache import chat_history_cache, add_chat_messages
+from services.doctor_assignment import record_reviewed
 from services.llm_service import improve_doctor_note
+from services.ttl_cache import TTLCache
 
 router = APIRouter(prefix="/consultation-doctor", tags=["Consultation Doctor"])
 
 # Dependency to ensure the user is a doctor
 allow_doctor = RoleChecker([models.RoleUser.DOCTOR])
 
+# Dashboards per doctor id, kept DOCTOR_DASHBOARD_TTL seconds; the doctor's own state changes invalidate them
+dashboard_cache = TTLCache(DOCTOR_DASHBOARD_TTL)
+
 # Helper function to map sender_type to role
 def map_sender_to_role(sender_type: models.MessageSenderType) -> str:
     if sender_type == models.MessageSenderType.USER:
@@ -87,6 +96,256 @@ async def get_doctor_consultations_by_etat(
         )
     return consultations
 
+# Helper function to filter the consultations a doctor may open: assigned to them or claimed by them from the review queue
+def reviewable_by(doctor_id: int):
+    return or_(models.Consultation.doctor_id == doctor_id, models.Consultation.claimed_by == doctor_id)
+
+# Helper function to check the review queue lease before a doctor reviews a consultation:
+# an active claim must be theirs, and without one only the assigned doctor may review it
+def check_review_lease(consultation: models.Consultation, doctor_id: int) -> None:
+    claim_active = consultation.claimed_by is not None and consultation.claim_expires_at is not None \
+        and consultation.claim_expires_at > datetime.now()
+    if claim_active and consultation.claimed_by != doctor_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Consultation is claimed by another doctor"
+        )
+    if not claim_active and consultation.doctor_id != doctor_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Review claim expired, claim the consultation again from the review queue"
+        )
+
+# Helper function to lock a consultation before saving its review, checking again that it is still EN_ATTENTE
+# and reviewable by the doctor (another doctor may have claimed or reviewed it during the LLM call).
+# Returns the id of the doctor the consultation was assigned to before the review.
+def lock_for_review(db: Session, consultation: models.Consultation, doctor_id: int) -> int:
+    db.refresh(consultation, with_for_update=True)
+    if consultation.etat != models.EtatConsultation.EN_ATTENTE:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Consultation was reviewed in the meantime"
+        )
+    check_review_lease(consultation, doctor_id)
+    # The review takes the consultation out of the assigned doctor's pending consultations
+    previous_doctor_id = consultation.doctor_id
+    record_reviewed(db, previous_doctor_id)
+    # The reviewer becomes the consultation's doctor and the claim ends with the review.
+    # EN_ATTENTE consultations have no appointment yet (they are booked after RECONSULTATION), so none is reassigned.
+    consultation.doctor_id = doctor_id
+    consultation.claimed_by = None
+    consultation.claim_expires_at = None
+    return previous_doctor_id
+
+# Helper function to build the dashboard of a doctor with three small queries
+def build_doctor_dashboard(db: Session, doctor_id: int) -> DoctorDashboard:
+    # Step 1: Count consultations per etat with one grouped query on (doctor_id, etat, date)
+    counts = {etat: 0 for etat in models.EtatConsultation}
+    counts.update(
+        db.query(models.Consultation.etat, func.count()).filter(
+            models.Consultation.doctor_id == doctor_id
+        ).group_by(models.Consultation.etat).all()
+    )
+
+    # Step 2: Oldest EN_ATTENTE consultations, read in index order and stopped after the limit
+    oldest_pending = db.query(models.Consultation).filter(
+        models.Consultation.doctor_id == doctor_id,
+        models.Consultation.etat == models.EtatConsultation.EN_ATTENTE
+    ).order_by(models.Consultation.date.asc(), models.Consultation.id.asc()).limit(DOCTOR_DASHBOARD_PENDING_LIMIT).all()
+
+    # Step 3: Today's PLANIFIE appointments, one range scan on (doctor_id, dateAppointment, etat)
+    start = datetime.combine(date.today(), time(0, 0))
+    appointments = db.query(
+        models.Appointment.id,
+        models.Appointment.dateAppointment,
+        models.Appointment.consultation_id,
+        models.Appointment.patient_id,
+        models.User.name
+    ).join(
+        models.User, models.User.id == models.Appointment.patient_id
+    ).filter(
+        models.Appointment.doctor_id == doctor_id,
+        models.Appointment.dateAppointment >= start,
+        models.Appointment.dateAppointment < start + timedelta(days=1),
+        models.Appointment.etat == models.EtatAppointment.PLANIFIE
+    ).order_by(models.Appointment.dateAppointment.asc()).all()
+
+    return DoctorDashboard(
+        counts=counts,
+        oldest_pending=[ConsultationListElement.model_validate(consultation) for consultation in oldest_pending],
+        today_appointments=[
+            DashboardAppointment(
+                id=appointment_id,
+                dateAppointment=date_appointment,
+                consultation_id=consultation_id,
+                patient_id=patient_id,
+                patient_name=patient_name
+            )
+            for appointment_id, date_appointment, consultation_id, patient_id, patient_name in appointments
+        ],
+        generated_at=datetime.now()
+    )
+
+@router.get("/dashboard", response_model=DoctorDashboard)
+async def get_doctor_dashboard(
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve what the doctor's home screen shows, in one call: the number of consultations per etat,
+    the oldest EN_ATTENTE consultations (at most DOCTOR_DASHBOARD_PENDING_LIMIT) and today's PLANIFIE appointments.
+    
+    Args:
+        current_user: The authenticated doctor (via dependency).
+        db: The database session (via dependency).
+    
+    Returns:
+        A DoctorDashboard, possibly up to DOCTOR_DASHBOARD_TTL seconds old (see generated_at).
+    """
+    return dashboard_cache.get_or_load(current_user.id, lambda: build_doctor_dashboard(db, current_user.id))
+
+@router.get("/availability-index/stats")
+async def get_availability_index_stats(
+    check: bool = False,
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the counters of this worker's appointment availability index.
+    
+    Args:
+        check: Also compare every cached day with the database (mismatches are logged and dropped from the index).
+        current_user: The authenticated doctor (via dependency).
+        db: The database session (via dependency).
+    
+    Returns:
+        The index counters, and the result of the consistency check when requested.
+    """
+    stats = {}
+    if check:
+        stats["consistency_check"] = availability_index.check_consistency(db)
+    stats.update(availability_index.stats())
+    return stats
+
+@router.post("/queue/claim", response_model=ConsultationClaim)
+async def claim_next_consultation(
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    """
+    Claim the oldest EN_ATTENTE consultation that no doctor is reviewing, for REVIEW_CLAIM_LEASE_SECONDS.
+
+    The candidate row is locked with SELECT ... FOR UPDATE SKIP LOCKED: concurrent claimers skip the rows
+    being claimed instead of waiting for them, so claims never block each other and never get the same consultation.
+    Consultations whose lease expired are claimable again.
+    
+    Args:
+        current_user: The authenticated doctor (via dependency).
+        db: The database session (via dependency).
+    
+    Returns:
+        The claimed consultation and the expiry of the lease.
+    
+    Raises:
+        HTTPException: If no consultation is waiting for review.
+    """
+    now = datetime.now()
+    consultation = db.query(models.Consultation).filter(
+        models.Consultation.etat == models.EtatConsultation.EN_ATTENTE,
+        or_(models.Consultation.claim_expires_at.is_(None), models.Consultation.claim_expires_at <= now)
+    ).order_by(
+        models.Consultation.date.asc(), models.Consultation.id.asc()
+    ).limit(1).with_for_update(skip_locked=True).first()
+    if not consultation:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No consultation waiting for review"
+        )
+
+    consultation.claimed_by = current_user.id
+    consultation.claim_expires_at = now + timedelta(seconds=REVIEW_CLAIM_LEASE_SECONDS)
+    db.commit()
+    db.refresh(consultation)
+
+    return ConsultationClaim(
+        consultation=ConsultationListElement.model_validate(consultation),
+        claim_expires_at=consultation.claim_expires_at
+    )
+
+@router.post("/queue/{consultation_id}/renew", response_model=ConsultationClaim)
+async def renew_consultation_claim(
+    consultation_id: int,
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    """
+    Extend the lease of a consultation claimed by the authenticated doctor by REVIEW_CLAIM_LEASE_SECONDS.
+    
+    Raises:
+        HTTPException: If the doctor does not hold an active claim on the consultation.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=REVIEW_CLAIM_LEASE_SECONDS)
+    # Conditional update: only the holder of an unexpired claim can extend it
+    renewed = db.query(models.Consultation).filter(
+        models.Consultation.id == consultation_id,
+        models.Consultation.etat == models.EtatConsultation.EN_ATTENTE,
+        models.Consultation.claimed_by == current_user.id,
+        models.Consultation.claim_expires_at > now
+    ).update({models.Consultation.claim_expires_at: expires_at}, synchronize_session=False)
+    db.commit()
+    if not renewed:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="No active claim on this consultation, claim it again from the review queue"
+        )
+
+    consultation = db.query(models.Consultation).filter(models.Consultation.id == consultation_id).first()
+    return ConsultationClaim(
+        consultation=ConsultationListElement.model_validate(consultation),
+        claim_expires_at=consultation.claim_expires_at
+    )
+
+@router.post("/queue/{consultation_id}/release", response_model=ConsultationListElement)
+async def release_consultation_claim(
+    consultation_id: int,
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    """
+    Give a claimed consultation back to the review queue without reviewing it.
+    
+    Raises:
+        HTTPException: If the consultation is not claimed by the authenticated doctor.
+    """
+    released = db.query(models.Consultation).filter(
+        models.Consultation.id == consultation_id,
+        models.Consultation.claimed_by == current_user.id
+    ).update({models.Consultation.claimed_by: None, models.Consultation.claim_expires_at: None}, synchronize_session=False)
+    db.commit()
+    if not released:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Consultation is not claimed by this doctor"
+        )
+
+    return db.query(models.Consultation).filter(models.Consultation.id == consultation_id).first()
+
+# Helper function to load a consultation with everything the detail view shows.
+# The patient and user (many-to-one) are joined; each collection is loaded by its own SELECT ... WHERE consultation_id IN (...),
+# joining three collections in one SELECT would return messages x symptoms x hypotheses rows.
+def load_consultation_detail(db: Session, consultation_id: int, doctor_id: int) -> models.Consultation:
+    return db.query(models.Consultation).options(
+        joinedload(models.Consultation.patient).joinedload(models.Patient.user),
+        selectinload(models.Consultation.symptoms),
+        selectinload(models.Consultation.hypotheses),
+        selectinload(models.Consultation.chat_messages)
+    ).filter(
+        models.Consultation.id == consultation_id,
+        reviewable_by(doctor_id)
+    ).first()
+
 @router.get("/consultations/{consultation_id}", response_model=ConsultationDetailed)
 async def get_consultation_by_id(
     consultation_id: int,
@@ -107,15 +366,7 @@ async def get_consultation_by_id(
     Raises:
         HTTPException: If the consultation is not found or not authorized.
     """
-    consultation = db.query(models.Consultation).options(
-        joinedload(models.Consultation.patient).joinedload(models.Patient.user),
-        joinedload(models.Consultation.symptoms),
-        joinedload(models.Consultation.hypotheses),
-        joinedload(models.Consultation.chat_messages)
-    ).filter(
-        models.Consultation.id == consultation_id,
-        models.Consultation.doctor_id == current_user.id
-    ).first()
+    consultation = load_consultation_detail(db, consultation_id, current_user.id)
 
     if not consultation:
         raise HTTPException(
@@ -154,48 +405,23 @@ async def get_consultation_by_id(
 
     return consultation_detailed
 
-async def add_diagnosis_to_blockchain(diagnosis_data: BlockchainDiagnosisRequest, db: Session):
-    """
-    Adds a diagnosis to the blockchain and handles errors with database rollback.
-    
-    Args:
-        diagnosis_data: The diagnosis data to add to the blockchain.
-        db: The database session for rollback in case of failure.
-    
-    Raises:
-        HTTPException: If the blockchain transaction fails.
-    """
-    try:
-        result = add_diagnosis(diagnosis_data)
-        if result["status"] == 0:
-            db.rollback()
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Diagnosis could not be added to the blockchain: Transaction failed"
-            )
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to add diagnosis to blockchain: {str(e)}"
-        )
-
 @router.post("/consultations/{consultation_id}/validate", response_model=Consultation)
 async def validate_consultation(
     consultation_id: int,
     note_data: DoctorNoteUpdate,
-    background_tasks: BackgroundTasks,
     current_user: AuthUser = Depends(allow_doctor),
     db: Session = Depends(get_db)
 ):
     """
     Validate a consultation by setting etat to VALIDE, updating the doctor_note,
-    adding the doctor_note to the chat history with role=DOCTOR, and adding the diagnosis to the blockchain.
+    adding the doctor_note to the chat history with role=DOCTOR, and queuing the diagnosis for the blockchain.
+    The diagnosis is written to the blockchain outbox in the same transaction and anchored by the worker.
+    The doctor must hold the review queue claim, or be the assigned doctor when no claim is active.
     """
     # Fetch consultation
     consultation = db.query(models.Consultation).filter(
         models.Consultation.id == consultation_id,
-        models.Consultation.doctor_id == current_user.id
+        reviewable_by(current_user.id)
     ).first()
     if not consultation:
         raise HTTPException(
@@ -209,6 +435,7 @@ async def validate_consultation(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Consultation must be in EN_ATTENTE state to be validated"
         )
+    check_review_lease(consultation, current_user.id)
 
     # Fetch the full chat history
     chat_history_db = consultation.chat_messages
@@ -240,40 +467,36 @@ async def validate_consultation(
             )
 
     # Update consultation
+    previous_doctor_id = lock_for_review(db, consultation, current_user.id)
     consultation.etat = models.EtatConsultation.VALIDE
     consultation.doctor_note = note_data.doctor_note
     consultation.diagnosis = improved_note or consultation.diagnosis
 
     # Add doctor_note to chat history as a ChatMessage with role=DOCTOR
+    doctor_message = None
     if note_data.doctor_note and note_data.doctor_note.strip():
         doctor_message = models.ChatMessage(
             consultation_id=consultation_id,
             content=improved_note,
             sender_type=models.MessageSenderType.DOCTOR
         )
-        db.add(doctor_message)
+        add_chat_messages(db, consultation_id, doctor_message)
+
+    # Queue the diagnosis for the blockchain in the same transaction as the state change
+    enqueue_diagnosis_anchor(db, consultation)
 
     db.add(consultation)
     db.commit()
     db.refresh(consultation)
+    chat_history_cache.invalidate(consultation_id)
+    # The consultation left the EN_ATTENTE list of its previous doctor, and may now belong to the reviewer
+    dashboard_cache.invalidate(current_user.id)
+    dashboard_cache.invalidate(previous_doctor_id)
 
-    # Construct BlockchainDiagnosisRequest for blockchain
-    hypotheses = consultation.hypotheses or []
-    diagnosis_data = BlockchainDiagnosisRequest(
-        diagnosis_id=consultation.id,
-        patient_id=consultation.patient_id,
-        doctor_id=consultation.doctor_id,
-        doctor_diagnosis=consultation.diagnosis or "",
-        condition1=hypotheses[0].condition if len(hypotheses) > 0 else "",
-        confidence1=hypotheses[0].confidence if len(hypotheses) > 0 else 0,
-        condition2=hypotheses[1].condition if len(hypotheses) > 1 else "",
-        confidence2=hypotheses[1].confidence if len(hypotheses) > 1 else 0,
-        condition3=hypotheses[2].condition if len(hypotheses) > 2 else "",
-        confidence3=hypotheses[2].confidence if len(hypotheses) > 2 else 0
-    )
-
-    # Schedule blockchain operation
-    background_tasks.add_task(add_diagnosis_to_blockchain, diagnosis_data, db)
+    # Push the doctor message and the new state to the patient's open chat sockets
+    if doctor_message is not None:
+        chat_broker.publish(consultation_id, message_event(doctor_message))
+    chat_broker.publish(consultation_id, etat_event(consultation.etat))
 
     return consultation
 
@@ -281,18 +504,19 @@ async def validate_consultation(
 async def mark_reconsultation(
     consultation_id: int,
     note_data: DoctorNoteUpdate,
-    background_tasks: BackgroundTasks,
     current_user: AuthUser = Depends(allow_doctor),
     db: Session = Depends(get_db)
 ):
     """
     Mark a consultation for reconsultation by setting etat to RECONSULTATION, updating the doctor_note,
-    adding the doctor_note to the chat history with role=DOCTOR, and adding the diagnosis to the blockchain.
+    adding the doctor_note to the chat history with role=DOCTOR, and queuing the diagnosis for the blockchain.
+    The diagnosis is written to the blockchain outbox in the same transaction and anchored by the worker.
+    The doctor must hold the review queue claim, or be the assigned doctor when no claim is active.
     """
     # Fetch consultation
     consultation = db.query(models.Consultation).filter(
         models.Consultation.id == consultation_id,
-        models.Consultation.doctor_id == current_user.id
+        reviewable_by(current_user.id)
     ).first()
     if not consultation:
         raise HTTPException(
@@ -306,6 +530,7 @@ async def mark_reconsultation(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Consultation must be in EN_ATTENTE state to be marked for reconsultation"
         )
+    check_review_lease(consultation, current_user.id)
 
     # Fetch the full chat history
     chat_history_db = consultation.chat_messages
@@ -337,39 +562,35 @@ async def mark_reconsultation(
             )
 
     # Update consultation
+    previous_doctor_id = lock_for_review(db, consultation, current_user.id)
     consultation.etat = models.EtatConsultation.RECONSULTATION
     consultation.doctor_note = note_data.doctor_note
     consultation.diagnosis = improved_note or consultation.diagnosis
 
     # Add doctor_note to chat history as a ChatMessage with role=DOCTOR
+    doctor_message = None
     if note_data.doctor_note and note_data.doctor_note.strip():
         doctor_message = models.ChatMessage(
             consultation_id=consultation_id,
             content=improved_note,
             sender_type=models.MessageSenderType.DOCTOR
         )
-        db.add(doctor_message)
+        add_chat_messages(db, consultation_id, doctor_message)
+
+    # Queue the diagnosis for the blockchain in the same transaction as the state change
+    enqueue_diagnosis_anchor(db, consultation)
 
     db.add(consultation)
     db.commit()
     db.refresh(consultation)
-
-    # Construct BlockchainDiagnosisRequest for blockchain
-    hypotheses = consultation.hypotheses or []
-    diagnosis_data = BlockchainDiagnosisRequest(
-        diagnosis_id=consultation.id,
-        patient_id=consultation.patient_id,
-        doctor_id=consultation.doctor_id,
-        doctor_diagnosis=consultation.diagnosis or "",
-        condition1=hypotheses[0].condition if len(hypotheses) > 0 else "",
-        confidence1=hypotheses[0].confidence if len(hypotheses) > 0 else 0,
-        condition2=hypotheses[1].condition if len(hypotheses) > 1 else "",
-        confidence2=hypotheses[1].confidence if len(hypotheses) > 1 else 0,
-        condition3=hypotheses[2].condition if len(hypotheses) > 2 else "",
-        confidence3=hypotheses[2].confidence if len(hypotheses) > 2 else 0
-    )
-
-    # Schedule blockchain operation
-    background_tasks.add_task(add_diagnosis_to_blockchain, diagnosis_data, db)
+    chat_history_cache.invalidate(consultation_id)
+    # The consultation left the EN_ATTENTE list of its previous doctor, and may now belong to the reviewer
+    dashboard_cache.invalidate(current_user.id)
+    dashboard_cache.invalidate(previous_doctor_id)
+
+    # Push the doctor message and the new state to the patient's open chat sockets
+    if doctor_message is not None:
+        chat_broker.publish(consultation_id, message_event(doctor_message))
+    chat_broker.publish(consultation_id, etat_event(consultation.etat))
 
     return consultation
\ No newline at end of file
@@ -1,17 +1,26 @@
+import asyncio
+import json
 from datetime import datetime, timedelta, time
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, not_
-from dependencies.auth import RoleChecker
+from sqlalchemy import not_
+from sqlalchemy.exc import IntegrityError
+from dependencies.auth import RoleChecker, get_user_from_token
+from dependencies.database import SessionLocal
+from dependencies.env import AVAILABILITY_CALENDAR_MAX_DAYS, NEXT_SLOTS_MAX_COUNT, NEXT_SLOTS_HORIZON_DAYS, CHAT_WS_IDLE_TIMEOUT
 from dependencies.get_db import get_db
 import models
 from schemas.auth_schemas import User as AuthUser
-from schemas.consultation_patient_schemas import Appointment, AppointmentCreate, Consultation, ConsultationListElement, ConsultationCreate, ChatMessageCreate, ChatMessage, TimeSlot, UnavailableTimesRequest, UnavailableTimesResponse
-from typing import List
+from schemas.consultation_patient_schemas import Appointment, AppointmentCreate, Consultation, ConsultationListElement, ConsultationCreate, ChatMessageCreate, ChatMessage, TimeSlot, UnavailableTimesRequest, UnavailableTimesResponse, AvailabilityCalendarRequest, AvailabilityCalendarResponse, DayAvailability, NextAvailableSlotsResponse
+from typing import List, Optional
 
 from schemas.llm_service_schemas import ChatRequest
-from services.blockchain_consultation_service import get_diagnosis
-from services.llm_service import chat_with_model, process_chat_history
+from services.availability_index import availability_index, appointment_slot_key
+from services.chat_broker import chat_broker, etat_event
+from services.chat_history_cache import chat_history_cache, add_chat_messages, load_chat_history
+from services.doctor_assignment import doctor_assigner, record_pending
+from services.integrity_service import verify_consultation_async
+from services.llm_service import chat_with_model, chat_with_model_stream, process_chat_history
 
 router = APIRouter(prefix="/consultation-patient", tags=["Consultation Patient"])
 
@@ -20,12 +29,15 @@ allow_patient = RoleChecker([models.RoleUser.PATIENT])
 allow_doctor = RoleChecker([models.RoleUser.DOCTOR])
 allow_both = RoleChecker([models.RoleUser.PATIENT, models.RoleUser.DOCTOR])
 
-# Helper function to get the single doctor (assuming only one doctor exists)
-def get_single_doctor(db: Session) -> models.Doctor:
-    doctor = db.query(models.Doctor).first()
-    if not doctor:
-        raise HTTPException(status_code=404, detail="No doctor found in the system")
-    return doctor
+# Helper function to get the doctor whose availability is requested: the given one, or the default doctor
+def get_requested_doctor_id(db: Session, doctor_id: Optional[int]) -> int:
+    if doctor_id is None:
+        doctor_id = doctor_assigner.default_doctor_id(db)
+        if doctor_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No doctor found in the system")
+    elif doctor_id not in doctor_assigner.doctor_ids(db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor not found")
+    return doctor_id
 
 @router.post("/", response_model=Consultation)
 async def create_consultation(
@@ -46,7 +58,7 @@ async def create_consultation(
         The existing or newly created Consultation object.
     
     Raises:
-        HTTPException: If the patient or doctor is not found.
+        HTTPException: If the patient is not found, or there is no doctor to assign.
     """
     # Get patient from the current user
     patient = db.query(models.Patient).filter(models.Patient.id == current_user.id).first()
@@ -68,13 +80,15 @@ async def create_consultation(
     if existing_consultation:
         return existing_consultation
 
-    # Get the single doctor
-    doctor = get_single_doctor(db)
+    # Choose the doctor with the configured assignment strategy
+    doctor_id = doctor_assigner.assign(db)
+    if doctor_id is None:
+        raise HTTPException(status_code=404, detail="No doctor found in the system")
 
     # Create a new consultation
     new_consultation = models.Consultation(
         etat=models.EtatConsultation.EN_COURS,  # En cours de consultation
-        doctor_id=doctor.id,
+        doctor_id=doctor_id,
         patient_id=patient.id,
         diagnosis=consultation_data.diagnosis,
         chat_summary=consultation_data.chat_summary,
@@ -140,10 +154,8 @@ async def get_all_patient_appointments(
     Raises:
         HTTPException: If no appointments are found.
     """
-    appointments = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
-        models.Consultation.patient_id == current_user.id
+    appointments = db.query(models.Appointment).filter(
+        models.Appointment.patient_id == current_user.id
     ).all()
     if not appointments:
         raise HTTPException(status_code=404, detail="No appointments found")
@@ -230,27 +242,60 @@ async def get_all_consultations_by_etat(
         raise HTTPException(status_code=404, detail=f"No consultations found with etat '{etat.value}'")
     return consultations
 
+# Helper function to compare an If-None-Match header with an ETag (weak comparison, several tags or *)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
 @router.get("/{consultation_id}/chat-history", response_model=List[ChatMessage])
 async def get_consultation_chat_history(
     consultation_id: int,
+    response: Response,
+    since_id: Optional[int] = Query(None, ge=0, description="Only return messages with a greater id (the last id the client has)"),
+    if_none_match: Optional[str] = Header(None),
     current_user: AuthUser = Depends(allow_patient),
     db: Session = Depends(get_db)
 ):
     """
     Retrieve the chat history for a specific consultation.
+
+    Messages are never modified, so the sequence number of the last message identifies the state of the history:
+    it is sent as the ETag, and a request whose If-None-Match matches it gets 304 without reading any message.
+    
+    Args:
+        consultation_id: The ID of the consultation.
+        since_id: Optional cursor, only messages with a greater id are returned.
+        if_none_match: ETag of the history the client already has.
+    
+    Returns:
+        The messages in chronological order, or an empty 304 response if nothing changed.
+    
+    Raises:
+        HTTPException: If the consultation is not found or does not belong to the patient.
     """
-    # Verify the consultation exists and belongs to the patient
-    consultation = db.query(models.Consultation).filter(
+    # Verify the consultation exists and belongs to the patient, and get its last message sequence number
+    consultation = db.query(models.Consultation.last_chat_seq).filter(
         models.Consultation.id == consultation_id,
         models.Consultation.patient_id == current_user.id
-    ).one()
+    ).first()
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
 
-    # Fetch all chat messages for the consultation
-    chat_history = db.query(models.ChatMessage).filter(
+    etag = f'W/"chat-{consultation_id}-{consultation.last_chat_seq}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+    # Fetch the chat messages for the consultation, after the cursor if given
+    query = db.query(models.ChatMessage).filter(
         models.ChatMessage.consultation_id == consultation_id
-    ).order_by(models.ChatMessage.timestamp.asc()).all()
+    )
+    if since_id is not None:
+        query = query.filter(models.ChatMessage.id > since_id)
+    chat_history = query.order_by(models.ChatMessage.seq.asc()).all()
 
     if not chat_history:
         return []  # Return an empty list if no messages exist
@@ -323,16 +368,8 @@ async def send_message_to_consultation(
         sender_type=models.MessageSenderType.USER
     )
 
-    # Step 4: Fetch the full chat history
-    chat_history_db = db.query(models.ChatMessage).filter(
-        models.ChatMessage.consultation_id == consultation_id
-    ).order_by(models.ChatMessage.timestamp.asc()).all()
-
-    # Convert to list of dictionaries with {"role": "user"/"assistant", "content": message}
-    chat_history = [
-        {"role": map_sender_to_role(msg.sender_type), "content": msg.content}
-        for msg in chat_history_db
-    ]
+    # Step 4: Get the chat history as {"role": "user"/"assistant", "content": message} dictionaries (cached while EN_COURS)
+    chat_history = chat_history_cache.history(db, consultation_id)
 
     # Append the user’s new message to the chat history for LLM
     chat_history.append(user_message_dict)
@@ -355,15 +392,183 @@ async def send_message_to_consultation(
     )
 
     # Step 7: Save both messages to the database only after successful LLM response
-    db.add(user_message_db)
-    db.add(assistant_message_db)
+    add_chat_messages(db, consultation_id, user_message_db, assistant_message_db)
     db.commit()
     db.refresh(user_message_db)
     db.refresh(assistant_message_db)
+    chat_history_cache.append(consultation_id, user_message_dict, assistant_message_dict)
 
     # Step 8: Return the LLM’s response
     return llm_response
 
+def load_chat_context(token: str, consultation_id: int):
+    """
+    Authenticates a chat WebSocket and loads its consultation context.
+
+    Returns:
+        (patient id, etat, chat history as LLM messages), or None if the token is invalid, the user is
+        disabled or the consultation does not belong to the patient.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            user = get_user_from_token(token, db)
+        except HTTPException:
+            return None
+        # Same checks as allow_patient (get_current_active_user) on the HTTP endpoints
+        if user.disabled or user.role != models.RoleUser.PATIENT:
+            return None
+        consultation = db.query(models.Consultation).filter(
+            models.Consultation.id == consultation_id,
+            models.Consultation.patient_id == user.id
+        ).first()
+        if not consultation:
+            return None
+        if consultation.etat == models.EtatConsultation.EN_COURS:
+            chat_history = chat_history_cache.history(db, consultation_id)
+        else:
+            chat_history = load_chat_history(db, consultation_id)
+        return user.id, consultation.etat, chat_history
+    finally:
+        db.close()
+
+def is_user_active(user_id: int) -> bool:
+    """Whether the user still exists and is not disabled, re-checked on each message of a chat WebSocket"""
+    db = SessionLocal()
+    try:
+        disabled = db.query(models.User.disabled).filter(models.User.id == user_id).scalar()
+        return disabled is False
+    finally:
+        db.close()
+
+def save_chat_turn(consultation_id: int, message: str, llm_response: str) -> None:
+    """Saves a user message and the LLM response, as the HTTP chat endpoint does"""
+    db = SessionLocal()
+    try:
+        add_chat_messages(
+            db,
+            consultation_id,
+            models.ChatMessage(consultation_id=consultation_id, content=message, sender_type=models.MessageSenderType.USER),
+            models.ChatMessage(consultation_id=consultation_id, content=llm_response, sender_type=models.MessageSenderType.ASSISTANT)
+        )
+        db.commit()
+    finally:
+        db.close()
+    chat_history_cache.append(
+        consultation_id,
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": llm_response}
+    )
+
+@router.websocket("/{consultation_id}/chat/ws")
+async def consultation_chat_socket(
+    websocket: WebSocket,
+    consultation_id: int,
+    token: str = Query(...)
+):
+    """
+    Consultation chat over a WebSocket, the connection-long equivalent of POST /{consultation_id}/chat.
+
+    The access token (query parameter, browsers cannot set headers on WebSockets), the patient's ownership
+    of the consultation and the chat history are checked and loaded once, when connecting.
+    The history is then kept in memory for the life of the connection. Whether the account is disabled is
+    checked again before each message, so disabling a patient also ends their open sockets.
+
+    Client messages: {"message": "..."}, accepted while the consultation is EN_COURS.
+    Server messages:
+        {"type": "token", "content": "..."}: a piece of the assistant response, while it is generated
+        {"type": "done", "content": "..."}: the full response, sent once both messages are saved
+        {"type": "message", "sender_type": "DOCTOR", ...}: a doctor message, pushed when the doctor posts it
+        {"type": "etat", "etat": "..."}: the consultation changed state
+        {"type": "error", "detail": "..."}: the message was rejected or the LLM failed, nothing was saved
+
+    Closes with code 1008 when authentication or authorization fails or the account is disabled,
+    and after CHAT_WS_IDLE_TIMEOUT seconds without a client message.
+    """
+    # Step 1: Authenticate and load the consultation context once
+    context = await asyncio.to_thread(load_chat_context, token, consultation_id)
+    if context is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    patient_id, etat, chat_history = context
+    await websocket.accept()
+
+    # Step 2: Forward doctor messages and state changes while the socket is open
+    events = chat_broker.subscribe(consultation_id)
+    send_lock = asyncio.Lock()
+
+    async def send(payload: dict) -> None:
+        async with send_lock:
+            await websocket.send_json(payload)
+
+    async def forward_events() -> None:
+        nonlocal etat
+        while True:
+            event = await events.get()
+            if event["type"] == "etat":
+                etat = models.EtatConsultation(event["etat"])
+            elif event["type"] == "message":
+                chat_history.append({
+                    "role": map_sender_to_role(models.MessageSenderType(event["sender_type"])),
+                    "content": event["content"]
+                })
+            await send(event)
+
+    forwarder = asyncio.create_task(forward_events())
+    try:
+        while True:
+            # Step 3: Wait for the next user message
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=CHAT_WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await websocket.close()
+                return
+            try:
+                message = json.loads(raw).get("message")
+            except (ValueError, AttributeError):
+                message = None
+            if not isinstance(message, str) or not message.strip():
+                await send({"type": "error", "detail": "Expected a JSON object with a non-empty 'message'"})
+                continue
+            if not await asyncio.to_thread(is_user_active, patient_id):
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                return
+            if etat != models.EtatConsultation.EN_COURS:
+                await send({"type": "error", "detail": "Consultation must be in EN_COURS state to send messages"})
+                continue
+
+            # Step 4: Stream the LLM response, reading the HTTP stream in a worker thread
+            tokens = chat_with_model_stream(chat_history + [{"role": "user", "content": message}])
+            pieces = []
+            try:
+                while True:
+                    try:
+                        piece = await asyncio.to_thread(next, tokens, None)
+                    except Exception as e:
+                        await send({"type": "error", "detail": f"Error communicating with LLM: {str(e)}"})
+                        pieces = None
+                        break
+                    if piece is None:
+                        break
+                    pieces.append(piece)
+                    await send({"type": "token", "content": piece})
+            finally:
+                tokens.close()
+            if pieces is None:
+                continue
+
+            # Step 5: Save both messages only after a complete response, then update the in-memory history
+            llm_response = "".join(pieces)
+            await asyncio.to_thread(save_chat_turn, consultation_id, message, llm_response)
+            chat_history.append({"role": "user", "content": message})
+            chat_history.append({"role": "assistant", "content": llm_response})
+            await send({"type": "done", "content": llm_response})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        forwarder.cancel()
+        chat_broker.unsubscribe(consultation_id, events)
+
 @router.post("/{consultation_id}/finish", response_model=Consultation)
 async def finish_consultation_chat(
     consultation_id: int,
@@ -384,7 +589,7 @@ async def finish_consultation_chat(
     
     Raises:
         HTTPException: If the consultation is not found, user is not authorized,
-                       consultation is not in EN_COURS state,
+                       consultation is not in EN_COURS state (or was finished during the LLM call),
                        or if there’s an error communicating with the LLM.
     """
     # Step 1: Verify the consultation exists and belongs to the patient
@@ -405,22 +610,14 @@ async def finish_consultation_chat(
             detail="Consultation cannot be finished; it is not in EN_COURS state"
         )
 
-    # Step 3: Fetch the full chat history
-    chat_history_db = db.query(models.ChatMessage).filter(
-        models.ChatMessage.consultation_id == consultation_id
-    ).order_by(models.ChatMessage.timestamp.asc()).all()
-    if not chat_history_db:
+    # Step 3: Get the full chat history as dictionaries for LLM
+    chat_history = chat_history_cache.history(db, consultation_id)
+    if not chat_history:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No chat history found for this consultation"
         )
 
-    # Convert to list of dictionaries for LLM
-    chat_history = [
-        {"role": map_sender_to_role(msg.sender_type), "content": msg.content}
-        for msg in chat_history_db
-    ]
-
     # Step 4: Call the combined LLM service and handle response
     try:
         # Call the combined method to get symptoms, conditions, and summary
@@ -436,10 +633,6 @@ async def finish_consultation_chat(
         )
 
     # Step 5: Prepare database updates in memory
-    # Update consultation with chat summary and set etat to EN_ATTENTE
-    consultation.chat_summary = chat_summary
-    consultation.etat = models.EtatConsultation.EN_ATTENTE
-
     # Create Symptom objects
     symptom_objects = [
         models.Symptoms(
@@ -460,7 +653,19 @@ async def finish_consultation_chat(
         for condition in conditions
     ]
 
-    # Step 6: Save all changes to the database only after successful LLM response
+    # Step 6: Save all changes to the database only after successful LLM response,
+    # checking again under a row lock that the chat was not finished by another request during the LLM call
+    db.refresh(consultation, with_for_update=True)
+    if consultation.etat != models.EtatConsultation.EN_COURS:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Consultation was finished in the meantime"
+        )
+    # Update consultation with chat summary and set etat to EN_ATTENTE, counted in the doctor's pending consultations
+    consultation.chat_summary = chat_summary
+    consultation.etat = models.EtatConsultation.EN_ATTENTE
+    record_pending(db, consultation.doctor_id)
     for symptom_obj in symptom_objects:
         db.add(symptom_obj)
     for condition_obj in condition_objects:
@@ -470,6 +675,8 @@ async def finish_consultation_chat(
 
     # Refresh the consultation to include updated relationships
     db.refresh(consultation)
+    chat_history_cache.invalidate(consultation_id)
+    chat_broker.publish(consultation_id, etat_event(consultation.etat))
 
     # Step 7: Return the updated consultation
     return consultation
@@ -540,20 +747,8 @@ async def add_appointment(
             detail="Appointment time must be at the start of an hour (e.g., 9:00, 10:00)"
         )
 
-    # Step 5: Check for scheduling conflicts
-    appointment_end = appointment_time + timedelta(hours=1)
-    conflicting_appointments = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
-        models.Consultation.doctor_id == consultation.doctor_id,
-        models.Appointment.etat != models.EtatAppointment.ANNULE,
-        and_(
-            models.Appointment.dateAppointment < appointment_end,
-            models.Appointment.dateAppointment >= appointment_time
-        )
-    ).all()
-
-    if conflicting_appointments:
+    # Step 5: Reject known scheduling conflicts early (in-memory index of the doctor's booked hours)
+    if availability_index.is_booked(db, consultation.doctor_id, appointment_time):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="The selected time slot is unavailable due to a scheduling conflict"
@@ -564,13 +759,26 @@ async def add_appointment(
         dateCreation=datetime.utcnow(),
         dateAppointment=appointment_time,
         etat=models.EtatAppointment.PLANIFIE,
-        consultation_id=consultation_id
+        consultation_id=consultation_id,
+        doctor_id=consultation.doctor_id,
+        patient_id=consultation.patient_id,
+        slot_key=appointment_slot_key(consultation.doctor_id, appointment_time)
     )
 
-    # Step 7: Save to database
+    # Step 7: Save to database, the unique slot key rejects a concurrent booking of the same slot
     db.add(new_appointment)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Booked by another process: refresh the index for this day
+        availability_index.release(consultation.doctor_id, appointment_time)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The selected time slot is unavailable due to a scheduling conflict"
+        )
     db.refresh(new_appointment)
+    availability_index.book(consultation.doctor_id, appointment_time)
 
     # Step 8: Return the created appointment
     return new_appointment
@@ -586,6 +794,7 @@ async def change_appointment_time(
     """
     Change the time of an existing appointment if:
     - The appointment exists and belongs to the patient's consultation.
+    - The appointment is not cancelled (ANNULE).
     - The new dateAppointment is at the start of an hour (e.g., 9:00, 10:00).
     - The one-hour time slot is available for the doctor (no other PLANIFIE appointments).
     
@@ -599,21 +808,25 @@ async def change_appointment_time(
         The updated Appointment object.
     
     Raises:
-        HTTPException: If the appointment is not found, user is not authorized,
+        HTTPException: If the appointment is not found, user is not authorized, appointment is cancelled,
                        time is not at the start of an hour, or slot is unavailable.
     """
     # Step 1: Verify the appointment exists and belongs to the patient
-    appointment = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
+    appointment = db.query(models.Appointment).filter(
         models.Appointment.id == appointment_id,
-        models.Consultation.patient_id == current_user.id
+        models.Appointment.patient_id == current_user.id
     ).first()
     if not appointment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Appointment not found or not authorized"
         )
+    # A cancelled appointment holds no slot: book a new one instead
+    if appointment.etat == models.EtatAppointment.ANNULE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A cancelled appointment cannot be rescheduled"
+        )
 
     # Step 2: Validate hourly interval
     new_time = appointment_data.dateAppointment
@@ -623,33 +836,35 @@ async def change_appointment_time(
             detail="New appointment time must be at the start of an hour (e.g., 9:00, 10:00)"
         )
 
-    # Step 3: Check for scheduling conflicts
-    appointment_end = new_time + timedelta(hours=1)
-    conflicting_appointments = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
-        models.Consultation.doctor_id == appointment.consultation.doctor_id,
-        models.Appointment.etat == models.EtatAppointment.PLANIFIE,
-        models.Appointment.id != appointment_id,  # Exclude the current appointment
-        and_(
-            models.Appointment.dateAppointment < appointment_end,
-            models.Appointment.dateAppointment >= new_time
-        )
-    ).all()
-
-    if conflicting_appointments:
+    # Step 3: Check for scheduling conflicts (the appointment's own slot is not a conflict)
+    doctor_id = appointment.doctor_id
+    old_time = appointment.dateAppointment
+    same_slot = old_time.date() == new_time.date() and old_time.hour == new_time.hour
+    if not same_slot and availability_index.is_booked(db, doctor_id, new_time):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="The selected time slot is unavailable due to a scheduling conflict"
         )
 
-    # Step 4: Update the appointment time
+    # Step 4: Update the appointment time and the slot it holds
     appointment.dateAppointment = new_time
+    appointment.slot_key = appointment_slot_key(doctor_id, new_time)
 
-    # Step 5: Save to database
+    # Step 5: Save to database, the unique slot key rejects a concurrent booking of the same slot
     db.add(appointment)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Booked by another process: refresh the index for this day
+        availability_index.release(doctor_id, new_time)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The selected time slot is unavailable due to a scheduling conflict"
+        )
     db.refresh(appointment)
+    availability_index.release(doctor_id, old_time)
+    availability_index.book(doctor_id, new_time)
 
     # Step 6: Return the updated appointment
     return appointment
@@ -677,11 +892,9 @@ async def cancel_appointment(
                        or the appointment is already canceled.
     """
     # Step 1: Verify the appointment exists and belongs to the patient
-    appointment = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
+    appointment = db.query(models.Appointment).filter(
         models.Appointment.id == appointment_id,
-        models.Consultation.patient_id == current_user.id
+        models.Appointment.patient_id == current_user.id
     ).first()
     if not appointment:
         raise HTTPException(
@@ -696,18 +909,20 @@ async def cancel_appointment(
             detail="Appointment is already canceled"
         )
 
-    # Step 3: Update the appointment status
+    # Step 3: Update the appointment status and free its slot
     appointment.etat = models.EtatAppointment.ANNULE
+    appointment.slot_key = None
 
     # Step 4: Save to database
     db.add(appointment)
     db.commit()
     db.refresh(appointment)
+    availability_index.release(appointment.doctor_id, appointment.dateAppointment)
 
     # Step 5: Return the updated appointment
     return appointment
 
-# Updated get_unavailable_times endpoint (hourly intervals, single doctor)
+# Updated get_unavailable_times endpoint (hourly intervals)
 @router.post("/unavailable-times", response_model=UnavailableTimesResponse)
 async def get_unavailable_times(
     request: UnavailableTimesRequest,
@@ -715,11 +930,11 @@ async def get_unavailable_times(
     db: Session = Depends(get_db)
 ):
     """
-    Retrieve unavailable time slots for the single doctor on a given date.
+    Retrieve unavailable time slots of a doctor on a given date.
     Time slots are hourly (e.g., 9:00, 10:00).
     
     Args:
-        request: The request body containing the date.
+        request: The request body containing the date, and the doctor (defaults to the first doctor).
         current_user: The authenticated patient (via dependency).
         db: The database session (via dependency).
     
@@ -727,37 +942,119 @@ async def get_unavailable_times(
         A list of unavailable time slots (hourly intervals).
     
     Raises:
-        HTTPException: If no doctor is found in the system.
+        HTTPException: If the doctor is not found, or no doctor is found in the system.
+    """
+    # Get the requested doctor
+    doctor_id = get_requested_doctor_id(db, request.doctor_id)
+
+    # Collect unavailable time slots from the doctor's booked hours on the given date
+    start_date = datetime.combine(request.date, time(0, 0))
+    unavailable_times = [
+        TimeSlot(start_time=start_date + timedelta(hours=hour))
+        for hour in availability_index.booked_hours(db, doctor_id, request.date)
+    ]
+
+    return UnavailableTimesResponse(unavailable_times=unavailable_times)
+
+@router.get("/{consultation_id}/next-available-slots", response_model=NextAvailableSlotsResponse)
+async def get_next_available_slots(
+    consultation_id: int,
+    after: Optional[datetime] = None,
+    count: int = 5,
+    current_user: AuthUser = Depends(allow_patient),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the next free hourly slots of the consultation's doctor, within working hours.
+    
+    Args:
+        consultation_id: The ID of the consultation.
+        after: Earliest slot start (defaults to now).
+        count: Number of slots to return (at most NEXT_SLOTS_MAX_COUNT).
+        current_user: The authenticated patient (via dependency).
+        db: The database session (via dependency).
+    
+    Returns:
+        Up to count free time slots in chronological order, searched at most NEXT_SLOTS_HORIZON_DAYS ahead.
+    
+    Raises:
+        HTTPException: If count is out of range, or the consultation is not found or not authorized.
     """
-    # Get the single doctor
-    doctor = db.query(models.Doctor).first()
-    if not doctor:
+    # Step 1: Validate count
+    if count < 1 or count > NEXT_SLOTS_MAX_COUNT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"count must be between 1 and {NEXT_SLOTS_MAX_COUNT}"
+        )
+
+    # Step 2: Verify the consultation exists and belongs to the patient
+    consultation = db.query(models.Consultation).filter(
+        models.Consultation.id == consultation_id,
+        models.Consultation.patient_id == current_user.id
+    ).first()
+    if not consultation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="No doctor found in the system"
+            detail="Consultation not found or not authorized"
         )
 
-    # Get start and end of the requested date
-    start_date = datetime.combine(request.date, time(0, 0))
-    end_date = start_date + timedelta(days=1)
+    # Step 3: Search the gaps between the doctor's booked slots
+    start = after or datetime.now()
+    slots = availability_index.next_free_slots(db, consultation.doctor_id, start, count, NEXT_SLOTS_HORIZON_DAYS)
 
-    # Fetch all appointments for the doctor on the given date
-    appointments = db.query(models.Appointment).join(
-        models.Consultation, models.Appointment.consultation_id == models.Consultation.id
-    ).filter(
-        models.Consultation.doctor_id == doctor.id,
-        models.Appointment.etat != models.EtatAppointment.ANNULE,
-        models.Appointment.dateAppointment >= start_date,
-        models.Appointment.dateAppointment < end_date
-    ).all()
+    return NextAvailableSlotsResponse(slots=[TimeSlot(start_time=slot) for slot in slots])
 
-    # Collect unavailable time slots
-    unavailable_times = [
-        TimeSlot(start_time=appointment.dateAppointment)
-        for appointment in appointments
-    ]
+@router.post("/availability-calendar", response_model=AvailabilityCalendarResponse)
+async def get_availability_calendar(
+    request: AvailabilityCalendarRequest,
+    current_user: AuthUser = Depends(allow_patient),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the booked and free hourly slots of a doctor for each day from start to end (inclusive).
+    Free slots are the working hours (WORKING_HOURS_START to WORKING_HOURS_END on WORKING_DAYS) not booked.
+    
+    Args:
+        request: The request body containing the start and end dates, and the doctor (defaults to the first doctor).
+        current_user: The authenticated patient (via dependency).
+        db: The database session (via dependency).
+    
+    Returns:
+        The booked and free time slots of every day in the range.
+    
+    Raises:
+        HTTPException: If the range is invalid or longer than AVAILABILITY_CALENDAR_MAX_DAYS,
+                       or the doctor is not found.
+    """
+    # Step 1: Validate the range
+    if request.end < request.start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="End date must not be before start date"
+        )
+    if (request.end - request.start).days + 1 > AVAILABILITY_CALENDAR_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The range cannot exceed {AVAILABILITY_CALENDAR_MAX_DAYS} days"
+        )
 
-    return UnavailableTimesResponse(unavailable_times=unavailable_times)
+    # Step 2: Get the requested doctor
+    doctor_id = get_requested_doctor_id(db, request.doctor_id)
+
+    # Step 3: Booked hours of every day (one range scan for the days missing from the index)
+    bitmaps = availability_index.bitmaps(db, doctor_id, request.start, request.end)
+
+    # Step 4: Build the booked and free slots of each day
+    days = []
+    for day, bitmap in sorted(bitmaps.items()):
+        start_date = datetime.combine(day, time(0, 0))
+        days.append(DayAvailability(
+            date=day,
+            booked=[TimeSlot(start_time=start_date + timedelta(hours=hour)) for hour in range(24) if bitmap >> hour & 1],
+            free=[TimeSlot(start_time=start_date + timedelta(hours=hour)) for hour in availability_index.free_hours(day, bitmap)]
+        ))
+
+    return AvailabilityCalendarResponse(days=days)
 
 @router.get("/verify-integrity/{consultation_id}")
 async def verify_consultation_integrity(
@@ -778,24 +1075,8 @@ async def verify_consultation_integrity(
         if not hypotheses:
             raise HTTPException(status_code=400, detail="No hypotheses found")
 
-        # Fetch diagnosis from blockchain
-        blockchain_diagnosis = get_diagnosis(consultation_id)
-
-        # Compare data
-        is_valid = (
-            consultation.diagnosis == blockchain_diagnosis["doctor_diagnosis"] and
-            consultation.patient_id == blockchain_diagnosis["patient_id"] and
-            consultation.doctor_id == blockchain_diagnosis["doctor_id"]
-        )
-
-        # Compare hypotheses (up to 3)
-        for i, hypo in enumerate(hypotheses[:3]):
-            condition_field = f"condition{i+1}"
-            confidence_field = f"confidence{i+1}"
-            if (hypo.condition != blockchain_diagnosis[condition_field] or
-                hypo.confidence != blockchain_diagnosis[confidence_field]):
-                is_valid = False
-                break
+        # Compare with the blockchain (Merkle proof for batched anchors, diagnosis record otherwise)
+        is_valid = await verify_consultation_async(db, consultation)
 
         return {
             "message": "Integrity verification completed",
@@ -1,47 +1,61 @@
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from controllers.consultation_patient_controller import AuthUser
 from dependencies.get_db import get_db
 from dependencies.env import BCRYPT_SALT_ROUNDS
 from dependencies.auth import RoleChecker, bcrypt
 import models
 from schemas.doctor_schemas import Doctor, DoctorCreate, DoctorUpdate
+from services.doctor_assignment import doctor_assigner
+from services.reference_cache import DOCTORS, reference_cache
 from models import RoleUser
 
 router = APIRouter(prefix="/doctors", tags=["Doctors"])
 
 # Dependency to ensure the user is authenticated
 allow_both = RoleChecker([models.RoleUser.PATIENT, models.RoleUser.DOCTOR])
+allow_doctor = RoleChecker([models.RoleUser.DOCTOR])
+
+# Helper function to get the profile of a doctor from the reference data cache, in the JSON form of the Doctor schema
+def get_doctor_profile(db: Session, doctor_id: int) -> Optional[dict]:
+    def load() -> Optional[dict]:
+        doctor = db.query(models.Doctor).options(joinedload(models.Doctor.user)).filter(models.Doctor.id == doctor_id).first()
+        if doctor is None:
+            return None
+        user = doctor.user
+        return Doctor(
+            id=doctor.id,
+            email=user.email,
+            name=user.name,
+            role=user.role,
+            adress=user.adress,
+            birthdate=user.birthdate,
+            phoneNumber=user.phoneNumber,
+            description=doctor.description,
+            rating=doctor.rating
+        ).model_dump(mode="json")
+
+    return reference_cache.get_or_load(DOCTORS, doctor_id, load)
 
 @router.get("/single-doctor", response_model=Doctor)
 def get_single_doctor_endpoint(
     current_user: AuthUser = Depends(allow_both),
     db: Session = Depends(get_db)
 ):
-    doctor = db.query(models.Doctor).first()
+    doctor_id = doctor_assigner.default_doctor_id(db)
+    doctor = get_doctor_profile(db, doctor_id) if doctor_id is not None else None
     if not doctor:
         raise HTTPException(status_code=404, detail="No doctor found in the system")
-    
-    user = doctor.user
-    
-    return {
-        "id": doctor.id,
-        "email": user.email,
-        "name": user.name,
-        "role": user.role,
-        "adress": user.adress,
-        "birthdate": user.birthdate,
-        "phoneNumber": user.phoneNumber,
-        "description": doctor.description,
-        "rating": doctor.rating
-    }
+    return doctor
 
-@router.post("/single-doctor", response_model=Doctor)
-async def create_single_doctor(doctor: DoctorCreate, db: Session = Depends(get_db)):
-    # Check if any doctor already exists
-    if db.query(models.Doctor).first():
-        raise HTTPException(status_code=400, detail="A doctor already exists in the system")
+@router.get("/reference-cache/stats")
+def get_reference_cache_stats(current_user: AuthUser = Depends(allow_doctor)):
+    # Counters of this worker process
+    return reference_cache.stats()
 
+# Helper function to create a doctor account (user and doctor rows) and return it in the form of the Doctor schema
+def create_doctor_account(db: Session, doctor: DoctorCreate) -> dict:
     # Check if email already exists
     if db.query(models.User).filter(models.User.email == doctor.email).first():
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -76,6 +90,8 @@ async def create_single_doctor(doctor: DoctorCreate, db: Session = Depends(get_d
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    # New consultations may be assigned to the new doctor
+    reference_cache.invalidate(DOCTORS)
 
     # Construct response
     return {
@@ -90,76 +106,28 @@ async def create_single_doctor(doctor: DoctorCreate, db: Session = Depends(get_d
         "rating": db_doctor.rating
     }
 
-# @router.post("/", response_model=Doctor)
-# def create_doctor(doctor: DoctorCreate, db: Session = Depends(get_db)):
-#     # Check if email already exists
-#     if db.query(models.User).filter(models.User.email == doctor.email).first():
-#         raise HTTPException(status_code=400, detail="Email already registered")
-
-#     # Hash the password
-#     hashed_password = bcrypt.hashpw(doctor.password.encode(), bcrypt.gensalt(BCRYPT_SALT_ROUNDS)).decode()
-
-#     # Create User
-#     db_user = models.User(
-#         email=doctor.email,
-#         adress=doctor.adress,
-#         birthdate=doctor.birthdate,
-#         name=doctor.name,
-#         password=hashed_password,
-#         phoneNumber=doctor.phoneNumber,
-#         role=RoleUser.DOCTOR
-#     )
-
-#     # Create Doctor
-#     db_doctor = models.Doctor(
-#         description=doctor.description,
-#         rating=doctor.rating
-#     )
-
-#     db_user.doctor = db_doctor
-#     db.add(db_user)
-    
-#     try:
-#         db.commit()
-#         db.refresh(db_user)
-#         db.refresh(db_doctor)
-#     except Exception as e:
-#         db.rollback()
-#         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-
-#     # Construct response
-#     return {
-#         "id": db_doctor.id,
-#         "email": db_user.email,
-#         "name": db_user.name,
-#         "role": db_user.role,
-#         "adress": db_user.adress,
-#         "birthdate": db_user.birthdate,
-#         "phoneNumber": db_user.phoneNumber,
-#         "description": db_doctor.description,
-#         "rating": db_doctor.rating
-#     }
+@router.post("/single-doctor", response_model=Doctor)
+async def create_single_doctor(doctor: DoctorCreate, db: Session = Depends(get_db)):
+    # Only creates the first doctor (no authentication), the next ones are added by a doctor with POST /doctors/
+    if db.query(models.Doctor).first():
+        raise HTTPException(status_code=400, detail="A doctor already exists in the system")
+    return create_doctor_account(db, doctor)
+
+@router.post("/", response_model=Doctor)
+def create_doctor(
+    doctor: DoctorCreate,
+    current_user: AuthUser = Depends(allow_doctor),
+    db: Session = Depends(get_db)
+):
+    # Adds a doctor to the ones new consultations are assigned to (DOCTOR_ASSIGNMENT_STRATEGY)
+    return create_doctor_account(db, doctor)
 
 @router.get("/{doctor_id}", response_model=Doctor)
 def get_doctor_by_id(doctor_id: int, db: Session = Depends(get_db)):
-    doctor = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
+    doctor = get_doctor_profile(db, doctor_id)
     if doctor is None:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    
-    # Fetch associated user
-    user = doctor.user
-    
-    return {
-        "id": doctor.id,
-        "email": user.email,
-        "name": user.name,
-        "role": user.role,
-        "adress": user.adress,
-        "birthdate": user.birthdate,
-        "phoneNumber": user.phoneNumber,
-        "description": doctor.description,
-        "rating": doctor.rating
-    }
+    return doctor
 
 @router.get("/name/{name}", response_model=list[Doctor])
 def get_doctors_by_name(name: str, db: Session = Depends(get_db)):
@@ -211,6 +179,7 @@ def update_doctor(doctor_id: int, doctor_update: DoctorUpdate, db: Session = Dep
     db.commit()
     db.refresh(db_user)
     db.refresh(db_doctor)
+    reference_cache.invalidate(DOCTORS)
 
     return {
         "id": db_doctor.id,
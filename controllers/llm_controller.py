@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
-from schemas.llm_service_schemas import SymptomRequest
-from services.llm_service import diagnose_patient_en, diagnose_patient_fr
+from schemas.llm_service_schemas import SymptomRequest, BatchSymptomRequest, BatchDiagnosisResponse
+from services.llm_service import diagnose_patient_en, diagnose_patient_fr, diagnose_patients_batch
 from schemas.auth_schemas import User as AuthUser
 from dependencies.auth import get_current_active_user
 
@@ -18,4 +18,26 @@ def diagnose_fr(
     request: SymptomRequest,
     current_user: AuthUser = Depends(get_current_active_user)
     ):
-    return diagnose_patient_fr(request.symptoms, request.additional_details)
\ No newline at end of file
+    return diagnose_patient_fr(request.symptoms, request.additional_details)
+
+@router.post("/diagnose-batch-en", response_model=BatchDiagnosisResponse)
+def diagnose_batch_en(
+    request: BatchSymptomRequest,
+    current_user: AuthUser = Depends(get_current_active_user)
+    ):
+    """
+    Diagnoses many symptom sets in English. Results are returned in input order,
+    failed items carry an error instead of a diagnosis. At most LLM_BATCH_MAX_ITEMS symptom sets per request.
+    """
+    return BatchDiagnosisResponse(results=diagnose_patients_batch(request.items, language="en"))
+
+@router.post("/diagnose-batch-fr", response_model=BatchDiagnosisResponse)
+def diagnose_batch_fr(
+    request: BatchSymptomRequest,
+    current_user: AuthUser = Depends(get_current_active_user)
+    ):
+    """
+    Diagnoses many symptom sets in French. Results are returned in input order,
+    failed items carry an error instead of a diagnosis. At most LLM_BATCH_MAX_ITEMS symptom sets per request.
+    """
+    return BatchDiagnosisResponse(results=diagnose_patients_batch(request.items, language="fr"))
\ No newline at end of file
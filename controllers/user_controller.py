@@ -1,16 +1,16 @@
 import os
 import bcrypt
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from dependencies.auth import bcrypt, get_current_active_user
-from dependencies.env import BCRYPT_SALT_ROUNDS
+from dependencies.env import BCRYPT_SALT_ROUNDS, PHOTO_MAX_BYTES
 from dependencies.get_db import get_db
 import models
 from schemas.auth_schemas import User as AuthUser
 from schemas.user_schemas import User, UserListElement, UserUpdatePassword
-from PIL import Image
-import io
+from services.photo_service import PhotoTooLarge, photo_renderer, read_upload_limited, rendition_path
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -91,7 +91,7 @@ def update_password(
 
     return db_user
 
-# Updated endpoint to upload, resize, and save as JPEG with size limit
+# Updated endpoint to upload the photo and save its renditions, with size limit
 @router.post("/me/photo", response_model=User)
 async def upload_profile_photo(
     file: UploadFile = File(...),
@@ -99,8 +99,10 @@ async def upload_profile_photo(
     db: Session = Depends(get_db)
 ):
     """
-    Upload or update the profile photo for the current user, resizing it to 200x200 pixels
-    and saving as JPEG. Enforces a 5MB file size limit.
+    Upload or update the profile photo for the current user, saving it fitted in each of
+    PHOTO_RENDITION_SIZES (e.g. 48, 96 and 200 pixels) in each of PHOTO_RENDITION_FORMATS (e.g. JPEG and WebP).
+    The upload is read in chunks and rejected as soon as it exceeds PHOTO_MAX_BYTES (5MB by default);
+    the image is decoded and resized once, in the photo process pool.
     
     Args:
         file: The uploaded image file (e.g., JPEG, PNG).
@@ -108,7 +110,7 @@ async def upload_profile_photo(
         db: The database session (via dependency).
     
     Returns:
-        The updated User object with the profile_photo path.
+        The updated User object with the profile_photo path (the largest JPEG rendition).
     
     Raises:
         HTTPException: If the user is not found, file type is invalid, file is too large,
@@ -128,34 +130,24 @@ async def upload_profile_photo(
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Generate unique file path (always .jpg)
-    file_name = f"user_{db_user.id}_profile.jpg"
-    file_path = os.path.join(UPLOAD_DIR, file_name)
-
+    # Read the file in chunks, stopping past the size limit
     try:
-        # Read and check file size
-        contents = await file.read()
-        if len(contents) > 5 * 1024 * 1024:  # 5MB limit
-            raise HTTPException(status_code=400, detail="File too large. Maximum size is 5MB.")
-        
-        # Open the image with Pillow
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB (required for JPEG)
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        # Resize to 200x200, maintaining aspect ratio
-        image.thumbnail((200, 200), Image.Resampling.LANCZOS)
-        
-        # Save as JPEG
-        image.save(file_path, format="JPEG", quality=85)
+        contents = await read_upload_limited(file)
+    except PhotoTooLarge:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File too large. Maximum size is {PHOTO_MAX_BYTES // (1024 * 1024)}MB."
+        )
 
+    # Decode, resize and save every rendition in the process pool
+    try:
+        paths = await photo_renderer.render(contents, UPLOAD_DIR, f"user_{db_user.id}_profile")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process image: {str(e)}")
 
     # Update user's profile_photo path
-    db_user.profile_photo = file_path
+    main_format = "jpeg" if "jpeg" in photo_renderer.formats else photo_renderer.formats[0]
+    db_user.profile_photo = paths[f"{max(photo_renderer.sizes)}.{main_format}"]
     db.commit()
     db.refresh(db_user)
 
@@ -164,6 +156,8 @@ async def upload_profile_photo(
 # New endpoint to get profile photo
 @router.get("/me/photo", response_class=FileResponse)
 async def get_profile_photo(
+    size: Optional[int] = None,
+    image_format: str = Query("jpeg", alias="format"),
     current_user: AuthUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -171,6 +165,8 @@ async def get_profile_photo(
     Retrieve the profile photo for the current user.
     
     Args:
+        size: Rendition size in pixels, one of PHOTO_RENDITION_SIZES (defaults to the profile_photo).
+        image_format: Rendition format, one of PHOTO_RENDITION_FORMATS (used with size).
         current_user: The authenticated user (via dependency).
         db: The database session (via dependency).
     
@@ -178,8 +174,15 @@ async def get_profile_photo(
         The image file as a FileResponse.
     
     Raises:
-        HTTPException: If the user or photo is not found, or the file is invalid.
+        HTTPException: If the rendition is not offered, the user or photo is not found, or the file is invalid.
     """
+    # Validate the requested rendition
+    if size is not None and (size not in photo_renderer.sizes or image_format not in photo_renderer.formats):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Available renditions: sizes {photo_renderer.sizes}, formats {photo_renderer.formats}"
+        )
+
     # Fetch the user
     db_user = db.query(models.User).filter(models.User.email == current_user.email).first()
     if not db_user:
@@ -189,4 +192,10 @@ async def get_profile_photo(
     if not db_user.profile_photo or not os.path.exists(db_user.profile_photo):
         raise HTTPException(status_code=404, detail="Profile photo not found")
 
+    # Photos uploaded before renditions existed only have the profile_photo
+    if size is not None:
+        path = rendition_path(UPLOAD_DIR, f"user_{db_user.id}_profile", size, image_format)
+        if os.path.exists(path):
+            return FileResponse(path)
+
     return FileResponse(db_user.profile_photo)
\ No newline at end of file
@@ -9,10 +9,20 @@ load_dotenv(override=True)
 GIST_ID = os.getenv("GIST_ID")
 
 # BASE_URL = os.getenv("BASE_URL")
-BASE_URL = get_ngrok_url(GIST_ID)
+# LLM_BASE_URL skips the Gist lookup, e.g. to point at the local stand-in (dev_scripts/llm_stand_in.py)
+BASE_URL = os.getenv("LLM_BASE_URL") or get_ngrok_url(GIST_ID)
+# Number of symptom sets sent to the LLM backend per batch request (1 to 32, the backend's MAX_BATCH_ITEMS)
+LLM_BATCH_CHUNK_SIZE = int(os.getenv("LLM_BATCH_CHUNK_SIZE", "16"))
+if not 1 <= LLM_BATCH_CHUNK_SIZE <= 32:
+    raise ValueError(f"LLM_BATCH_CHUNK_SIZE must be between 1 and 32 (MAX_BATCH_ITEMS of the LLM backend), got {LLM_BATCH_CHUNK_SIZE}")
+# Maximum number of symptom sets accepted by one /llm/diagnose-batch-* request
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "128"))
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 BLOCKCHAIN_URL = os.getenv("BLOCKCHAIN_URL")
+# Connections kept open to the node by the async client, and request timeout in seconds
+BLOCKCHAIN_HTTP_POOL_SIZE = int(os.getenv("BLOCKCHAIN_HTTP_POOL_SIZE", "20"))
+BLOCKCHAIN_HTTP_TIMEOUT = float(os.getenv("BLOCKCHAIN_HTTP_TIMEOUT", "30"))
 
 # Contract details (replace with your deployed contract address)
 STORAGE_CONTRACT_ADDRESS = os.getenv("STORAGE_CONTRACT_ADDRESS")
@@ -20,6 +30,43 @@ DIAGNOSIS_CONTRACT_ADDRESS = os.getenv("DIAGNOSIS_CONTRACT_ADDRESS")
 # Public address
 ACCOUNT = os.getenv("ACCOUNT")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
+# Seconds a transaction may stay pending before it is replaced with higher fees
+BLOCKCHAIN_TX_TIMEOUT = int(os.getenv("BLOCKCHAIN_TX_TIMEOUT", "120"))
+BLOCKCHAIN_MAX_REPLACEMENTS = int(os.getenv("BLOCKCHAIN_MAX_REPLACEMENTS", "3"))
+# EIP-1559 fee estimation: tip percentile paid in recent blocks (higher confirms sooner), fee cap and gas limit margin
+BLOCKCHAIN_FEE_PERCENTILE = float(os.getenv("BLOCKCHAIN_FEE_PERCENTILE", "50"))
+BLOCKCHAIN_FEE_HISTORY_BLOCKS = int(os.getenv("BLOCKCHAIN_FEE_HISTORY_BLOCKS", "10"))
+BLOCKCHAIN_BASE_FEE_MULTIPLIER = float(os.getenv("BLOCKCHAIN_BASE_FEE_MULTIPLIER", "2"))
+BLOCKCHAIN_MAX_FEE_GWEI = float(os.getenv("BLOCKCHAIN_MAX_FEE_GWEI", "200"))
+BLOCKCHAIN_FEE_CACHE_SECONDS = float(os.getenv("BLOCKCHAIN_FEE_CACHE_SECONDS", "12"))
+BLOCKCHAIN_GAS_MARGIN = float(os.getenv("BLOCKCHAIN_GAS_MARGIN", "1.25"))
+BLOCKCHAIN_GAS_BUCKET_BYTES = int(os.getenv("BLOCKCHAIN_GAS_BUCKET_BYTES", "64"))
+
+# Diagnosis anchoring worker (blockchain outbox)
+BLOCKCHAIN_ANCHOR_WORKER_ENABLED = os.getenv("BLOCKCHAIN_ANCHOR_WORKER_ENABLED", "true").lower() == "true"
+BLOCKCHAIN_ANCHOR_POLL_INTERVAL = float(os.getenv("BLOCKCHAIN_ANCHOR_POLL_INTERVAL", "5"))
+BLOCKCHAIN_ANCHOR_BATCH_SIZE = int(os.getenv("BLOCKCHAIN_ANCHOR_BATCH_SIZE", "20"))
+BLOCKCHAIN_ANCHOR_MAX_ATTEMPTS = int(os.getenv("BLOCKCHAIN_ANCHOR_MAX_ATTEMPTS", "5"))
+BLOCKCHAIN_ANCHOR_BACKOFF_SECONDS = int(os.getenv("BLOCKCHAIN_ANCHOR_BACKOFF_SECONDS", "10"))
+# "single": one addDiagnosis transaction per consultation
+# "merkle": one anchorMerkleRoot transaction per batch (requires SmartContract_Diagnosis_V4_MerkleBatch.sol)
+BLOCKCHAIN_ANCHOR_MODE = os.getenv("BLOCKCHAIN_ANCHOR_MODE", "single").lower()
+BLOCKCHAIN_MERKLE_BATCH_SIZE = int(os.getenv("BLOCKCHAIN_MERKLE_BATCH_SIZE", "32"))
+BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT = int(os.getenv("BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT", "300"))
+# Blocks after which an on-chain record is considered final and cached locally
+BLOCKCHAIN_FINALITY_DEPTH = int(os.getenv("BLOCKCHAIN_FINALITY_DEPTH", "12"))
+ONCHAIN_CACHE_SIZE = int(os.getenv("ONCHAIN_CACHE_SIZE", "10000"))
+# Bulk integrity verification: calls per JSON-RPC batch, parallel batches, consultations per streamed chunk
+BLOCKCHAIN_RPC_BATCH_SIZE = int(os.getenv("BLOCKCHAIN_RPC_BATCH_SIZE", "50"))
+BLOCKCHAIN_RPC_MAX_WORKERS = int(os.getenv("BLOCKCHAIN_RPC_MAX_WORKERS", "4"))
+BULK_VERIFY_CHUNK_SIZE = int(os.getenv("BULK_VERIFY_CHUNK_SIZE", "200"))
+BULK_VERIFY_MAX_IDS = int(os.getenv("BULK_VERIFY_MAX_IDS", "5000"))
+# Event indexer: first block to scan (contract deployment), blocks per eth_getLogs request (adapted at runtime)
+BLOCKCHAIN_INDEXER_ENABLED = os.getenv("BLOCKCHAIN_INDEXER_ENABLED", "false").lower() == "true"
+BLOCKCHAIN_INDEXER_START_BLOCK = int(os.getenv("BLOCKCHAIN_INDEXER_START_BLOCK", "0"))
+BLOCKCHAIN_INDEXER_POLL_INTERVAL = float(os.getenv("BLOCKCHAIN_INDEXER_POLL_INTERVAL", "15"))
+BLOCKCHAIN_INDEXER_CHUNK_SIZE = int(os.getenv("BLOCKCHAIN_INDEXER_CHUNK_SIZE", "2000"))
+BLOCKCHAIN_INDEXER_MAX_CHUNK_SIZE = int(os.getenv("BLOCKCHAIN_INDEXER_MAX_CHUNK_SIZE", "10000"))
 
 SECRET_KEY = os.getenv("SECRET_KEY", "default-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
@@ -28,6 +75,41 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "20")
 # OAuth2 Configuration
 TOKEN_URL = os.getenv("TOKEN_URL", "auth/token")
 
+# Appointment availability index: seconds a cached day stays valid, and number of cached (doctor, day) entries
+AVAILABILITY_INDEX_TTL = float(os.getenv("AVAILABILITY_INDEX_TTL", "60"))
+AVAILABILITY_INDEX_MAX_DAYS = int(os.getenv("AVAILABILITY_INDEX_MAX_DAYS", "5000"))
+# Working hours offered as free slots (start included, end excluded) and working days (0 = Monday)
+WORKING_HOURS_START = int(os.getenv("WORKING_HOURS_START", "9"))
+WORKING_HOURS_END = int(os.getenv("WORKING_HOURS_END", "17"))
+WORKING_DAYS = {int(day) for day in os.getenv("WORKING_DAYS", "0,1,2,3,4").split(",") if day.strip()}
+AVAILABILITY_CALENDAR_MAX_DAYS = int(os.getenv("AVAILABILITY_CALENDAR_MAX_DAYS", "62"))
+# Next available slots search: maximum slots per request and days searched ahead
+NEXT_SLOTS_MAX_COUNT = int(os.getenv("NEXT_SLOTS_MAX_COUNT", "50"))
+NEXT_SLOTS_HORIZON_DAYS = int(os.getenv("NEXT_SLOTS_HORIZON_DAYS", "90"))
+# Seconds a consultation chat WebSocket may stay without a patient message before it is closed
+CHAT_WS_IDLE_TIMEOUT = float(os.getenv("CHAT_WS_IDLE_TIMEOUT", "900"))
+# Number of EN_COURS consultations whose chat history is kept in memory
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "2000"))
+# Doctor dashboard: oldest EN_ATTENTE consultations listed, and seconds a dashboard is cached (0 disables the cache)
+DOCTOR_DASHBOARD_PENDING_LIMIT = int(os.getenv("DOCTOR_DASHBOARD_PENDING_LIMIT", "10"))
+DOCTOR_DASHBOARD_TTL = float(os.getenv("DOCTOR_DASHBOARD_TTL", "5"))
+# Seconds a doctor keeps an EN_ATTENTE consultation claimed from the review queue, unless renewed
+REVIEW_CLAIM_LEASE_SECONDS = int(os.getenv("REVIEW_CLAIM_LEASE_SECONDS", "900"))
+# Doctor of new consultations: least_pending, round_robin or earliest_free_slot
+DOCTOR_ASSIGNMENT_STRATEGY = os.getenv("DOCTOR_ASSIGNMENT_STRATEGY", "least_pending")
+# Reference data cache (doctor profiles): empty for a per-process cache, or a redis:// URL to share it between workers,
+# seconds an entry is kept, and entries kept by the per-process cache
+REFERENCE_CACHE_URL = os.getenv("REFERENCE_CACHE_URL", "")
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "3600"))
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", "10000"))
+# Profile photos: maximum upload size and read chunk size in bytes, rendition sizes in pixels and formats (jpeg, webp),
+# and processes rendering them
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(5 * 1024 * 1024)))
+PHOTO_UPLOAD_CHUNK_SIZE = int(os.getenv("PHOTO_UPLOAD_CHUNK_SIZE", "65536"))
+PHOTO_RENDITION_SIZES = [int(size) for size in os.getenv("PHOTO_RENDITION_SIZES", "48,96,200").split(",") if size.strip()]
+PHOTO_RENDITION_FORMATS = [fmt.strip().lower() for fmt in os.getenv("PHOTO_RENDITION_FORMATS", "jpeg,webp").split(",") if fmt.strip()]
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", "2"))
+
 # Bcrypt settings
 BCRYPT_SALT_ROUNDS = int(os.getenv("BCRYPT_SALT_ROUNDS", "12"))
 
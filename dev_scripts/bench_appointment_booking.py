@@ -0,0 +1,94 @@
+"""Concurrency test and throughput benchmark of appointment booking
+1. Race: N patients book the same slot at the same instant, exactly one must get 200 and the others 409.
+2. Throughput: the same N patients book N distinct slots concurrently, reports bookings/second and latency.
+
+Patients are registered through the API, their RECONSULTATION consultations are created directly in the database.
+Start the backend first, e.g.: uvicorn main:app --port 8000
+Run with: python -m dev_scripts.bench_appointment_booking [--patients 100] [--api http://127.0.0.1:8000]
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+import models
+from dependencies.database import SessionLocal
+from dev_scripts.bench_patient_flow import login, register_patient
+from dev_scripts.bench_utils import StepTimer
+
+def create_patients(api: str, count: int, doctor_id: int) -> list[tuple[requests.Session, int, int]]:
+    """Registers patients and gives each two RECONSULTATION consultations (race and throughput phases)"""
+    patients = []
+    db = SessionLocal()
+    try:
+        for _ in range(count):
+            email, password = register_patient(api)
+            session = requests.Session()
+            login(session, api, email, password)
+            patient_id = db.query(models.User.id).filter(models.User.email == email).scalar()
+            consultations = [
+                models.Consultation(etat=models.EtatConsultation.RECONSULTATION, doctor_id=doctor_id, patient_id=patient_id)
+                for _ in range(2)
+            ]
+            db.add_all(consultations)
+            db.commit()
+            patients.append((session, consultations[0].id, consultations[1].id))
+    finally:
+        db.close()
+    return patients
+
+def book(api: str, session: requests.Session, consultation_id: int, slot: datetime) -> int:
+    response = session.post(f"{api}/consultation-patient/{consultation_id}/appointments", json={"dateAppointment": slot.isoformat()})
+    return response.status_code
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--patients", type=int, default=100)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    doctor = db.query(models.Doctor).first()
+    db.close()
+    if doctor is None:
+        raise SystemExit("No doctor in the database")
+
+    print(f"Registering {args.patients} patients...")
+    patients = create_patients(args.api, args.patients, doctor.id)
+    # A random hour years ahead, so repeated runs do not collide with earlier bookings
+    base = datetime.combine(datetime.now().date() + timedelta(days=random.randint(365, 3650)), datetime.min.time())
+    race_slot = base + timedelta(hours=10)
+
+    # Phase 1: every patient books race_slot at the same instant
+    barrier = threading.Barrier(len(patients))
+    def race(patient):
+        session, consultation_id, _ = patient
+        barrier.wait()
+        return book(args.api, session, consultation_id, race_slot)
+
+    with ThreadPoolExecutor(max_workers=len(patients)) as executor:
+        statuses = Counter(executor.map(race, patients))
+    print(f"race on {race_slot}: {dict(statuses)}")
+    assert statuses[200] == 1, "Exactly one booking of the slot must succeed"
+    assert statuses[409] == len(patients) - 1, "Every other booking must be rejected with 409"
+
+    # Phase 2: every patient books its own slot, one hour apart on the following days
+    timer = StepTimer()
+    def book_distinct(indexed_patient):
+        index, (session, _, consultation_id) = indexed_patient
+        slot = base + timedelta(days=1 + index // 24, hours=index % 24)
+        with timer.measure("book_appointment"):
+            status_code = book(args.api, session, consultation_id, slot)
+            if status_code != 200:
+                raise RuntimeError(f"Booking {slot} returned {status_code}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(32, len(patients))) as executor:
+        futures = [executor.submit(book_distinct, patient) for patient in enumerate(patients)]
+    failures = sum(1 for future in futures if future.exception() is not None)
+    elapsed = time.perf_counter() - start
+    print(f"throughput: {len(patients) / elapsed:.1f} bookings/s over {len(patients)} distinct slots, failed: {failures}")
+    print(timer.report())
@@ -0,0 +1,128 @@
+"""Compares the appointment queries joined through consultations (before) with the queries
+on the denormalized appointments.doctor_id / patient_id columns (after), on a large table.
+
+Seeds synthetic users, consultations and appointments (1M by default) into the given database,
+which should be a scratch database: python -m dev_scripts.db_migrate is not needed, tables are created.
+Run with: python -m dev_scripts.bench_appointment_queries --database-url mysql+mysqlconnector://user:pw@localhost/bench
+    [--appointments 1000000] [--skip-seed] [--runs 200] [--cleanup]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, delete, func, select
+import models
+from dev_scripts.bench_utils import StepTimer
+
+EMAIL_DOMAIN = "@bench-appointments.local"
+BATCH = 10000
+
+Appointment = models.Appointment.__table__
+Consultation = models.Consultation.__table__
+
+def next_id(conn, table) -> int:
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+def insert_batches(conn, table, rows) -> None:
+    for start in range(0, len(rows), BATCH):
+        conn.execute(table.insert(), rows[start:start + BATCH])
+
+def seed(engine, appointments: int, doctors: int, patients: int) -> None:
+    rng = random.Random(42)
+    etats = [models.EtatAppointment.COMPLETE] * 7 + [models.EtatAppointment.PLANIFIE] * 2 + [models.EtatAppointment.ANNULE]
+    origin = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        first_user = next_id(conn, models.User.__table__)
+        users = [
+            {"id": first_user + i, "email": f"bench-{first_user + i}{EMAIL_DOMAIN}", "name": "Bench", "password": "-",
+             "role": models.RoleUser.DOCTOR if i < doctors else models.RoleUser.PATIENT}
+            for i in range(doctors + patients)
+        ]
+        insert_batches(conn, models.User.__table__, users)
+        doctor_ids = [user["id"] for user in users[:doctors]]
+        patient_ids = [user["id"] for user in users[doctors:]]
+        insert_batches(conn, models.Doctor.__table__, [{"id": doctor_id} for doctor_id in doctor_ids])
+        insert_batches(conn, models.Patient.__table__, [{"id": patient_id} for patient_id in patient_ids])
+
+    # Consultations and appointments in chunks, one transaction each
+    for start in range(0, appointments, BATCH * 10):
+        size = min(BATCH * 10, appointments - start)
+        with engine.begin() as conn:
+            first_consultation = next_id(conn, Consultation)
+            consultations, rows = [], []
+            for i in range(size):
+                doctor_id, patient_id = rng.choice(doctor_ids), rng.choice(patient_ids)
+                consultations.append({"id": first_consultation + i, "etat": models.EtatConsultation.RECONSULTATION,
+                                      "doctor_id": doctor_id, "patient_id": patient_id})
+                rows.append({"consultation_id": first_consultation + i, "doctor_id": doctor_id, "patient_id": patient_id,
+                             "dateAppointment": origin + timedelta(hours=rng.randrange(3 * 365 * 24)),
+                             "etat": rng.choice(etats)})
+            insert_batches(conn, Consultation, consultations)
+            insert_batches(conn, Appointment, rows)
+        print(f"Seeded {start + size}/{appointments} appointments")
+
+def cleanup(engine) -> None:
+    with engine.begin() as conn:
+        user_ids = select(models.User.__table__.c.id).where(models.User.__table__.c.email.like(f"%{EMAIL_DOMAIN}")).scalar_subquery()
+        conn.execute(delete(Appointment).where(Appointment.c.patient_id.in_(user_ids)))
+        conn.execute(delete(Consultation).where(Consultation.c.patient_id.in_(user_ids)))
+        for table in (models.Patient.__table__, models.Doctor.__table__):
+            conn.execute(delete(table).where(table.c.id.in_(user_ids)))
+        conn.execute(delete(models.User.__table__).where(models.User.__table__.c.email.like(f"%{EMAIL_DOMAIN}")))
+
+def queries(doctor_id: int, patient_id: int, day: datetime):
+    """(name, before, after) statements for one set of random parameters"""
+    joined = Appointment.join(Consultation, Appointment.c.consultation_id == Consultation.c.id)
+    active = Appointment.c.etat != models.EtatAppointment.ANNULE
+    for name, days in (("doctor_day", 1), ("doctor_month", 31)):
+        yield (
+            name,
+            select(Appointment.c.dateAppointment).select_from(joined).where(
+                Consultation.c.doctor_id == doctor_id, active,
+                Appointment.c.dateAppointment >= day, Appointment.c.dateAppointment < day + timedelta(days=days)),
+            select(Appointment.c.dateAppointment).where(
+                Appointment.c.doctor_id == doctor_id, active,
+                Appointment.c.dateAppointment >= day, Appointment.c.dateAppointment < day + timedelta(days=days))
+        )
+    yield (
+        "patient_appointments",
+        select(Appointment).select_from(joined).where(Consultation.c.patient_id == patient_id),
+        select(Appointment).where(Appointment.c.patient_id == patient_id)
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="Scratch database, seeded rows are added to it")
+    parser.add_argument("--appointments", type=int, default=1_000_000)
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=200, help="Executions of each query")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse rows seeded by an earlier run")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the seeded rows at the end")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    models.Base.metadata.create_all(engine)
+    if not args.skip_seed:
+        seed(engine, args.appointments, args.doctors, args.patients)
+
+    with engine.connect() as conn:
+        users = models.User.__table__
+        doctor_ids = conn.execute(select(users.c.id).where(users.c.email.like(f"%{EMAIL_DOMAIN}"), users.c.role == models.RoleUser.DOCTOR)).scalars().all()
+        patient_ids = conn.execute(select(users.c.id).where(users.c.email.like(f"%{EMAIL_DOMAIN}"), users.c.role == models.RoleUser.PATIENT)).scalars().all()
+        total = conn.execute(select(func.count()).select_from(Appointment)).scalar()
+        print(f"appointments in table: {total}")
+
+        rng = random.Random(7)
+        timer = StepTimer()
+        for _ in range(args.runs):
+            day = datetime(2024, 1, 1) + timedelta(days=rng.randrange(3 * 365))
+            for name, before, after in queries(rng.choice(doctor_ids), rng.choice(patient_ids), day):
+                # Alternate the order so neither variant always runs on a warmer buffer pool
+                for variant, statement in sorted((("before", before), ("after", after)), key=lambda _: rng.random()):
+                    with timer.measure(f"{name}_{variant}"):
+                        conn.execute(statement).all()
+        print(timer.report())
+
+    if args.cleanup:
+        cleanup(engine)
+        print("Seeded rows deleted")
@@ -0,0 +1,84 @@
+"""Benchmark of the chat history preparation done on each chat turn, over 50-turn conversations:
+- orm_reload: the previous path, every ChatMessage hydrated as an ORM object and mapped to {"role", "content"}
+- core_load: a cache miss, Core select of (sender_type, content)
+- cached: a cache hit, the in-memory history checked with one primary key lookup
+
+No LLM involved: each turn inserts a user and an assistant message directly. The conversations are created
+for the first doctor and patient of the configured database and deleted at the end.
+Run with: python -m dev_scripts.bench_chat_history [--conversations 20] [--turns 50]
+"""
+import argparse
+from sqlalchemy import delete
+import models
+from dependencies.database import SessionLocal
+from dev_scripts.bench_patient_flow import PATIENT_MESSAGES
+from dev_scripts.bench_utils import StepTimer
+from services.chat_history_cache import ChatHistoryCache, SENDER_ROLES, add_chat_messages, load_chat_history
+
+ASSISTANT_REPLY = "Thank you. How long have you had this pain, and does it wake you up at night? " * 3
+
+def orm_reload(db, consultation_id: int) -> list:
+    messages = db.query(models.ChatMessage).filter(
+        models.ChatMessage.consultation_id == consultation_id
+    ).order_by(models.ChatMessage.timestamp.asc(), models.ChatMessage.id.asc()).all()
+    return [{"role": SENDER_ROLES[msg.sender_type], "content": msg.content} for msg in messages]
+
+def run_conversation(db, cache: ChatHistoryCache, doctor_id: int, patient_id: int, turns: int, timer: StepTimer) -> int:
+    consultation = models.Consultation(etat=models.EtatConsultation.EN_COURS, doctor_id=doctor_id, patient_id=patient_id)
+    db.add(consultation)
+    db.commit()
+
+    for turn in range(turns):
+        # Fresh identity map each turn, as each request gets its own session
+        db.expire_all()
+        with timer.measure("orm_reload"):
+            expected = orm_reload(db, consultation.id)
+        with timer.measure("core_load"):
+            loaded = load_chat_history(db, consultation.id)
+        with timer.measure("cached"):
+            cached = cache.history(db, consultation.id)
+        assert expected == loaded == cached, f"History mismatch at turn {turn}"
+
+        user_message = {"role": "user", "content": PATIENT_MESSAGES[turn % len(PATIENT_MESSAGES)]}
+        assistant_message = {"role": "assistant", "content": ASSISTANT_REPLY}
+        add_chat_messages(
+            db,
+            consultation.id,
+            models.ChatMessage(consultation_id=consultation.id, content=user_message["content"], sender_type=models.MessageSenderType.USER),
+            models.ChatMessage(consultation_id=consultation.id, content=assistant_message["content"], sender_type=models.MessageSenderType.ASSISTANT)
+        )
+        db.commit()
+        cache.append(consultation.id, user_message, assistant_message)
+    return consultation.id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    doctor = db.query(models.Doctor).first()
+    patient = db.query(models.Patient).first()
+    if doctor is None or patient is None:
+        raise SystemExit("A doctor and a patient are needed in the database")
+
+    timer = StepTimer()
+    cache = ChatHistoryCache(maxsize=args.conversations)
+    consultation_ids = []
+    try:
+        for _ in range(args.conversations):
+            consultation_ids.append(run_conversation(db, cache, doctor.id, patient.id, args.turns, timer))
+    finally:
+        db.rollback()
+        db.execute(delete(models.ChatMessage).where(models.ChatMessage.consultation_id.in_(consultation_ids)))
+        db.execute(delete(models.Consultation).where(models.Consultation.id.in_(consultation_ids)))
+        db.commit()
+        db.close()
+
+    # Messages read per conversation: the reload reads 0 + 2 + 4 + ... rows, the cache only its first (empty) load
+    rows_reloaded = sum(2 * turn for turn in range(args.turns))
+    print(f"conversations: {args.conversations}, turns: {args.turns}, rows read per conversation: "
+          f"{rows_reloaded} with orm_reload, 0 with the cache (one primary key lookup per turn)")
+    print(f"cache: {cache.stats()}")
+    print(timer.report())
@@ -0,0 +1,110 @@
+"""Benchmark of the doctor's consultation detail query versus chat length:
+- joined: the previous loading, one SELECT joining symptoms, hypotheses and chat messages
+- selectin: load_consultation_detail, one SELECT per collection
+Reports the rows returned by the database and the SQL statements per load, and p50/p95 latency.
+
+Consultations with 8 symptoms and 3 hypotheses are created for the first doctor and patient
+of the configured database, and deleted at the end.
+Run with: python -m dev_scripts.bench_consultation_detail [--chat-lengths 10,30,60,120] [--runs 50]
+"""
+import argparse
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import joinedload
+import models
+from controllers.consultation_doctor_controller import load_consultation_detail
+from dependencies.database import SessionLocal, engine
+from dev_scripts.bench_utils import StepTimer
+
+SYMPTOMS = 8
+HYPOTHESES = 3
+
+def load_joined(db, consultation_id: int, doctor_id: int) -> models.Consultation:
+    return db.query(models.Consultation).options(
+        joinedload(models.Consultation.patient).joinedload(models.Patient.user),
+        joinedload(models.Consultation.symptoms),
+        joinedload(models.Consultation.hypotheses),
+        joinedload(models.Consultation.chat_messages)
+    ).filter(
+        models.Consultation.id == consultation_id,
+        models.Consultation.doctor_id == doctor_id
+    ).first()
+
+def create_consultation(db, doctor_id: int, patient_id: int, messages: int) -> int:
+    consultation = models.Consultation(etat=models.EtatConsultation.EN_ATTENTE, doctor_id=doctor_id, patient_id=patient_id,
+                                       last_chat_seq=messages)
+    db.add(consultation)
+    db.flush()
+    db.add_all(
+        models.ChatMessage(consultation_id=consultation.id, seq=seq, content=f"Message {seq} " + "lorem ipsum " * 20,
+                           sender_type=models.MessageSenderType.USER if seq % 2 else models.MessageSenderType.ASSISTANT)
+        for seq in range(1, messages + 1)
+    )
+    db.add_all(models.Symptoms(symptom=f"Symptom {i}", user_id=patient_id, consultation_id=consultation.id) for i in range(SYMPTOMS))
+    db.add_all(models.Hypothese(condition=f"Condition {i}", confidence=90 - i, consultation_id=consultation.id) for i in range(HYPOTHESES))
+    db.commit()
+    return consultation.id
+
+def rows_returned(db, consultation_id: int) -> dict:
+    """Rows each strategy makes the database return, counted with the same joins"""
+    joined = db.execute(
+        select(func.count()).select_from(
+            models.Consultation.__table__
+            .outerjoin(models.Symptoms.__table__)
+            .outerjoin(models.Hypothese.__table__)
+            .outerjoin(models.ChatMessage.__table__)
+        ).where(models.Consultation.id == consultation_id)
+    ).scalar()
+    collections = sum(
+        db.execute(select(func.count()).select_from(table).where(table.c.consultation_id == consultation_id)).scalar()
+        for table in (models.Symptoms.__table__, models.Hypothese.__table__, models.ChatMessage.__table__)
+    )
+    return {"joined": joined, "selectin": 1 + collections}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-lengths", default="10,30,60,120", help="Comma separated numbers of chat messages")
+    parser.add_argument("--runs", type=int, default=50, help="Loads of each consultation per strategy")
+    args = parser.parse_args()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *_: statements.append(1))
+
+    db = SessionLocal()
+    doctor = db.query(models.Doctor).first()
+    patient = db.query(models.Patient).first()
+    db.close()
+    if doctor is None or patient is None:
+        raise SystemExit("A doctor and a patient are needed in the database")
+
+    consultation_ids = []
+    try:
+        for length in (int(value) for value in args.chat_lengths.split(",")):
+            db = SessionLocal()
+            consultation_id = create_consultation(db, doctor.id, patient.id, length)
+            consultation_ids.append(consultation_id)
+            rows = rows_returned(db, consultation_id)
+            db.close()
+
+            timer = StepTimer()
+            queries = {}
+            for name, load in (("joined", load_joined), ("selectin", load_consultation_detail)):
+                for _ in range(args.runs):
+                    db = SessionLocal()
+                    statements.clear()
+                    with timer.measure(name):
+                        consultation = load(db, consultation_id, doctor.id)
+                        assert len(consultation.chat_messages) == length
+                    queries[name] = len(statements)
+                    db.close()
+
+            print(f"\nchat messages: {length}, symptoms: {SYMPTOMS}, hypotheses: {HYPOTHESES}")
+            for name in ("joined", "selectin"):
+                print(f"{name:<10} rows returned: {rows[name]:>6}   SQL statements: {queries[name]}")
+            print(timer.report())
+    finally:
+        db = SessionLocal()
+        for model in (models.ChatMessage, models.Symptoms, models.Hypothese):
+            db.execute(delete(model).where(model.consultation_id.in_(consultation_ids)))
+        db.execute(delete(models.Consultation).where(models.Consultation.id.in_(consultation_ids)))
+        db.commit()
+        db.close()
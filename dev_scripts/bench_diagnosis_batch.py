@@ -0,0 +1,47 @@
+"""Compares diagnosis throughput (items/second) of the single-item and batched LLM paths
+Run with: python -m dev_scripts.bench_diagnosis_batch [number_of_items] [chunk_size]"""
+import random
+import sys
+import time
+from schemas.llm_service_schemas import SymptomRequest
+from services.llm_service import diagnose_patient_en, diagnose_patients_batch
+
+SYMPTOMS = [
+    "toothache", "bleeding gums", "sensitivity to cold", "sensitivity to heat", "swollen gums",
+    "bad breath", "jaw pain", "loose tooth", "pain when chewing", "dry mouth"
+]
+
+def build_items(count: int) -> list[SymptomRequest]:
+    rng = random.Random(42)
+    return [
+        SymptomRequest(symptoms=rng.sample(SYMPTOMS, rng.randint(1, 4)))
+        for _ in range(count)
+    ]
+
+def bench_single(items: list[SymptomRequest]) -> tuple[float, int]:
+    errors = 0
+    start = time.perf_counter()
+    for item in items:
+        try:
+            diagnose_patient_en(item.symptoms, item.additional_details)
+        except Exception:
+            errors += 1
+    return time.perf_counter() - start, errors
+
+def bench_batch(items: list[SymptomRequest], chunk_size: int) -> tuple[float, int]:
+    start = time.perf_counter()
+    results = diagnose_patients_batch(items, language="en", chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(1 for result in results if result.error)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    items = build_items(count)
+
+    single_time, single_errors = bench_single(items)
+    batch_time, batch_errors = bench_batch(items, chunk_size)
+
+    print(f"items: {count}, chunk size: {chunk_size}")
+    print(f"single : {count / single_time:8.2f} items/s ({single_time:.2f}s, {single_errors} errors)")
+    print(f"batched: {count / batch_time:8.2f} items/s ({batch_time:.2f}s, {batch_errors} errors)")
@@ -0,0 +1,90 @@
+"""Benchmark of the doctor assignment strategies of new consultations:
+- counted: the least loaded doctor found by counting EN_ATTENTE consultations on each assignment
+  (latency only, it is what the maintained counters save)
+- least_pending, round_robin, earliest_free_slot: services/doctor_assignment.py, on the maintained counters
+Reports p50/p95 latency per assignment and, for the counter strategies, the spread of the doctors' pending consultations
+with every chat finished right after its assignment.
+
+Doctor accounts are created directly in the database with uneven starting loads and deleted at the end;
+the assignments of each strategy are rolled back.
+Run with: python -m dev_scripts.bench_doctor_assignment [--doctors 20] [--assignments 500]
+"""
+import argparse
+import random
+import uuid
+from sqlalchemy import delete, func, select
+import models
+from dependencies.database import SessionLocal
+from dev_scripts.bench_utils import StepTimer
+from services.doctor_assignment import STRATEGIES, DoctorAssigner, record_pending
+
+class CountedStrategy:
+    """The previous way to balance the load: one grouped count of the consultations table per assignment"""
+    name = "counted"
+
+    def choose(self, db, doctor_ids):
+        counts = dict(db.execute(
+            select(models.Consultation.doctor_id, func.count())
+            .where(models.Consultation.etat == models.EtatConsultation.EN_ATTENTE)
+            .group_by(models.Consultation.doctor_id)
+        ).all())
+        return min(doctor_ids, key=lambda doctor_id: (counts.get(doctor_id, 0), doctor_id))
+
+def pending_loads(db, doctor_ids: list[int]) -> list[int]:
+    return list(db.execute(
+        select(models.Doctor.pending_consultations).where(models.Doctor.id.in_(doctor_ids))
+    ).scalars())
+
+def create_doctors(count: int) -> list[int]:
+    db = SessionLocal()
+    try:
+        users = [
+            models.User(email=f"bench-doctor-{uuid.uuid4().hex[:12]}@example.com", name="Bench Doctor",
+                        password="-", role=models.RoleUser.DOCTOR)
+            for _ in range(count)
+        ]
+        db.add_all(users)
+        db.flush()
+        # Uneven starting loads, so that the strategies have something to balance
+        db.add_all(models.Doctor(id=user.id, pending_consultations=random.randint(0, 20)) for user in users)
+        db.commit()
+        return [user.id for user in users]
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--assignments", type=int, default=500)
+    args = parser.parse_args()
+
+    doctor_ids = create_doctors(args.doctors)
+    try:
+        timer = StepTimer()
+        strategies = [CountedStrategy()] + [strategy() for strategy in STRATEGIES.values()]
+        for strategy in strategies:
+            # The assigner only sees the bench doctors; the counters incremented below are rolled back
+            assigner = DoctorAssigner(strategy)
+            assigner.doctor_ids = lambda db: doctor_ids
+            db = SessionLocal()
+            try:
+                before = pending_loads(db, doctor_ids)
+                for _ in range(args.assignments):
+                    with timer.measure(strategy.name):
+                        doctor_id = assigner.assign(db)
+                    # As if the chat were finished right away (not timed)
+                    record_pending(db, doctor_id)
+                after = pending_loads(db, doctor_ids)
+            finally:
+                db.rollback()
+                db.close()
+            if strategy.name != "counted":
+                print(f"{strategy.name:<20} pending consultations per doctor: {min(before)}-{max(before)} before, "
+                      f"{min(after)}-{max(after)} after {args.assignments} assignments")
+        print(timer.report())
+    finally:
+        db = SessionLocal()
+        db.execute(delete(models.Doctor).where(models.Doctor.id.in_(doctor_ids)))
+        db.execute(delete(models.User).where(models.User.id.in_(doctor_ids)))
+        db.commit()
+        db.close()
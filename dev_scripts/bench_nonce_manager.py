@@ -0,0 +1,84 @@
+"""Throughput test of concurrent transactions sent through NonceManager on a local chain
+Uses an in-process eth-tester chain (pip install "web3[tester]") or any local node such as Hardhat/Anvil.
+Run with: python -m dev_scripts.bench_nonce_manager [--rpc http://127.0.0.1:8545] [--transactions 200] [--threads 16]
+Add --naive to compare with fetching get_transaction_count for every transaction."""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from eth_account import Account
+from web3 import Web3
+from services.nonce_manager import NonceManager
+
+def connect(rpc: str) -> Web3:
+    if rpc:
+        return Web3(Web3.HTTPProvider(rpc))
+    from web3 import EthereumTesterProvider
+    provider = EthereumTesterProvider()
+    # Keep transactions in the pending pool so they can arrive out of nonce order, like on a real node
+    provider.ethereum_tester.disable_auto_mine_transactions()
+    return Web3(provider)
+
+def mine(w3: Web3) -> None:
+    tester = getattr(w3.provider, "ethereum_tester", None)
+    if tester is not None:
+        tester.mine_blocks(1)
+
+def fund_sender(w3: Web3) -> Account:
+    sender = Account.create()
+    tx_hash = w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": sender.address, "value": w3.to_wei(100, "ether")})
+    mine(w3)
+    w3.eth.wait_for_transaction_receipt(tx_hash)
+    return sender
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpc", default="", help="Local node URL, eth-tester is used when omitted")
+    parser.add_argument("--transactions", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--naive", action="store_true", help="Fetch the nonce from the node for every transaction")
+    args = parser.parse_args()
+
+    w3 = connect(args.rpc)
+    sender = fund_sender(w3)
+    recipient = Account.create().address
+    manager = NonceManager(w3, sender.address)
+    gas_price = w3.eth.gas_price
+
+    def build_transaction(nonce: int) -> dict:
+        return {"from": sender.address, "to": recipient, "value": 1, "gas": 21000, "gasPrice": gas_price, "nonce": nonce, "chainId": w3.eth.chain_id}
+
+    def send_one(_):
+        if args.naive:
+            tx = build_transaction(w3.eth.get_transaction_count(sender.address, "pending"))
+            signed_tx = w3.eth.account.sign_transaction(tx, sender.key)
+            return w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        tx_hash, _ = manager.send_transaction(build_transaction, sender.key)
+        return tx_hash
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        futures = [executor.submit(send_one, i) for i in range(args.transactions)]
+    submitted, failed = [], 0
+    for future in futures:
+        try:
+            submitted.append(future.result())
+        except Exception:
+            failed += 1
+    submit_time = time.perf_counter() - start
+
+    mine(w3)
+    mined = 0
+    for tx_hash in submitted:
+        try:
+            if w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60).status == 1:
+                mined += 1
+        except Exception:
+            pass
+    total_time = time.perf_counter() - start
+    final_nonce = w3.eth.get_transaction_count(sender.address)
+
+    print(f"mode: {'naive' if args.naive else 'nonce manager'}, transactions: {args.transactions}, threads: {args.threads}")
+    print(f"submitted: {len(submitted)}, rejected: {failed}, mined: {mined}, final account nonce: {final_nonce}")
+    print(f"submit throughput: {len(submitted) / submit_time:.1f} tx/s, end-to-end: {mined / total_time:.1f} tx/s")
+    if not args.naive:
+        assert mined == args.transactions == final_nonce, "Every transaction must be mined with a distinct nonce"
@@ -0,0 +1,95 @@
+"""End-to-end latency benchmark of the patient flow:
+create consultation -> N chat turns -> finish -> doctor claim from the review queue -> validate.
+Reports p50/p95/p99 per step.
+
+New consultations are spread over all doctors (DOCTOR_ASSIGNMENT_STRATEGY), so the benchmark doctor reviews
+through the queue, which lets any doctor validate: each flow validates the oldest waiting consultation,
+not necessarily its own. Use a database with no other EN_ATTENTE consultation, they would be validated too.
+
+Start the LLM stand-in and the backend first, e.g.:
+    python -m dev_scripts.llm_stand_in 8001
+    LLM_BASE_URL=http://127.0.0.1:8001 uvicorn main:app --port 8000
+Run with: python -m dev_scripts.bench_patient_flow --doctor-email doc@example.com --doctor-password secret
+"""
+import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dev_scripts.bench_utils import StepTimer
+
+PATIENT_MESSAGES = [
+    "I have a pain in my lower left molar.",
+    "It started three days ago.",
+    "It hurts more with cold drinks.",
+    "My gums bleed a little when I brush.",
+    "No, I have no fever.",
+]
+
+def login(session: requests.Session, api: str, email: str, password: str) -> None:
+    response = session.post(f"{api}/auth/token", data={"username": email, "password": password})
+    response.raise_for_status()
+    session.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+def register_patient(api: str) -> tuple[str, str]:
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    password = "bench-password"
+    response = requests.post(f"{api}/patients/", json={"email": email, "name": "Bench Patient", "password": password})
+    response.raise_for_status()
+    return email, password
+
+def run_flow(api: str, turns: int, doctor: requests.Session, timer: StepTimer) -> None:
+    patient = requests.Session()
+    email, password = register_patient(api)
+    with timer.measure("patient_login"):
+        login(patient, api, email, password)
+
+    with timer.measure("create_consultation"):
+        response = patient.post(f"{api}/consultation-patient/", json={})
+        response.raise_for_status()
+    consultation_id = response.json()["id"]
+
+    for turn in range(turns):
+        with timer.measure("chat_turn"):
+            message = PATIENT_MESSAGES[turn % len(PATIENT_MESSAGES)]
+            patient.post(f"{api}/consultation-patient/{consultation_id}/chat", json={"message": message}).raise_for_status()
+
+    with timer.measure("finish"):
+        patient.post(f"{api}/consultation-patient/{consultation_id}/finish").raise_for_status()
+
+    with timer.measure("doctor_claim"):
+        response = doctor.post(f"{api}/consultation-doctor/queue/claim")
+        response.raise_for_status()
+    claimed_id = response.json()["consultation"]["id"]
+
+    with timer.measure("doctor_validate"):
+        doctor.post(
+            f"{api}/consultation-doctor/consultations/{claimed_id}/validate",
+            json={"doctor_note": "caries on lower left molar, filling needed"}
+        ).raise_for_status()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--doctor-email", required=True)
+    parser.add_argument("--doctor-password", required=True)
+    parser.add_argument("--flows", type=int, default=20, help="Number of complete patient flows")
+    parser.add_argument("--turns", type=int, default=5, help="Chat turns per flow")
+    parser.add_argument("--concurrency", type=int, default=4, help="Flows running in parallel")
+    args = parser.parse_args()
+
+    timer = StepTimer()
+    doctor = requests.Session()
+    login(doctor, args.api, args.doctor_email, args.doctor_password)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_flow, args.api, args.turns, doctor, timer) for _ in range(args.flows)]
+        failures = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                print(f"Flow failed: {e}")
+
+    print(f"flows: {args.flows}, turns: {args.turns}, concurrency: {args.concurrency}, failed flows: {failures}")
+    print(timer.report())
@@ -0,0 +1,96 @@
+"""Benchmark of the profile photo upload processing, with concurrent uploads of a camera-sized JPEG:
+- inline: the previous path, whole upload read, decoded, resized (LANCZOS, 200 px) and encoded on the event loop
+- pool: read_upload_limited and photo_renderer, every rendition (PHOTO_RENDITION_SIZES x PHOTO_RENDITION_FORMATS)
+  rendered in the process pool with draft() decoding
+Reports uploads/sec and the event loop stall: a 5 ms heartbeat task records how late it wakes up,
+which is how long every other request (chat, availability...) would have waited.
+
+No server or database involved, renditions are written to a temporary directory.
+Run with: python -m dev_scripts.bench_photo_upload [--uploads 40] [--concurrency 8] [--width 4000 --height 3000]
+"""
+import argparse
+import asyncio
+import io
+import tempfile
+import time
+from fastapi import UploadFile
+from PIL import Image
+from dependencies.env import PHOTO_MAX_BYTES
+from dev_scripts.bench_utils import percentile
+from services.photo_service import photo_renderer, read_upload_limited
+
+HEARTBEAT_INTERVAL = 0.005
+
+def make_photo(width: int, height: int) -> bytes:
+    """A noisy gradient JPEG (noise keeps the file close to a real photo's size), under PHOTO_MAX_BYTES"""
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    image = Image.blend(gradient, noise, 0.3)
+    for quality in (90, 80, 70, 60, 50):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        if buffer.tell() <= PHOTO_MAX_BYTES:
+            return buffer.getvalue()
+    raise SystemExit("Could not make a photo under PHOTO_MAX_BYTES, use a smaller --width/--height")
+
+async def upload_inline(file: UploadFile, directory: str, stem: str) -> None:
+    contents = await file.read()
+    if len(contents) > 5 * 1024 * 1024:
+        raise ValueError("File too large")
+    image = Image.open(io.BytesIO(contents))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((200, 200), Image.Resampling.LANCZOS)
+    image.save(f"{directory}/{stem}.jpg", format="JPEG", quality=85)
+
+async def upload_pool(file: UploadFile, directory: str, stem: str) -> None:
+    contents = await read_upload_limited(file)
+    await photo_renderer.render(contents, directory, stem)
+
+async def heartbeat(lateness: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + HEARTBEAT_INTERVAL
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lateness.append(max(0.0, time.perf_counter() - expected))
+
+async def run(upload, photo: bytes, uploads: int, concurrency: int, directory: str) -> tuple:
+    lateness = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lateness, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int) -> None:
+        async with semaphore:
+            await upload(UploadFile(file=io.BytesIO(photo), filename="photo.jpg", size=len(photo)), directory, f"user_{index}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(uploads)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return elapsed, lateness
+
+async def main(args) -> None:
+    photo = make_photo(args.width, args.height)
+    print(f"photo: {args.width}x{args.height} JPEG, {len(photo) / 1024 / 1024:.1f} MB; uploads: {args.uploads}, "
+          f"concurrency: {args.concurrency}; renditions: sizes {photo_renderer.sizes}, formats {photo_renderer.formats}, "
+          f"{photo_renderer.workers} worker processes")
+    # Start the worker processes before measuring
+    with tempfile.TemporaryDirectory() as directory:
+        await upload_pool(UploadFile(file=io.BytesIO(photo), filename="photo.jpg"), directory, "warmup")
+
+    print(f"{'path':<8}{'uploads/s':>11}{'stall p50 ms':>14}{'stall p99 ms':>14}{'stall max ms':>14}{'stalled s':>11}")
+    for name, upload in (("inline", upload_inline), ("pool", upload_pool)):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed, lateness = await run(upload, photo, args.uploads, args.concurrency, directory)
+        print(f"{name:<8}{args.uploads / elapsed:>11.1f}{percentile(lateness, 50) * 1000:>14.1f}"
+              f"{percentile(lateness, 99) * 1000:>14.1f}{max(lateness) * 1000:>14.1f}{sum(lateness):>11.2f}")
+    photo_renderer.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    asyncio.run(main(parser.parse_args()))
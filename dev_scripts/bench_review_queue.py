@@ -0,0 +1,124 @@
+"""Contention test of the review queue: many doctors claim EN_ATTENTE consultations at the same time
+until the queue is empty. Checks that no consultation is claimed twice and reports claim latency
+(claims skip locked rows, so latency should not grow with the number of claimers).
+
+Doctor accounts and EN_ATTENTE consultations are created directly in the database and deleted at the end.
+Start the backend first, e.g.: uvicorn main:app --port 8000
+Run with: python -m dev_scripts.bench_review_queue [--doctors 50] [--consultations 2000] [--api http://127.0.0.1:8000]
+"""
+import argparse
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import requests
+from sqlalchemy import delete, update
+import models
+from dependencies.database import SessionLocal
+from dev_scripts.bench_patient_flow import login, register_patient
+from dev_scripts.bench_utils import StepTimer
+
+PASSWORD = "bench-password"
+
+def create_doctors(count: int) -> list[tuple[int, str]]:
+    hashed_password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+    db = SessionLocal()
+    try:
+        users = [
+            models.User(email=f"bench-doctor-{uuid.uuid4().hex[:12]}@example.com", name="Bench Doctor",
+                        password=hashed_password, role=models.RoleUser.DOCTOR)
+            for _ in range(count)
+        ]
+        db.add_all(users)
+        db.flush()
+        db.add_all(models.Doctor(id=user.id) for user in users)
+        db.commit()
+        return [(user.id, user.email) for user in users]
+    finally:
+        db.close()
+
+def create_consultations(count: int, doctor_id: int, patient_id: int) -> list[int]:
+    db = SessionLocal()
+    try:
+        consultations = [
+            models.Consultation(etat=models.EtatConsultation.EN_ATTENTE, doctor_id=doctor_id, patient_id=patient_id)
+            for _ in range(count)
+        ]
+        db.add_all(consultations)
+        db.commit()
+        return [consultation.id for consultation in consultations]
+    finally:
+        db.close()
+
+def cleanup(doctor_ids: list[int], consultation_ids: list[int]) -> None:
+    db = SessionLocal()
+    try:
+        # Real EN_ATTENTE consultations claimed during the test go back to the queue
+        db.execute(update(models.Consultation).where(models.Consultation.claimed_by.in_(doctor_ids))
+                   .values(claimed_by=None, claim_expires_at=None))
+        db.execute(delete(models.Consultation).where(models.Consultation.id.in_(consultation_ids)))
+        db.execute(delete(models.Doctor).where(models.Doctor.id.in_(doctor_ids)))
+        db.execute(delete(models.User).where(models.User.id.in_(doctor_ids)))
+        db.commit()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--doctors", type=int, default=50, help="Concurrent claimers")
+    parser.add_argument("--consultations", type=int, default=2000)
+    args = parser.parse_args()
+
+    email, _ = register_patient(args.api)
+    db = SessionLocal()
+    patient_id = db.query(models.User.id).filter(models.User.email == email).scalar()
+    db.close()
+
+    doctors = create_doctors(args.doctors)
+    doctor_ids = [doctor_id for doctor_id, _ in doctors]
+    consultation_ids = []
+    try:
+        consultation_ids = create_consultations(args.consultations, doctor_ids[0], patient_id)
+        sessions = []
+        for _, doctor_email in doctors:
+            session = requests.Session()
+            login(session, args.api, doctor_email, PASSWORD)
+            sessions.append(session)
+
+        timer = StepTimer()
+        claims = Counter()
+        claims_lock = threading.Lock()
+        barrier = threading.Barrier(len(sessions))
+
+        def claimer(session: requests.Session) -> None:
+            barrier.wait()
+            while True:
+                start = time.perf_counter()
+                response = session.post(f"{args.api}/consultation-doctor/queue/claim")
+                if response.status_code == 404:
+                    return
+                response.raise_for_status()
+                timer.record("claim", time.perf_counter() - start)
+                with claims_lock:
+                    claims[response.json()["consultation"]["id"]] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            futures = [executor.submit(claimer, session) for session in sessions]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        elapsed = time.perf_counter() - start
+
+        duplicates = {consultation_id: count for consultation_id, count in claims.items() if count > 1}
+        unclaimed = set(consultation_ids) - set(claims)
+        print(f"claimers: {args.doctors}, claims: {sum(claims.values())} in {elapsed:.1f}s "
+              f"({sum(claims.values()) / elapsed:.0f}/s), claimer errors: {len(errors)}")
+        print(timer.report())
+        assert not errors, f"Claimers failed: {errors[:3]}"
+        assert not duplicates, f"Consultations claimed more than once: {list(duplicates)[:10]}"
+        assert not unclaimed, f"{len(unclaimed)} seeded consultations were never claimed"
+        print("OK: every consultation claimed exactly once")
+    finally:
+        cleanup(doctor_ids, consultation_ids)
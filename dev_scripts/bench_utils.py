@@ -0,0 +1,53 @@
+"""Shared helpers for the benchmark scripts in dev_scripts"""
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of the samples (pct between 0 and 100)"""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class StepTimer:
+    """Collects latency samples per named step, safe to share between threads"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, step: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors[step] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[step].append(elapsed)
+
+    def record(self, step: str, elapsed: float) -> None:
+        """Adds a sample measured by the caller (e.g. a time to first event)"""
+        with self._lock:
+            self.samples[step].append(elapsed)
+
+    def report(self) -> str:
+        lines = [f"{'step':<24}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for step in list(self.samples) + [step for step in self.errors if step not in self.samples]:
+            samples = self.samples.get(step, [])
+            lines.append(
+                f"{step:<24}{len(samples):>8}{self.errors.get(step, 0):>8}"
+                f"{percentile(samples, 50) * 1000:>10.1f}"
+                f"{percentile(samples, 95) * 1000:>10.1f}"
+                f"{percentile(samples, 99) * 1000:>10.1f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,142 @@
+"""Applies schema changes that create_all cannot make on an existing database (new columns, indexes, backfills)
+Each step is idempotent, run it after pulling changes to models.py
+Run with: python -m dev_scripts.db_migrate"""
+from sqlalchemy import inspect, text
+from dependencies.database import engine
+import models
+from services.availability_index import appointment_slot_key
+from services.doctor_assignment import recount_pending_consultations
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return column in {col["name"] for col in inspect(conn).get_columns(table)}
+
+def index_exists(conn, table: str, index: str) -> bool:
+    return index in {idx["name"] for idx in inspect(conn).get_indexes(table)}
+
+def add_column(conn, table: str, column: str, ddl: str) -> None:
+    if not column_exists(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        print(f"Added column {table}.{column}")
+
+def add_index(conn, table: str, index: str, columns: str) -> None:
+    if not index_exists(conn, table, index):
+        conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+        print(f"Added index {table}.{index}")
+
+def migrate_blockchain_outbox(conn) -> None:
+    add_column(conn, "consultations", "blockchain_status", "ENUM('PENDING','SUBMITTED','CONFIRMED','FAILED') NULL")
+    add_column(conn, "consultations", "blockchain_tx_hash", "VARCHAR(66) NULL")
+
+def migrate_merkle_batches(conn) -> None:
+    add_column(conn, "blockchain_outbox", "kind", "ENUM('DIAGNOSIS','MERKLE_ROOT') NOT NULL DEFAULT 'DIAGNOSIS'")
+    add_column(conn, "blockchain_outbox", "batch_id", "INT NULL, ADD INDEX ix_blockchain_outbox_batch_id (batch_id), ADD FOREIGN KEY (batch_id) REFERENCES blockchain_outbox(id)")
+    conn.execute(text("ALTER TABLE blockchain_outbox MODIFY consultation_id INT NULL"))
+
+def migrate_anchor_fees(conn) -> None:
+    add_column(conn, "blockchain_outbox", "gas_limit", "INT NULL")
+    add_column(conn, "blockchain_outbox", "max_fee_per_gas", "BIGINT NULL")
+    add_column(conn, "blockchain_outbox", "max_priority_fee_per_gas", "BIGINT NULL")
+    add_column(conn, "blockchain_outbox", "gas_used", "INT NULL")
+    add_column(conn, "blockchain_outbox", "effective_gas_price", "BIGINT NULL")
+    add_column(conn, "blockchain_outbox", "fee_paid", "BIGINT NULL")
+    add_column(conn, "blockchain_outbox", "confirmed_at", "TIMESTAMP NULL")
+    add_column(conn, "blockchain_outbox", "raw_tx", "TEXT NULL")
+
+def migrate_appointment_date_index(conn) -> None:
+    add_index(conn, "appointments", "ix_appointments_dateAppointment", "dateAppointment")
+
+def migrate_appointment_slot_key(conn) -> None:
+    add_column(conn, "appointments", "slot_key", "VARCHAR(32) NULL")
+    if index_exists(conn, "appointments", "uq_appointments_slot_key"):
+        return
+    # Backfill active appointments, the oldest keeps the slot when legacy data double booked it
+    rows = conn.execute(text(
+        "SELECT a.id, c.doctor_id, a.dateAppointment FROM appointments a "
+        "JOIN consultations c ON c.id = a.consultation_id "
+        "WHERE a.etat != 'ANNULE' ORDER BY a.id"
+    )).all()
+    taken = set()
+    for appointment_id, doctor_id, date_appointment in rows:
+        key = appointment_slot_key(doctor_id, date_appointment)
+        if key in taken:
+            print(f"Appointment {appointment_id} double books slot {key}, left without slot key")
+            continue
+        taken.add(key)
+        conn.execute(text("UPDATE appointments SET slot_key = :key WHERE id = :id"), {"key": key, "id": appointment_id})
+    conn.execute(text("CREATE UNIQUE INDEX uq_appointments_slot_key ON appointments (slot_key)"))
+    print("Added unique index appointments.uq_appointments_slot_key")
+
+def migrate_appointment_owner_ids(conn) -> None:
+    if not column_exists(conn, "appointments", "doctor_id"):
+        add_column(conn, "appointments", "doctor_id", "INT NULL")
+        add_column(conn, "appointments", "patient_id", "INT NULL")
+        conn.execute(text(
+            "UPDATE appointments a JOIN consultations c ON c.id = a.consultation_id "
+            "SET a.doctor_id = c.doctor_id, a.patient_id = c.patient_id"
+        ))
+        conn.execute(text(
+            "ALTER TABLE appointments MODIFY doctor_id INT NOT NULL, MODIFY patient_id INT NOT NULL, "
+            "ADD FOREIGN KEY (doctor_id) REFERENCES doctors(id), ADD FOREIGN KEY (patient_id) REFERENCES patients(id)"
+        ))
+        print("Backfilled appointments.doctor_id and appointments.patient_id")
+    add_index(conn, "appointments", "ix_appointments_doctor_date_etat", "doctor_id, dateAppointment, etat")
+    add_index(conn, "appointments", "ix_appointments_patient_date", "patient_id, dateAppointment")
+
+def migrate_chat_message_seq(conn) -> None:
+    add_column(conn, "consultations", "last_chat_seq", "INT NOT NULL DEFAULT 0")
+    if not column_exists(conn, "chat_messages", "seq"):
+        add_column(conn, "chat_messages", "seq", "INT NULL")
+        # Number existing messages in their previous order, ties between equal timestamps broken by id
+        conn.execute(text(
+            "UPDATE chat_messages m JOIN ("
+            "SELECT id, ROW_NUMBER() OVER (PARTITION BY consultation_id ORDER BY timestamp, id) AS seq FROM chat_messages"
+            ") numbered ON numbered.id = m.id SET m.seq = numbered.seq"
+        ))
+        conn.execute(text(
+            "UPDATE consultations c JOIN ("
+            "SELECT consultation_id, MAX(seq) AS last_seq FROM chat_messages GROUP BY consultation_id"
+            ") counts ON counts.consultation_id = c.id SET c.last_chat_seq = counts.last_seq"
+        ))
+        conn.execute(text("ALTER TABLE chat_messages MODIFY seq INT NOT NULL"))
+        print("Backfilled chat_messages.seq and consultations.last_chat_seq")
+    if not index_exists(conn, "chat_messages", "uq_chat_messages_consultation_seq"):
+        conn.execute(text("CREATE UNIQUE INDEX uq_chat_messages_consultation_seq ON chat_messages (consultation_id, seq)"))
+        print("Added unique index chat_messages.uq_chat_messages_consultation_seq")
+    add_index(conn, "chat_messages", "ix_chat_messages_consultation_seq_sender", "consultation_id, seq, sender_type")
+
+def migrate_consultation_dashboard_index(conn) -> None:
+    add_index(conn, "consultations", "ix_consultations_doctor_etat_date", "doctor_id, etat, date")
+
+def migrate_review_queue(conn) -> None:
+    add_column(conn, "consultations", "claimed_by", "INT NULL, ADD FOREIGN KEY (claimed_by) REFERENCES doctors(id)")
+    add_column(conn, "consultations", "claim_expires_at", "TIMESTAMP NULL")
+    add_index(conn, "consultations", "ix_consultations_etat_date", "etat, date")
+
+def migrate_doctor_pending_consultations(conn) -> None:
+    add_column(conn, "doctors", "pending_consultations", "INT NOT NULL DEFAULT 0")
+    add_index(conn, "doctors", "ix_doctors_pending_consultations", "pending_consultations, id")
+    # Recounted on every run: backfills the new column and repairs drifted counters
+    changed = recount_pending_consultations(conn)
+    if changed:
+        print(f"Recounted doctors.pending_consultations of {changed} doctors")
+
+MIGRATIONS = [
+    migrate_blockchain_outbox,
+    migrate_merkle_batches,
+    migrate_anchor_fees,
+    migrate_appointment_date_index,
+    migrate_appointment_slot_key,
+    migrate_appointment_owner_ids,
+    migrate_chat_message_seq,
+    migrate_consultation_dashboard_index,
+    migrate_review_queue,
+    migrate_doctor_pending_consultations,
+]
+
+if __name__ == "__main__":
+    # New tables are created directly from the models
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
+    print("Database migrated successfully!")
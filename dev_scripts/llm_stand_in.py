@@ -0,0 +1,182 @@
+"""Deterministic local stand-in for the Colab LLM backend (no GPU or ngrok needed)
+Implements the same endpoints as colab_remote_backend_notebooks/FastAPI_Remote_LLM_backend_prod.ipynb
+(including /chat_stream), with configurable latency, token rate and failure rate.
+
+Run with: python -m dev_scripts.llm_stand_in [port]
+Then start the backend with LLM_BASE_URL=http://127.0.0.1:<port>
+
+Configuration (environment variables):
+    STAND_IN_SEED          Seed of the latency/failure random generator (default 0)
+    STAND_IN_LATENCY       Base latency per request, one of:
+                           fixed:<s> | uniform:<min>,<max> | normal:<mean>,<std> | lognormal:<mu>,<sigma>
+                           (default fixed:0.05)
+    STAND_IN_TOKEN_RATE    Generated tokens per second, 0 disables token pacing (default 50)
+    STAND_IN_FAILURE_RATE  Probability of answering with HTTP 500 (default 0.0)
+"""
+import asyncio
+import hashlib
+import os
+import random
+import sys
+from typing import List, Dict, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import uvicorn
+
+SEED = int(os.getenv("STAND_IN_SEED", "0"))
+LATENCY = os.getenv("STAND_IN_LATENCY", "fixed:0.05")
+TOKEN_RATE = float(os.getenv("STAND_IN_TOKEN_RATE", "50"))
+FAILURE_RATE = float(os.getenv("STAND_IN_FAILURE_RATE", "0.0"))
+
+CONDITIONS = ["Dental caries", "Gingivitis", "Periodontitis", "Pulpitis", "Dental abscess", "Tooth sensitivity", "Bruxism"]
+SYMPTOMS = ["Toothache", "Bleeding gums", "Sensitivity to cold", "Swollen gums", "Bad breath", "Jaw pain"]
+QUESTIONS = [
+    "How long have you had this pain?",
+    "Is the pain constant or does it come and go?",
+    "Do your gums bleed when you brush your teeth?",
+    "Is the tooth sensitive to hot or cold drinks?",
+    "Have you noticed any swelling in your face or gums?",
+]
+
+rng = random.Random(SEED)
+
+class SymptomRequest(BaseModel):
+    symptoms: List[str]
+    additional_details: str = "None"
+
+# Same limit as the notebook
+MAX_BATCH_ITEMS = 32
+
+class BatchSymptomRequest(BaseModel):
+    items: List[SymptomRequest] = Field(..., max_length=MAX_BATCH_ITEMS)
+
+class ChatHistoryRequest(BaseModel):
+    chat_history: List[Dict]
+
+class ImproveNoteRequest(BaseModel):
+    etat: str
+    doctor_note: str
+    chat_history: List[Dict]
+
+def parse_latency(spec: str):
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+sample_latency = parse_latency(LATENCY)
+
+def digest(*parts) -> int:
+    """Stable integer derived from the request content, so equal requests get equal answers"""
+    return int(hashlib.sha256(repr(parts).encode()).hexdigest(), 16)
+
+def generation_time(text: str) -> float:
+    return len(text.split()) / TOKEN_RATE if TOKEN_RATE > 0 else 0.0
+
+async def simulate(text: str = ""):
+    """Waits for the sampled latency plus generation time, and fails at the configured rate"""
+    latency = sample_latency()
+    failed = rng.random() < FAILURE_RATE
+    await asyncio.sleep(latency + generation_time(text))
+    if failed:
+        raise HTTPException(status_code=500, detail="Simulated LLM backend failure")
+
+def fake_diagnosis(symptoms: List[str], details: str) -> List[Dict]:
+    seed = digest(tuple(symptoms), details)
+    picked = [CONDITIONS[(seed >> (8 * i)) % len(CONDITIONS)] for i in range(3)]
+    confidences = sorted(((seed >> (8 * i + 4)) % 60 + 20 for i in range(3)), reverse=True)
+    return [{"condition": condition, "confidence": confidence} for condition, confidence in zip(picked, confidences)]
+
+def fake_reply(chat_history: List[Dict]) -> str:
+    last = chat_history[-1]["content"] if chat_history else ""
+    return QUESTIONS[digest(len(chat_history), last) % len(QUESTIONS)]
+
+app = FastAPI(title="LLM stand-in")
+
+@app.get("/hello")
+async def root():
+    return {"message": "Hello World"}
+
+@app.post("/chat")
+async def chat(request: ChatHistoryRequest):
+    response = fake_reply(request.chat_history)
+    await simulate(response)
+    return {"response": response}
+
+@app.post("/chat_stream")
+async def chat_stream(request: ChatHistoryRequest):
+    response = fake_reply(request.chat_history)
+    await simulate()
+
+    async def tokens():
+        delay = 1 / TOKEN_RATE if TOKEN_RATE > 0 else 0.0
+        for i, word in enumerate(response.split(" ")):
+            await asyncio.sleep(delay)
+            yield word if i == 0 else f" {word}"
+
+    return StreamingResponse(tokens(), media_type="text/plain")
+
+@app.post("/process_chat")
+async def process_chat(request: ChatHistoryRequest):
+    seed = digest(tuple(message.get("content", "") for message in request.chat_history))
+    symptoms = [{"symptom": SYMPTOMS[(seed >> (4 * i)) % len(SYMPTOMS)]} for i in range(seed % 3 + 1)]
+    user_messages = [message["content"] for message in request.chat_history if message.get("role") == "user"]
+    summary = f"The patient exchanged {len(request.chat_history)} messages. " + " ".join(user_messages)[:300]
+    await simulate(summary)
+    return {
+        "symptoms": symptoms,
+        "conditions": fake_diagnosis([s["symptom"] for s in symptoms], "None"),
+        "summary": summary
+    }
+
+@app.post("/improve_note")
+async def improve_note(request: ImproveNoteRequest):
+    improved_note = request.doctor_note.strip().capitalize()
+    if not improved_note.endswith("."):
+        improved_note += "."
+    await simulate(improved_note)
+    return {"improved_note": improved_note}
+
+@app.post("/diagnose-en")
+async def diagnose_en(request: SymptomRequest):
+    await simulate("token " * 40)
+    return {"diagnosis": fake_diagnosis(request.symptoms, request.additional_details)}
+
+@app.post("/diagnose-fr")
+async def diagnose_fr(request: SymptomRequest):
+    await simulate("token " * 40)
+    return {"diagnosis": fake_diagnosis(request.symptoms, request.additional_details)}
+
+async def diagnose_batch(items: List[SymptomRequest]) -> Dict:
+    await simulate("token " * 40 * len(items))
+    results = []
+    for index, item in enumerate(items):
+        error: Optional[str] = None
+        if rng.random() < FAILURE_RATE:
+            error = "Simulated item failure"
+        results.append({
+            "index": index,
+            "diagnosis": None if error else fake_diagnosis(item.symptoms, item.additional_details),
+            "error": error
+        })
+    return {"results": results}
+
+@app.post("/diagnose-batch-en")
+async def diagnose_batch_en(request: BatchSymptomRequest):
+    return await diagnose_batch(request.items)
+
+@app.post("/diagnose-batch-fr")
+async def diagnose_batch_fr(request: BatchSymptomRequest):
+    return await diagnose_batch(request.items)
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    uvicorn.run(app, host="127.0.0.1", port=port)
@@ -0,0 +1,87 @@
+"""Soak test of the consultation chat WebSocket: many concurrent sockets on one backend worker,
+each sending chat turns for the whole duration. Reports time to first token and full turn latency,
+plus connection failures and sockets dropped before the end.
+
+Start the LLM stand-in and a single backend worker first, e.g.:
+    python -m dev_scripts.llm_stand_in 8001
+    LLM_BASE_URL=http://127.0.0.1:8001 uvicorn main:app --port 8000
+Run with: python -m dev_scripts.soak_chat_websocket [--sockets 200] [--duration 120] [--think-time 2]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+from dev_scripts.bench_patient_flow import PATIENT_MESSAGES, login, register_patient
+from dev_scripts.bench_utils import StepTimer
+
+def create_consultation(api: str) -> tuple[str, int]:
+    """Registers a patient and opens an EN_COURS consultation, returns (access token, consultation id)"""
+    session = requests.Session()
+    login(session, api, *register_patient(api))
+    response = session.post(f"{api}/consultation-patient/", json={})
+    response.raise_for_status()
+    return session.headers["Authorization"].split(" ", 1)[1], response.json()["id"]
+
+async def chat_socket(ws_api: str, token: str, consultation_id: int, deadline: float, think_time: float,
+                      timer: StepTimer, counters: dict) -> None:
+    url = f"{ws_api}/consultation-patient/{consultation_id}/chat/ws?token={token}"
+    try:
+        websocket = await connect(url, open_timeout=30)
+    except Exception as e:
+        counters["connect_failed"] += 1
+        print(f"Connection failed: {e}")
+        return
+    counters["connected"] += 1
+    turn = 0
+    try:
+        async with websocket:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(random.uniform(0, 2 * think_time))
+                start = time.perf_counter()
+                await websocket.send(json.dumps({"message": PATIENT_MESSAGES[turn % len(PATIENT_MESSAGES)]}))
+                first_token = None
+                while True:
+                    event = json.loads(await websocket.recv())
+                    if event["type"] == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                        timer.record("first_token", first_token)
+                    elif event["type"] == "done":
+                        timer.record("chat_turn", time.perf_counter() - start)
+                        break
+                    elif event["type"] == "error":
+                        counters["turn_errors"] += 1
+                        break
+                turn += 1
+    except ConnectionClosed as e:
+        counters["dropped"] += 1
+        print(f"Socket of consultation {consultation_id} closed early: {e}")
+
+async def soak(args, consultations) -> None:
+    timer = StepTimer()
+    counters = {"connected": 0, "connect_failed": 0, "dropped": 0, "turn_errors": 0}
+    ws_api = args.api.replace("http", "ws", 1)
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*(
+        chat_socket(ws_api, token, consultation_id, deadline, args.think_time, timer, counters)
+        for token, consultation_id in consultations
+    ))
+    print(f"sockets: {args.sockets}, duration: {args.duration}s, {counters}")
+    print(timer.report())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--sockets", type=int, default=200, help="Concurrent sockets, one patient and consultation each")
+    parser.add_argument("--duration", type=float, default=120, help="Seconds each socket keeps sending turns")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean pause between turns of a socket, in seconds")
+    args = parser.parse_args()
+
+    print(f"Creating {args.sockets} patients and consultations...")
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        consultations = list(executor.map(lambda _: create_consultation(args.api), range(args.sockets)))
+    asyncio.run(soak(args, consultations))
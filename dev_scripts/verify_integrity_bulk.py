@@ -0,0 +1,72 @@
+"""Verifies the integrity of many consultations against the blockchain and reports consultations verified per second
+Prints one NDJSON result per consultation on stdout and the summary on stderr.
+Run with: python -m dev_scripts.verify_integrity_bulk [--ids 1,2,3] [--limit 1000] [--chunk-size 200] [--serial] [--no-cache]
+Without --ids, every consultation anchored on the blockchain (blockchain_status CONFIRMED) is verified.
+--serial runs the one-consultation-per-call path for comparison, --no-cache empties the on-chain cache table first
+so every record is read from the blockchain."""
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+import models
+from dependencies.database import SessionLocal
+from services.integrity_service import verify_consultation, verify_consultations_bulk
+from services.onchain_cache import onchain_cache
+
+def select_ids(db, limit: int) -> list[int]:
+    query = db.query(models.Consultation.id) \
+        .filter(models.Consultation.blockchain_status == models.BlockchainStatus.CONFIRMED) \
+        .order_by(models.Consultation.id)
+    if limit:
+        query = query.limit(limit)
+    return [consultation_id for (consultation_id,) in query.all()]
+
+def verify_serial(db, consultation_ids: list[int]):
+    for consultation_id in consultation_ids:
+        result = {"consultation_id": consultation_id, "is_valid": None, "error": None}
+        consultation = db.get(models.Consultation, consultation_id)
+        if consultation is None:
+            result["error"] = "Consultation not found"
+        else:
+            try:
+                result["is_valid"] = verify_consultation(db, consultation)
+            except Exception as e:
+                result["error"] = str(e)
+        yield result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", default="", help="Comma separated consultation IDs")
+    parser.add_argument("--limit", type=int, default=0, help="Maximum number of anchored consultations to verify")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--serial", action="store_true", help="Verify one consultation at a time")
+    parser.add_argument("--no-cache", action="store_true", help="Read every record from the blockchain")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        consultation_ids = [int(i) for i in args.ids.split(",") if i.strip()] or select_ids(db, args.limit)
+        if args.no_cache:
+            db.query(models.OnChainRecordCache).delete()
+            db.commit()
+
+        results = verify_serial(db, consultation_ids) if args.serial \
+            else verify_consultations_bulk(db, consultation_ids, chunk_size=args.chunk_size)
+        outcomes = Counter()
+        start = time.perf_counter()
+        first_result = None
+        for result in results:
+            if first_result is None:
+                first_result = time.perf_counter() - start
+            outcomes["error" if result["error"] else "valid" if result["is_valid"] else "invalid"] += 1
+            print(json.dumps(result))
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+
+    print(f"mode: {'serial' if args.serial else 'bulk'}, consultations: {len(consultation_ids)}, "
+          f"valid: {outcomes['valid']}, invalid: {outcomes['invalid']}, errors: {outcomes['error']}", file=sys.stderr)
+    print(f"elapsed: {elapsed:.2f}s, first result after: {(first_result or 0):.2f}s, "
+          f"throughput: {len(consultation_ids) / elapsed if elapsed else 0:.1f} consultations/s", file=sys.stderr)
+    print(f"on-chain cache: {onchain_cache.stats()}", file=sys.stderr)
@@ -1,7 +1,13 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dependencies.database import engine
+from dependencies.env import BLOCKCHAIN_ANCHOR_WORKER_ENABLED, BLOCKCHAIN_INDEXER_ENABLED
 import models
+from services.async_blockchain_client import blockchain_client
+from services.blockchain_anchor_service import anchor_worker
+from services.blockchain_indexer import event_indexer
+from services.photo_service import photo_renderer
 from controllers import auth_controller, blockchain_consultation_controller, consultation_patient_controller, consultation_doctor_controller, user_controller, patient_controller, doctor_controller, llm_controller
 
 # # Enable SQLAlchemy logging: Shows SQL queries
@@ -12,10 +18,26 @@ from controllers import auth_controller, blockchain_consultation_controller, con
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Persistent connection pool to the blockchain node
+    await blockchain_client.start()
+    # Background workers
+    if BLOCKCHAIN_ANCHOR_WORKER_ENABLED:
+        anchor_worker.start()
+    if BLOCKCHAIN_INDEXER_ENABLED:
+        event_indexer.start()
+    yield
+    await anchor_worker.stop()
+    await event_indexer.stop()
+    await blockchain_client.stop()
+    photo_renderer.stop()
+
 app = FastAPI(
     title="FastAPI Backend",
     description="Backend that manages DB, LLM and Blockchain.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Middleware
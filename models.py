@@ -1,6 +1,6 @@
 """Contains SQLAlchemy database models inheriting from Base
 Can be used to generate database"""
-from sqlalchemy import Boolean, Column, Integer, String, Float, Date, TIMESTAMP, ForeignKey, Enum, Table, Text
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, Float, Date, TIMESTAMP, ForeignKey, Enum, Table, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from dependencies.database import Base  # Adjust if needed
@@ -22,6 +22,16 @@ class EtatAppointment(enum.Enum):
     COMPLETE = "COMPLETE"
     ANNULE = "ANNULE"
 
+class BlockchainStatus(enum.Enum):
+    PENDING = "PENDING"
+    SUBMITTED = "SUBMITTED"
+    CONFIRMED = "CONFIRMED"
+    FAILED = "FAILED"
+
+class AnchorKind(enum.Enum):
+    DIAGNOSIS = "DIAGNOSIS"      # One addDiagnosis transaction per consultation
+    MERKLE_ROOT = "MERKLE_ROOT"  # One anchorMerkleRoot transaction for a batch of diagnoses
+
 
 class User(Base):
     __tablename__ = "users"
@@ -44,11 +54,17 @@ class User(Base):
 
 class Doctor(Base):
     __tablename__ = "doctors"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        # Least loaded doctor first (see services/doctor_assignment.py)
+        Index("ix_doctors_pending_consultations", "pending_consultations", "id"),
+        {"mysql_engine": "InnoDB"}
+    )
     
     id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     description = Column(Text, nullable=True)
     rating = Column(Float, default=0.0)
+    # Consultations of the doctor waiting for a review (EN_ATTENTE), maintained when a chat is finished and on review
+    pending_consultations = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationship
     user = relationship("User", back_populates="doctor")
@@ -69,7 +85,13 @@ class Patient(Base):
 
 class Consultation(Base):
     __tablename__ = "consultations"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        # Per-doctor counts by etat and oldest-first queues of one etat
+        Index("ix_consultations_doctor_etat_date", "doctor_id", "etat", "date"),
+        # Review queue: oldest consultations of an etat, shared by all doctors
+        Index("ix_consultations_etat_date", "etat", "date"),
+        {"mysql_engine": "InnoDB"}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     date = Column(TIMESTAMP, server_default=func.now(), nullable=False)
@@ -81,6 +103,14 @@ class Consultation(Base):
     prix = Column(Float, nullable=True)
     doctor_id = Column(Integer, ForeignKey('doctors.id'), nullable=False)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
+    # Anchoring of the diagnosis on the blockchain (see BlockchainOutbox)
+    blockchain_status = Column(Enum(BlockchainStatus), nullable=True)
+    blockchain_tx_hash = Column(String(66), nullable=True)
+    # Sequence number of the last chat message, incremented when messages are added (see ChatMessage.seq)
+    last_chat_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # Review queue lease: the doctor reviewing the EN_ATTENTE consultation, until claim_expires_at
+    claimed_by = Column(Integer, ForeignKey('doctors.id'), nullable=True)
+    claim_expires_at = Column(TIMESTAMP, nullable=True)
 
     # Relationships
     doctor = relationship("Doctor", back_populates="consultations", foreign_keys=[doctor_id])
@@ -88,17 +118,28 @@ class Consultation(Base):
     appointment = relationship("Appointment", back_populates="consultation", uselist=False, cascade="all, delete-orphan")
     hypotheses = relationship("Hypothese", back_populates="consultation", cascade="all, delete-orphan")
     symptoms = relationship("Symptoms", back_populates="consultation", cascade="all, delete-orphan")
-    chat_messages = relationship("ChatMessage", back_populates="consultation",cascade="all, delete-orphan",order_by="ChatMessage.timestamp")
+    chat_messages = relationship("ChatMessage", back_populates="consultation",cascade="all, delete-orphan",order_by="ChatMessage.seq")
 
 class Appointment(Base):
     __tablename__ = "appointments"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        UniqueConstraint("slot_key", name="uq_appointments_slot_key"),
+        Index("ix_appointments_doctor_date_etat", "doctor_id", "dateAppointment", "etat"),
+        Index("ix_appointments_patient_date", "patient_id", "dateAppointment"),
+        {"mysql_engine": "InnoDB"}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     dateCreation = Column(TIMESTAMP, server_default=func.now(), nullable=False)
-    dateAppointment = Column(TIMESTAMP, nullable=False)
+    dateAppointment = Column(TIMESTAMP, nullable=False, index=True)
     etat = Column(Enum(EtatAppointment), nullable=False)
     consultation_id = Column(Integer, ForeignKey('consultations.id'), nullable=False)
+    # Copied from the consultation on write so appointment queries need no join
+    doctor_id = Column(Integer, ForeignKey('doctors.id'), nullable=False)
+    patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
+    # "<doctor_id>:<YYYYMMDDHH>" while the appointment holds its slot, NULL once ANNULE:
+    # the unique constraint makes double booking of a doctor's hour impossible
+    slot_key = Column(String(32), nullable=True)
 
     # Relationship
     consultation = relationship("Consultation", back_populates="appointment")
@@ -135,13 +176,109 @@ class MessageSenderType(enum.Enum):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        UniqueConstraint("consultation_id", "seq", name="uq_chat_messages_consultation_seq"),
+        # History reads: range scan in seq order, sender_type read from the index
+        Index("ix_chat_messages_consultation_seq_sender", "consultation_id", "seq", "sender_type"),
+        {"mysql_engine": "InnoDB"}
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     consultation_id = Column(Integer, ForeignKey('consultations.id'), nullable=False)
+    # Position of the message in its consultation (1, 2, ...), allocated from Consultation.last_chat_seq
+    seq = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)  # Using Text instead of String for longer messages
     sender_type = Column(Enum(MessageSenderType), nullable=False)
     timestamp = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     
     # Relationship
-    consultation = relationship("Consultation", back_populates="chat_messages")
\ No newline at end of file
+    consultation = relationship("Consultation", back_populates="chat_messages")
+
+class BlockchainOutbox(Base):
+    """Diagnoses (or Merkle batches of diagnoses) waiting to be anchored on the blockchain,
+    written in the same transaction as the consultation state change and processed by the anchor worker"""
+    __tablename__ = "blockchain_outbox"
+    __table_args__ = (
+        Index("ix_blockchain_outbox_status_next_attempt", "status", "next_attempt_at"),
+        {"mysql_engine": "InnoDB"}
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(Enum(AnchorKind), nullable=False, default=AnchorKind.DIAGNOSIS)
+    consultation_id = Column(Integer, ForeignKey('consultations.id'), nullable=True)  # Null for MERKLE_ROOT entries
+    batch_id = Column(Integer, ForeignKey('blockchain_outbox.id'), nullable=True, index=True)  # MERKLE_ROOT entry anchoring this diagnosis
+    payload = Column(Text, nullable=False)  # DiagnosisRequest, or {"root", "leaf_count"} for MERKLE_ROOT, as JSON
+    status = Column(Enum(BlockchainStatus), nullable=False, default=BlockchainStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    nonce = Column(Integer, nullable=True)
+    replacements = Column(Integer, nullable=False, default=0)
+    tx_hash = Column(String(66), nullable=True)
+    tx_hashes = Column(Text, nullable=True)  # JSON list of every broadcast version (replacements included)
+    raw_tx = Column(Text, nullable=True)  # Last signed version, stored before it is broadcast and sent again on restart
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(TIMESTAMP, nullable=False)
+    submitted_at = Column(TIMESTAMP, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    # Fees of the last broadcast version (maxFeePerGas holds gasPrice for legacy transactions) and cost once mined, in wei
+    gas_limit = Column(Integer, nullable=True)
+    max_fee_per_gas = Column(BigInteger, nullable=True)
+    max_priority_fee_per_gas = Column(BigInteger, nullable=True)
+    gas_used = Column(Integer, nullable=True)
+    effective_gas_price = Column(BigInteger, nullable=True)
+    fee_paid = Column(BigInteger, nullable=True)
+    confirmed_at = Column(TIMESTAMP, nullable=True)
+
+    # Relationship
+    consultation = relationship("Consultation")
+
+class DiagnosisMerkleProof(Base):
+    """Proof that a consultation's diagnosis belongs to a Merkle batch anchored on the blockchain"""
+    __tablename__ = "diagnosis_merkle_proofs"
+    __table_args__ = {"mysql_engine": "InnoDB"}
+
+    consultation_id = Column(Integer, ForeignKey('consultations.id'), primary_key=True)
+    batch_id = Column(Integer, ForeignKey('blockchain_outbox.id'), nullable=False, index=True)
+    leaf_index = Column(Integer, nullable=False)
+    leaf_hash = Column(String(66), nullable=False)
+    proof = Column(Text, nullable=False)  # JSON list of sibling hashes, leaf to root
+
+class OnChainRecordCache(Base):
+    """Decoded contract reads that are final (older than the finality depth) and therefore immutable"""
+    __tablename__ = "onchain_record_cache"
+    __table_args__ = {"mysql_engine": "InnoDB"}
+
+    record_type = Column(String(32), primary_key=True)  # e.g. "diagnosis" (getDiagnosisId), "merkle_root" (getMerkleRoot)
+    record_id = Column(Integer, primary_key=True)
+    payload = Column(Text, nullable=False)  # Decoded result as JSON
+    block_number = Column(Integer, nullable=False)  # Block the record was read at
+    cached_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+
+class IndexerCheckpoint(Base):
+    """Last block processed by a blockchain event indexer, with its hash to detect reorgs"""
+    __tablename__ = "indexer_checkpoints"
+    __table_args__ = {"mysql_engine": "InnoDB"}
+
+    name = Column(String(64), primary_key=True)
+    block_number = Column(Integer, nullable=False)
+    block_hash = Column(String(66), nullable=False)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+class BlockchainEvent(Base):
+    """Contract event (DiagnosisAdded, HashAdded, MerkleRootAnchored) ingested by the event indexer"""
+    __tablename__ = "blockchain_events"
+    __table_args__ = (
+        UniqueConstraint("tx_hash", "log_index", name="uq_blockchain_events_tx_log"),
+        {"mysql_engine": "InnoDB"}
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_name = Column(String(32), nullable=False)
+    block_number = Column(Integer, nullable=False, index=True)
+    block_hash = Column(String(66), nullable=False)
+    tx_hash = Column(String(66), nullable=False)
+    log_index = Column(Integer, nullable=False)
+    diagnosis_id = Column(Integer, nullable=True, index=True)  # Consultation ID for DiagnosisAdded and HashAdded
+    patient_id = Column(Integer, nullable=True)
+    batch_id = Column(Integer, nullable=True, index=True)  # Outbox entry ID for MerkleRootAnchored
+    data = Column(Text, nullable=False)  # Decoded event arguments as JSON
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic.main import BaseModel
 
 class DiagnosisRequest(BaseModel):
@@ -10,4 +11,7 @@ class DiagnosisRequest(BaseModel):
     confidence3: int
     doctor_diagnosis: str
     patient_id: int
-    doctor_id: int
\ No newline at end of file
+    doctor_id: int
+
+class BulkIntegrityRequest(BaseModel):
+    consultation_ids: List[int]
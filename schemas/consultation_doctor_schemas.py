@@ -1,10 +1,11 @@
 from pydantic import BaseModel
 from datetime import date, datetime
-from typing import Optional, List
-from models import EtatConsultation, MessageSenderType, RoleUser
+from typing import Dict, Optional, List
+from models import BlockchainStatus, EtatConsultation, MessageSenderType, RoleUser
 
 class ChatMessage(BaseModel):
     id: int
+    seq: int
     content: str
     sender_type: MessageSenderType
     timestamp: datetime
@@ -23,6 +24,8 @@ class Consultation(BaseModel):
     prix: Optional[float] = None
     doctor_id: int
     patient_id: int
+    blockchain_status: Optional[BlockchainStatus] = None
+    blockchain_tx_hash: Optional[str] = None
     chat_messages: List[ChatMessage] = []
 
     class Config:
@@ -39,10 +42,16 @@ class ConsultationListElement(BaseModel):
     prix: Optional[float] = None
     doctor_id: int
     patient_id: int
+    claimed_by: Optional[int] = None
+    claim_expires_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class ConsultationClaim(BaseModel):
+    consultation: ConsultationListElement
+    claim_expires_at: datetime
+
 class DoctorNoteUpdate(BaseModel):
     doctor_note: str
 
@@ -90,6 +99,19 @@ class ConsultationDetailed(BaseModel):
     class Config:
         from_attributes = True
 
+class DashboardAppointment(BaseModel):
+    id: int
+    dateAppointment: datetime
+    consultation_id: int
+    patient_id: int
+    patient_name: str
+
+class DoctorDashboard(BaseModel):
+    counts: Dict[EtatConsultation, int]
+    oldest_pending: List[ConsultationListElement]
+    today_appointments: List[DashboardAppointment]
+    generated_at: datetime
+
 class BlockchainDiagnosisRequest(BaseModel):
     diagnosis_id: int
     patient_id: int
@@ -1,13 +1,14 @@
 from pydantic import BaseModel
 from datetime import datetime, date
 from typing import Optional, List
-from models import EtatConsultation, EtatAppointment, MessageSenderType
+from models import BlockchainStatus, EtatConsultation, EtatAppointment, MessageSenderType
 
 class ChatMessageCreate(BaseModel):
     content: str
 
 class ChatMessage(BaseModel):
     id: int
+    seq: int
     content: str
     sender_type: MessageSenderType
     timestamp: datetime
@@ -33,6 +34,8 @@ class Consultation(BaseModel):
     prix: Optional[float] = None
     doctor_id: int
     patient_id: int
+    blockchain_status: Optional[BlockchainStatus] = None
+    blockchain_tx_hash: Optional[str] = None
     chat_messages: List[ChatMessage] = []
 
     class Config:
@@ -70,9 +73,27 @@ class Appointment(BaseModel):
 # New schemas for unavailable times
 class UnavailableTimesRequest(BaseModel):
     date: date
+    doctor_id: Optional[int] = None  # Defaults to the first doctor
 
 class TimeSlot(BaseModel):
     start_time: datetime
 
 class UnavailableTimesResponse(BaseModel):
-    unavailable_times: List[TimeSlot]
\ No newline at end of file
+    unavailable_times: List[TimeSlot]
+
+# Schemas for the multi-day availability calendar
+class AvailabilityCalendarRequest(BaseModel):
+    start: date
+    end: date  # Inclusive
+    doctor_id: Optional[int] = None  # Defaults to the first doctor
+
+class DayAvailability(BaseModel):
+    date: date
+    booked: List[TimeSlot]
+    free: List[TimeSlot]  # Working hours not booked
+
+class AvailabilityCalendarResponse(BaseModel):
+    days: List[DayAvailability]
+
+class NextAvailableSlotsResponse(BaseModel):
+    slots: List[TimeSlot]
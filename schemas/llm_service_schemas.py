@@ -1,5 +1,6 @@
-from typing import Dict, List
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+from dependencies.env import LLM_BATCH_MAX_ITEMS
 
 class SymptomRequest(BaseModel):
     symptoms: List[str]
@@ -8,6 +9,18 @@ class SymptomRequest(BaseModel):
 class DiagnosisResponse(BaseModel):
     diagnosis: List[Dict]
 
+class BatchSymptomRequest(BaseModel):
+    # Bounded so that one request cannot hold a worker for an unbounded number of chunks
+    items: List[SymptomRequest] = Field(..., max_length=LLM_BATCH_MAX_ITEMS)
+
+class BatchDiagnosisItem(BaseModel):
+    index: int
+    diagnosis: Optional[List[Dict]] = None
+    error: Optional[str] = None
+
+class BatchDiagnosisResponse(BaseModel):
+    results: List[BatchDiagnosisItem]
+
 class Symptom(BaseModel):
     symptom: str
 
@@ -0,0 +1,92 @@
+"""Non-blocking blockchain client (AsyncWeb3 over one persistent aiohttp session) for the async endpoints"""
+import asyncio
+from typing import Optional
+import aiohttp
+from fastapi import HTTPException
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from dependencies.env import BLOCKCHAIN_URL, DIAGNOSIS_CONTRACT_ADDRESS, BLOCKCHAIN_HTTP_POOL_SIZE, BLOCKCHAIN_HTTP_TIMEOUT
+from schemas.blockchain_consultation_schemas import DiagnosisRequest
+from services.blockchain_consultation_service import (
+    CONTRACT_ABI, MERKLE_BATCH_ABI, diagnosis_record, merkle_root_record, add_diagnosis
+)
+
+class AsyncBlockchainClient:
+    """
+    AsyncWeb3 client sharing one aiohttp session (keep-alive connection pool of BLOCKCHAIN_HTTP_POOL_SIZE)
+    for every request, so chain reads never block the event loop.
+
+    The session is opened and closed by the app lifespan (start/stop). Transactions are still signed, broadcast
+    and replaced through the process-wide nonce manager, in a thread, so nonces stay shared with the anchor worker.
+    """
+
+    def __init__(self, url: str = BLOCKCHAIN_URL, pool_size: int = BLOCKCHAIN_HTTP_POOL_SIZE, timeout: float = BLOCKCHAIN_HTTP_TIMEOUT):
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.w3: Optional[AsyncWeb3] = None
+        self.contract = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self.session is not None:
+                return
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            provider = AsyncHTTPProvider(self.url)
+            await provider.cache_async_session(self.session)
+            self.w3 = AsyncWeb3(provider)
+            self.contract = self.w3.eth.contract(address=DIAGNOSIS_CONTRACT_ADDRESS, abi=CONTRACT_ABI + MERKLE_BATCH_ABI)
+
+    async def stop(self) -> None:
+        async with self._lock:
+            if self.session is not None:
+                await self.session.close()
+            self.session = None
+            self.w3 = None
+            self.contract = None
+
+    async def _client(self) -> AsyncWeb3:
+        # Started by the lifespan, lazily otherwise (scripts, tests)
+        if self.w3 is None:
+            await self.start()
+        return self.w3
+
+    async def get_block_number(self) -> int:
+        w3 = await self._client()
+        return await w3.eth.block_number
+
+    async def get_diagnosis(self, diagnosis_id: int, block_identifier="latest") -> dict:
+        """
+        Retrieves a diagnosis from the blockchain by diagnosis ID, as of the given block
+        """
+        await self._client()
+        try:
+            result = await self.contract.functions.getDiagnosisId(diagnosis_id).call(block_identifier=block_identifier)
+            return diagnosis_record(result)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_merkle_root(self, batch_id: int, block_identifier="latest") -> dict:
+        """
+        Retrieves the Merkle root anchored for a batch of diagnoses, as of the given block
+        """
+        await self._client()
+        try:
+            result = await self.contract.functions.getMerkleRoot(batch_id).call(block_identifier=block_identifier)
+            return merkle_root_record(batch_id, result)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def add_diagnosis(self, diagnosis: DiagnosisRequest) -> dict:
+        """
+        Adds a diagnosis to the blockchain and awaits its receipt, replacing the transaction
+        with higher fees every BLOCKCHAIN_TX_TIMEOUT seconds it stays pending.
+        Sending and replacing go through the nonce manager (NonceManager.wait_or_replace), in a thread.
+        """
+        return await asyncio.to_thread(add_diagnosis, diagnosis)
+
+blockchain_client = AsyncBlockchainClient()
@@ -0,0 +1,198 @@
+"""In-memory index of the booked hourly appointment slots of each doctor"""
+import logging
+import threading
+import time as clock
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Tuple
+from sqlalchemy.orm import Session
+import models
+from dependencies.env import AVAILABILITY_INDEX_TTL, AVAILABILITY_INDEX_MAX_DAYS, WORKING_HOURS_START, WORKING_HOURS_END, WORKING_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Bit n set for every working hour n
+WORKING_HOURS_MASK = sum(1 << hour for hour in range(WORKING_HOURS_START, WORKING_HOURS_END))
+
+def appointment_slot_key(doctor_id: int, slot: datetime) -> str:
+    """Value of Appointment.slot_key for an appointment of the doctor in the hour starting at slot"""
+    return f"{doctor_id}:{slot:%Y%m%d%H}"
+
+class AvailabilityIndex:
+    """
+    Keeps, per (doctor, day), a 24-bit bitmap of the hours holding an appointment that is not ANNULE.
+
+    - Days are loaded from the database on first use (one range scan for consecutive days) and kept for AVAILABILITY_INDEX_TTL seconds,
+      so appointments booked by other processes are seen after at most that delay.
+    - Booking sets the bit in place. Cancelling or moving an appointment drops the day, which is reloaded
+      on the next lookup (another appointment may still hold the same hour).
+    - Reloading an expired day compares it with the cached bitmap: any difference is logged and counted
+      in mismatches, which should stay at 0 in a single process.
+    At most AVAILABILITY_INDEX_MAX_DAYS days are kept, least recently used first out.
+    """
+
+    def __init__(self, ttl: float = AVAILABILITY_INDEX_TTL, max_days: int = AVAILABILITY_INDEX_MAX_DAYS):
+        self.ttl = ttl
+        self.max_days = max_days
+        self._days: "OrderedDict[Tuple[int, date], Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.mismatches = 0
+
+    def _load_range(self, db: Session, doctor_id: int, first_day: date, last_day: date) -> Dict[date, int]:
+        """Loads the bitmaps of consecutive days with one range scan on (doctor_id, dateAppointment, etat)"""
+        start = datetime.combine(first_day, time(0, 0))
+        end = datetime.combine(last_day, time(0, 0)) + timedelta(days=1)
+        rows = db.query(models.Appointment.dateAppointment).filter(
+            models.Appointment.doctor_id == doctor_id,
+            models.Appointment.etat != models.EtatAppointment.ANNULE,
+            models.Appointment.dateAppointment >= start,
+            models.Appointment.dateAppointment < end
+        ).all()
+        bitmaps = {first_day + timedelta(days=offset): 0 for offset in range((last_day - first_day).days + 1)}
+        for (date_appointment,) in rows:
+            bitmaps[date_appointment.date()] |= 1 << date_appointment.hour
+        return bitmaps
+
+    def _fresh(self, key: Tuple[int, date]):
+        """Cached bitmap of a day if it has not expired (lock held), and the cached entry"""
+        cached = self._days.get(key)
+        if cached is not None and clock.monotonic() - cached[1] < self.ttl:
+            self._days.move_to_end(key)
+            self.hits += 1
+            return cached[0], cached
+        return None, cached
+
+    def _store(self, doctor_id: int, bitmaps: Dict[date, int], previous: Dict[date, tuple]) -> None:
+        with self._lock:
+            self.loads += len(bitmaps)
+            for day, bitmap in bitmaps.items():
+                cached = previous.get(day)
+                if cached is not None and cached[0] != bitmap:
+                    self.mismatches += 1
+                    logger.warning("Availability index out of sync for doctor %s on %s: cached %s, database %s",
+                                   doctor_id, day, bin(cached[0]), bin(bitmap))
+                self._days[(doctor_id, day)] = (bitmap, clock.monotonic())
+                self._days.move_to_end((doctor_id, day))
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+
+    def bitmaps(self, db: Session, doctor_id: int, first_day: date, last_day: date) -> Dict[date, int]:
+        """
+        Returns the booked hours of a doctor for each day from first_day to last_day (inclusive),
+        bit n set when hour n is booked. Days missing from the index are loaded with a single query.
+        """
+        days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+        bitmaps, previous = {}, {}
+        with self._lock:
+            for day in days:
+                bitmap, cached = self._fresh((doctor_id, day))
+                if bitmap is not None:
+                    bitmaps[day] = bitmap
+                elif cached is not None:
+                    previous[day] = cached
+
+        missing = [day for day in days if day not in bitmaps]
+        if missing:
+            loaded = self._load_range(db, doctor_id, missing[0], missing[-1])
+            loaded = {day: loaded[day] for day in missing}
+            self._store(doctor_id, loaded, previous)
+            bitmaps.update(loaded)
+        return bitmaps
+
+    def bitmap(self, db: Session, doctor_id: int, day: date) -> int:
+        """Returns the booked hours of a doctor on a day, bit n set when hour n is booked"""
+        return self.bitmaps(db, doctor_id, day, day)[day]
+
+    def booked_hours(self, db: Session, doctor_id: int, day: date) -> List[int]:
+        bitmap = self.bitmap(db, doctor_id, day)
+        return [hour for hour in range(24) if bitmap >> hour & 1]
+
+    def is_booked(self, db: Session, doctor_id: int, slot: datetime) -> bool:
+        """Whether the hour starting at slot already holds an appointment of the doctor"""
+        return bool(self.bitmap(db, doctor_id, slot.date()) >> slot.hour & 1)
+
+    def free_hours(self, day: date, bitmap: int) -> List[int]:
+        """Working hours (WORKING_HOURS_START to WORKING_HOURS_END on WORKING_DAYS) not set in the bitmap"""
+        if day.weekday() not in WORKING_DAYS:
+            return []
+        free = WORKING_HOURS_MASK & ~bitmap
+        return [hour for hour in range(24) if free >> hour & 1]
+
+    def next_free_slots(self, db: Session, doctor_id: int, after: datetime, count: int, horizon_days: int) -> List[datetime]:
+        """
+        Returns the first count free working-hour slots of a doctor starting at or after after,
+        looking at most horizon_days ahead.
+
+        Days are scanned in windows (one range scan each, starting with a week and doubling),
+        so the search stops as soon as enough free slots are found.
+        """
+        first_hour = after.replace(minute=0, second=0, microsecond=0)
+        if first_hour < after:
+            first_hour += timedelta(hours=1)
+        last_day = after.date() + timedelta(days=horizon_days)
+
+        slots: List[datetime] = []
+        window_start, window_days = first_hour.date(), 7
+        while window_start <= last_day and len(slots) < count:
+            window_end = min(last_day, window_start + timedelta(days=window_days - 1))
+            for day, bitmap in sorted(self.bitmaps(db, doctor_id, window_start, window_end).items()):
+                if day.weekday() not in WORKING_DAYS:
+                    continue
+                free = WORKING_HOURS_MASK & ~bitmap
+                if day == first_hour.date():
+                    free &= ~((1 << first_hour.hour) - 1)  # Hours already past
+                while free and len(slots) < count:
+                    hour = (free & -free).bit_length() - 1  # Lowest free hour
+                    slots.append(datetime.combine(day, time(hour, 0)))
+                    free &= free - 1
+                if len(slots) >= count:
+                    break
+            window_start, window_days = window_end + timedelta(days=1), window_days * 2
+        return slots
+
+    def book(self, doctor_id: int, slot: datetime) -> None:
+        """Records a committed appointment"""
+        key = (doctor_id, slot.date())
+        with self._lock:
+            cached = self._days.get(key)
+            if cached is not None:
+                self._days[key] = (cached[0] | 1 << slot.hour, cached[1])
+
+    def release(self, doctor_id: int, slot: datetime) -> None:
+        """Records that an appointment left the slot (cancelled or moved)"""
+        with self._lock:
+            self._days.pop((doctor_id, slot.date()), None)
+
+    def check_consistency(self, db: Session) -> dict:
+        """
+        Compares every cached day with the database (one range scan per doctor). Differences are logged,
+        counted in mismatches and dropped from the index, so the next lookup reloads them.
+        """
+        with self._lock:
+            cached: Dict[int, Dict[date, int]] = {}
+            for (doctor_id, day), (bitmap, _) in self._days.items():
+                cached.setdefault(doctor_id, {})[day] = bitmap
+
+        mismatched = 0
+        for doctor_id, days in cached.items():
+            loaded = self._load_range(db, doctor_id, min(days), max(days))
+            for day, bitmap in days.items():
+                if loaded[day] == bitmap:
+                    continue
+                mismatched += 1
+                logger.warning("Availability index out of sync for doctor %s on %s: cached %s, database %s",
+                               doctor_id, day, bin(bitmap), bin(loaded[day]))
+                with self._lock:
+                    # Unless it was reloaded in the meantime
+                    if self._days.get((doctor_id, day), (None,))[0] == bitmap:
+                        self._days.pop((doctor_id, day))
+        with self._lock:
+            self.mismatches += mismatched
+        return {"checked_days": sum(len(days) for days in cached.values()), "mismatched_days": mismatched}
+
+    def stats(self) -> dict:
+        return {"days": len(self._days), "hits": self.hits, "loads": self.loads, "mismatches": self.mismatches}
+
+availability_index = AvailabilityIndex()
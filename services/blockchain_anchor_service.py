@@ -0,0 +1,398 @@
+"""Durable anchoring of validated diagnoses on the blockchain (transactional outbox + worker)"""
+import asyncio
+import json
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from web3 import Web3
+import models
+from dependencies.database import SessionLocal
+from dependencies.env import (
+    BLOCKCHAIN_ANCHOR_POLL_INTERVAL, BLOCKCHAIN_ANCHOR_BATCH_SIZE, BLOCKCHAIN_ANCHOR_MAX_ATTEMPTS,
+    BLOCKCHAIN_ANCHOR_BACKOFF_SECONDS, BLOCKCHAIN_TX_TIMEOUT, BLOCKCHAIN_MAX_REPLACEMENTS,
+    BLOCKCHAIN_ANCHOR_MODE, BLOCKCHAIN_MERKLE_BATCH_SIZE, BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT
+)
+from schemas.blockchain_consultation_schemas import DiagnosisRequest
+from services.blockchain_consultation_service import (
+    build_add_diagnosis_transaction, build_anchor_merkle_root_transaction, sign_transaction, sign_replacement,
+    broadcast_transaction, rebroadcast_raw_transaction, get_transaction_receipts, fee_oracle, nonce_manager
+)
+from services.merkle_service import build_merkle_tree, diagnosis_leaf, merkle_proof, merkle_root
+from services.nonce_manager import is_rejected
+
+logger = logging.getLogger(__name__)
+
+def build_diagnosis_request(consultation: models.Consultation) -> DiagnosisRequest:
+    """
+    Builds the on-chain diagnosis record of a consultation (doctor diagnosis and up to 3 hypotheses)
+    """
+    hypotheses = consultation.hypotheses or []
+    return DiagnosisRequest(
+        diagnosis_id=consultation.id,
+        patient_id=consultation.patient_id,
+        doctor_id=consultation.doctor_id,
+        doctor_diagnosis=consultation.diagnosis or "",
+        condition1=hypotheses[0].condition if len(hypotheses) > 0 else "",
+        confidence1=hypotheses[0].confidence if len(hypotheses) > 0 else 0,
+        condition2=hypotheses[1].condition if len(hypotheses) > 1 else "",
+        confidence2=hypotheses[1].confidence if len(hypotheses) > 1 else 0,
+        condition3=hypotheses[2].condition if len(hypotheses) > 2 else "",
+        confidence3=hypotheses[2].confidence if len(hypotheses) > 2 else 0
+    )
+
+def enqueue_diagnosis_anchor(db: Session, consultation: models.Consultation) -> models.BlockchainOutbox:
+    """
+    Adds the consultation's diagnosis to the blockchain outbox.
+    The row is only added to the session: it is committed together with the consultation update.
+    """
+    entry = models.BlockchainOutbox(
+        kind=models.AnchorKind.DIAGNOSIS,
+        consultation_id=consultation.id,
+        payload=build_diagnosis_request(consultation).model_dump_json(),
+        status=models.BlockchainStatus.PENDING,
+        attempts=0,
+        replacements=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    consultation.blockchain_status = models.BlockchainStatus.PENDING
+    consultation.blockchain_tx_hash = None
+    db.add(entry)
+    return entry
+
+def backoff_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BLOCKCHAIN_ANCHOR_BACKOFF_SECONDS * 2 ** (attempts - 1), 3600))
+
+def build_anchor_transaction(entry: models.BlockchainOutbox, nonce: int, fees: Optional[dict] = None) -> dict:
+    """
+    Builds the unsigned transaction anchoring an outbox entry (addDiagnosis or anchorMerkleRoot)
+    """
+    payload = json.loads(entry.payload)
+    if entry.kind == models.AnchorKind.MERKLE_ROOT:
+        return build_anchor_merkle_root_transaction(entry.id, payload["root"], payload["leaf_count"], nonce, fees)
+    return build_add_diagnosis_transaction(DiagnosisRequest(**payload), nonce, fees)
+
+def record_fees(entry: models.BlockchainOutbox, tx: dict) -> None:
+    """Stores the gas limit and fees of the version of the transaction just broadcast"""
+    entry.gas_limit = tx["gas"]
+    entry.max_fee_per_gas = tx.get("maxFeePerGas", tx.get("gasPrice"))
+    entry.max_priority_fee_per_gas = tx.get("maxPriorityFeePerGas")
+
+def entry_fees(entry: models.BlockchainOutbox) -> dict:
+    """Fee fields of the last broadcast version of an entry's transaction"""
+    if entry.max_priority_fee_per_gas is None:
+        return {"gasPrice": entry.max_fee_per_gas}
+    return {"maxFeePerGas": entry.max_fee_per_gas, "maxPriorityFeePerGas": entry.max_priority_fee_per_gas}
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of the samples (pct between 0 and 100)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+def anchor_metrics(db: Session, limit: int = 1000) -> dict:
+    """
+    Confirmation latency (from enqueue to receipt) and cost of the last confirmed anchoring transactions.
+    Cost per diagnosis divides a Merkle root transaction's fee between the diagnoses of its batch.
+    """
+    entries = db.query(models.BlockchainOutbox).filter(
+        models.BlockchainOutbox.status == models.BlockchainStatus.CONFIRMED,
+        models.BlockchainOutbox.confirmed_at.isnot(None),
+        models.BlockchainOutbox.fee_paid.isnot(None)
+    ).order_by(models.BlockchainOutbox.confirmed_at.desc()).limit(limit).all()
+
+    latencies = [(entry.confirmed_at - entry.created_at).total_seconds() for entry in entries]
+    fees = [entry.fee_paid for entry in entries]
+    diagnoses = sum(json.loads(entry.payload)["leaf_count"] if entry.kind == models.AnchorKind.MERKLE_ROOT else 1 for entry in entries)
+    return {
+        "transactions": len(entries),
+        "diagnoses": diagnoses,
+        "replacements": sum(entry.replacements for entry in entries),
+        "confirmation_latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies) if latencies else None
+        },
+        "fee_paid_wei": {
+            "p50": percentile(fees, 50),
+            "p95": percentile(fees, 95),
+            "total": sum(fees)
+        },
+        "fee_per_diagnosis_wei": sum(fees) // diagnoses if diagnoses else None,
+        "gas_used_avg": sum(entry.gas_used for entry in entries) / len(entries) if entries else None
+    }
+
+class AnchorWorker:
+    """
+    Submits pending outbox entries and polls the receipts of submitted ones in batches.
+
+    In "merkle" mode (BLOCKCHAIN_ANCHOR_MODE), pending diagnoses are grouped every
+    BLOCKCHAIN_MERKLE_BATCH_SIZE diagnoses or BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT seconds:
+    a single anchorMerkleRoot transaction is sent per batch and every consultation
+    keeps its Merkle proof in diagnosis_merkle_proofs.
+
+    - Submission failures are retried with exponential backoff, up to BLOCKCHAIN_ANCHOR_MAX_ATTEMPTS.
+      A broadcast that failed without a definite rejection is sent again as the same signed transaction.
+    - Transactions pending longer than BLOCKCHAIN_TX_TIMEOUT are replaced with higher fees.
+    - The final status is recorded on the consultation (blockchain_status, blockchain_tx_hash).
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, and a PENDING entry is committed as SUBMITTED
+    (with its nonce and signed transaction) before it is broadcast, so no entry is anchored twice when several
+    processes run the worker. The nonce manager is per process though: processes sharing the account re-sync
+    on "nonce too low", enable the worker (BLOCKCHAIN_ANCHOR_WORKER_ENABLED) in a single process to avoid it.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = BLOCKCHAIN_ANCHOR_BATCH_SIZE,
+                 poll_interval: float = BLOCKCHAIN_ANCHOR_POLL_INTERVAL, mode: str = BLOCKCHAIN_ANCHOR_MODE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.mode = mode
+        self._task: Optional[asyncio.Task] = None
+        self._recovered = False
+
+    def _claim(self, db: Session, status: models.BlockchainStatus, due_only: bool, limit: Optional[int] = None):
+        query = db.query(models.BlockchainOutbox).filter(models.BlockchainOutbox.status == status)
+        if due_only:
+            query = query.filter(models.BlockchainOutbox.next_attempt_at <= datetime.utcnow())
+        if status == models.BlockchainStatus.PENDING and self.mode == "merkle":
+            # Single diagnoses are anchored through batches in merkle mode
+            query = query.filter(models.BlockchainOutbox.kind == models.AnchorKind.MERKLE_ROOT)
+        if status == models.BlockchainStatus.SUBMITTED:
+            # Batched diagnoses have no transaction of their own
+            query = query.filter(models.BlockchainOutbox.tx_hashes.isnot(None))
+        return query.order_by(models.BlockchainOutbox.id).limit(limit or self.batch_size).with_for_update(skip_locked=True).all()
+
+    def _members(self, db: Session, entry: models.BlockchainOutbox):
+        """Diagnosis entries anchored by an entry: itself, or every diagnosis of a Merkle batch"""
+        if entry.kind == models.AnchorKind.MERKLE_ROOT:
+            return db.query(models.BlockchainOutbox).filter(models.BlockchainOutbox.batch_id == entry.id).all()
+        return [entry]
+
+    def _set_final_status(self, db: Session, entry: models.BlockchainOutbox, status: models.BlockchainStatus) -> None:
+        entry.status = status
+        for member in self._members(db, entry):
+            member.status = status
+            member.tx_hash = entry.tx_hash
+            member.consultation.blockchain_status = status
+            member.consultation.blockchain_tx_hash = entry.tx_hash
+
+    def batch_pending(self, db: Session) -> int:
+        """
+        Groups pending diagnoses into a Merkle batch once BLOCKCHAIN_MERKLE_BATCH_SIZE are waiting
+        or the oldest has waited BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT seconds, and stores their proofs.
+        """
+        entries = db.query(models.BlockchainOutbox).filter(
+            models.BlockchainOutbox.kind == models.AnchorKind.DIAGNOSIS,
+            models.BlockchainOutbox.status == models.BlockchainStatus.PENDING,
+            models.BlockchainOutbox.batch_id.is_(None)
+        ).order_by(models.BlockchainOutbox.id).limit(BLOCKCHAIN_MERKLE_BATCH_SIZE).with_for_update(skip_locked=True).all()
+
+        oldest_wait = datetime.utcnow() - entries[0].next_attempt_at if entries else timedelta(0)
+        if not entries or (len(entries) < BLOCKCHAIN_MERKLE_BATCH_SIZE and oldest_wait < timedelta(seconds=BLOCKCHAIN_MERKLE_BATCH_MAX_WAIT)):
+            db.rollback()
+            return 0
+
+        levels = build_merkle_tree([diagnosis_leaf(DiagnosisRequest(**json.loads(entry.payload))) for entry in entries])
+        batch = models.BlockchainOutbox(
+            kind=models.AnchorKind.MERKLE_ROOT,
+            payload=json.dumps({"root": Web3.to_hex(merkle_root(levels)), "leaf_count": len(entries)}),
+            status=models.BlockchainStatus.PENDING,
+            attempts=0,
+            replacements=0,
+            next_attempt_at=datetime.utcnow()
+        )
+        db.add(batch)
+        db.flush()  # The outbox id of the batch is its on-chain batch id
+
+        for index, entry in enumerate(entries):
+            entry.batch_id = batch.id
+            entry.status = models.BlockchainStatus.SUBMITTED
+            entry.consultation.blockchain_status = models.BlockchainStatus.SUBMITTED
+            db.merge(models.DiagnosisMerkleProof(
+                consultation_id=entry.consultation_id,
+                batch_id=batch.id,
+                leaf_index=index,
+                leaf_hash=Web3.to_hex(levels[0][index]),
+                proof=json.dumps([Web3.to_hex(node) for node in merkle_proof(levels, index)])
+            ))
+        db.commit()
+        return len(entries)
+
+    def _submit_failed(self, db: Session, entry: models.BlockchainOutbox, error: Exception) -> None:
+        entry.last_error = str(error)
+        if entry.attempts >= BLOCKCHAIN_ANCHOR_MAX_ATTEMPTS:
+            self._set_final_status(db, entry, models.BlockchainStatus.FAILED)
+        else:
+            entry.next_attempt_at = datetime.utcnow() + backoff_delay(entry.attempts)
+
+    def submit_pending(self, db: Session) -> int:
+        """
+        Broadcasts the due PENDING entries, one transaction each: the entry is claimed, signed and committed
+        as SUBMITTED with its nonce and signed transaction, then broadcast. Once committed no other worker can
+        claim it, and a crash before the broadcast is recovered by recover_submitted. Only a definite rejection
+        by the node (is_rejected) puts the entry back to PENDING with its nonce released.
+        """
+        count = 0
+        for _ in range(self.batch_size):
+            entries = self._claim(db, models.BlockchainStatus.PENDING, due_only=True, limit=1)
+            if not entries:
+                break
+            entry = entries[0]
+            count += 1
+            entry.attempts += 1
+            try:
+                signed_tx, tx = sign_transaction(lambda nonce: build_anchor_transaction(entry, nonce))
+            except Exception as e:
+                self._submit_failed(db, entry, e)
+                db.commit()
+                continue
+
+            # Step 1: Persist the signed transaction, releasing the row lock with the entry no longer PENDING
+            entry.status = models.BlockchainStatus.SUBMITTED
+            entry.nonce = tx["nonce"]
+            entry.tx_hash = Web3.to_hex(signed_tx.hash)
+            entry.tx_hashes = json.dumps([entry.tx_hash])
+            entry.raw_tx = Web3.to_hex(signed_tx.raw_transaction)
+            entry.submitted_at = datetime.utcnow()
+            record_fees(entry, tx)
+            entry.last_error = None
+            if entry.consultation is not None:
+                entry.consultation.blockchain_status = models.BlockchainStatus.SUBMITTED
+                entry.consultation.blockchain_tx_hash = entry.tx_hash
+            db.commit()
+
+            # Step 2: Broadcast it, back to PENDING only if the node refused it for certain. After any other
+            # error (timeout, dropped connection) the node may have it: the entry stays SUBMITTED and
+            # poll_submitted broadcasts the same signed transaction again, never a second one for the entry.
+            try:
+                broadcast_transaction(signed_tx)
+            except Exception as e:
+                if not is_rejected(e):
+                    entry.last_error = str(e)
+                    db.commit()
+                    continue
+                nonce_manager.abandon(tx["nonce"], e)
+                entry.status = models.BlockchainStatus.PENDING
+                entry.nonce = None
+                entry.tx_hash = None
+                entry.tx_hashes = None
+                entry.raw_tx = None
+                if entry.consultation is not None:
+                    entry.consultation.blockchain_status = models.BlockchainStatus.PENDING
+                    entry.consultation.blockchain_tx_hash = None
+                self._submit_failed(db, entry, e)
+                db.commit()
+        return count
+
+    def recover_submitted(self, db: Session) -> int:
+        """
+        Broadcasts again the last signed transaction of every SUBMITTED entry, run once when the worker starts:
+        a process stopped between committing an entry and broadcasting it left a transaction the node never saw.
+        Transactions the node already has, or already mined, are skipped.
+        """
+        entries = self._claim(db, models.BlockchainStatus.SUBMITTED, due_only=False, limit=10_000)
+        for entry in entries:
+            if entry.raw_tx:
+                try:
+                    rebroadcast_raw_transaction(entry.raw_tx)
+                except Exception as e:
+                    entry.last_error = str(e)
+        db.commit()
+        return len(entries)
+
+    def _replace_stuck(self, entry: models.BlockchainOutbox) -> None:
+        """Re-broadcasts a stuck transaction with the same nonce and higher fees"""
+        if entry.replacements >= BLOCKCHAIN_MAX_REPLACEMENTS:
+            return
+        tx = build_anchor_transaction(entry, entry.nonce, fee_oracle.replacement_fees(entry_fees(entry)))
+        signed_tx = sign_replacement(tx)
+        try:
+            tx_hash = Web3.to_hex(broadcast_transaction(signed_tx))
+        except Exception as e:
+            entry.last_error = str(e)
+            return
+        entry.replacements += 1
+        entry.tx_hash = tx_hash
+        entry.raw_tx = Web3.to_hex(signed_tx.raw_transaction)
+        entry.tx_hashes = json.dumps(json.loads(entry.tx_hashes or "[]") + [tx_hash])
+        entry.submitted_at = datetime.utcnow()
+        record_fees(entry, tx)
+        if entry.consultation is not None:
+            entry.consultation.blockchain_tx_hash = tx_hash
+
+    def poll_submitted(self, db: Session) -> int:
+        """Checks the receipts of SUBMITTED entries with one batched JSON-RPC call"""
+        entries = self._claim(db, models.BlockchainStatus.SUBMITTED, due_only=False)
+        hashes_by_entry = {entry.id: json.loads(entry.tx_hashes or "[]") for entry in entries}
+        receipts = get_transaction_receipts([tx_hash for hashes in hashes_by_entry.values() for tx_hash in hashes])
+
+        for entry in entries:
+            mined = next(
+                ((tx_hash, receipts[tx_hash]) for tx_hash in hashes_by_entry[entry.id] if receipts.get(tx_hash)),
+                None
+            )
+            if mined:
+                entry.tx_hash = mined[0]
+                entry.gas_used = mined[1]["gas_used"]
+                entry.effective_gas_price = mined[1]["effective_gas_price"]
+                entry.fee_paid = entry.gas_used * entry.effective_gas_price
+                # Same clock as the created_at server default
+                entry.confirmed_at = func.now()
+                logger.info("Anchor %s mined after %s replacements, fee paid %s wei", entry.id, entry.replacements, entry.fee_paid)
+                if mined[1]["status"] == 1:
+                    self._set_final_status(db, entry, models.BlockchainStatus.CONFIRMED)
+                else:
+                    entry.last_error = "Transaction reverted"
+                    self._set_final_status(db, entry, models.BlockchainStatus.FAILED)
+            elif entry.submitted_at and datetime.utcnow() - entry.submitted_at > timedelta(seconds=BLOCKCHAIN_TX_TIMEOUT):
+                self._replace_stuck(entry)
+            elif entry.last_error and entry.raw_tx:
+                # The last broadcast failed without a definite rejection: send the same transaction again
+                try:
+                    rebroadcast_raw_transaction(entry.raw_tx)
+                    entry.last_error = None
+                except Exception as e:
+                    entry.last_error = str(e)
+        db.commit()
+        return len(entries)
+
+    def run_once(self) -> None:
+        db = self.session_factory()
+        try:
+            if not self._recovered:
+                self.recover_submitted(db)
+                self._recovered = True
+            if self.mode == "merkle":
+                self.batch_pending(db)
+            self.submit_pending(db)
+            self.poll_submitted(db)
+        except Exception:
+            db.rollback()
+            logger.exception("Blockchain anchor worker iteration failed")
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        while True:
+            # web3 and SQLAlchemy calls are blocking: keep them off the event loop
+            await asyncio.to_thread(self.run_once)
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+anchor_worker = AnchorWorker()
@@ -1,8 +1,13 @@
 """Contains the methods that communicate with the Blockchain"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from fastapi import HTTPException
 from web3 import Web3
-from dependencies.env import BLOCKCHAIN_URL, DIAGNOSIS_CONTRACT_ADDRESS, ACCOUNT, PRIVATE_KEY
+from web3.exceptions import TransactionNotFound
+from dependencies.env import BLOCKCHAIN_URL, DIAGNOSIS_CONTRACT_ADDRESS, ACCOUNT, PRIVATE_KEY, BLOCKCHAIN_TX_TIMEOUT, BLOCKCHAIN_MAX_REPLACEMENTS, BLOCKCHAIN_RPC_BATCH_SIZE, BLOCKCHAIN_RPC_MAX_WORKERS
 from schemas.blockchain_consultation_schemas import DiagnosisRequest
+from services.fee_oracle import FeeOracle, GasEstimator
+from services.nonce_manager import NonceManager, is_already_known, is_nonce_too_low
 
 #Sepolia
 # Configure Web3
@@ -16,36 +21,148 @@ private_key = PRIVATE_KEY
 
 CONTRACT_ABI = [{ "anonymous": False, "inputs": [ { "indexed": True, "internalType": "uint256", "name": "diagnosisId", "type": "uint256" }, { "indexed": True, "internalType": "uint256", "name": "patientId", "type": "uint256" } ], "name": "DiagnosisAdded", "type": "event" }, { "anonymous": False, "inputs": [ { "indexed": False, "internalType": "string", "name": "hash", "type": "string" }, { "indexed": True, "internalType": "uint256", "name": "patientId", "type": "uint256" }, { "indexed": True, "internalType": "uint256", "name": "diagnosisId", "type": "uint256" }, { "indexed": False, "internalType": "uint256", "name": "timestamp", "type": "uint256" } ], "name": "HashAdded", "type": "event" }, { "inputs": [ { "internalType": "uint256", "name": "_id", "type": "uint256" }, { "internalType": "string", "name": "_condition1", "type": "string" }, { "internalType": "uint256", "name": "_confidence1", "type": "uint256" }, { "internalType": "string", "name": "_condition2", "type": "string" }, { "internalType": "uint256", "name": "_confidence2", "type": "uint256" }, { "internalType": "string", "name": "_condition3", "type": "string" }, { "internalType": "uint256", "name": "_confidence3", "type": "uint256" }, { "internalType": "string", "name": "_doctorDiagnosis", "type": "string" }, { "internalType": "uint256", "name": "_patientId", "type": "uint256" }, { "internalType": "uint256", "name": "_doctorId", "type": "uint256" } ], "name": "addDiagnosis", "outputs": [], "stateMutability": "nonpayable", "type": "function" }, { "inputs": [ { "internalType": "string", "name": "_hash", "type": "string" }, { "internalType": "uint256", "name": "_diagnosisId", "type": "uint256" } ], "name": "addOffChainHashByDiagnosisId", "outputs": [], "stateMutability": "nonpayable", "type": "function" }, { "inputs": [], "name": "getDiagnosisCount", "outputs": [ { "internalType": "uint256", "name": "", "type": "uint256" } ], "stateMutability": "view", "type": "function" }, { "inputs": [ { "internalType": "uint256", "name": "_id", "type": "uint256" } ], "name": "getDiagnosisId", "outputs": [ { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "string", "name": "", "type": "string" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "string", "name": "", "type": "string" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "string", "name": "", "type": "string" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "string", "name": "", "type": "string" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "uint256", "name": "", "type": "uint256" } ], "stateMutability": "view", "type": "function" }, { "inputs": [ { "internalType": "uint256", "name": "_diagnosisId", "type": "uint256" } ], "name": "getHashesById", "outputs": [ { "internalType": "string[]", "name": "", "type": "string[]" } ], "stateMutability": "view", "type": "function" }]
 
-contract = w3.eth.contract(address=DIAGNOSIS_CONTRACT_ADDRESS, abi=CONTRACT_ABI)
+# Merkle batch anchoring, requires blockchain_smart_contracts/SmartContract_Diagnosis_V4_MerkleBatch.sol
+MERKLE_BATCH_ABI = [{ "anonymous": False, "inputs": [ { "indexed": True, "internalType": "uint256", "name": "batchId", "type": "uint256" }, { "indexed": False, "internalType": "bytes32", "name": "root", "type": "bytes32" }, { "indexed": False, "internalType": "uint256", "name": "leafCount", "type": "uint256" } ], "name": "MerkleRootAnchored", "type": "event" }, { "inputs": [ { "internalType": "uint256", "name": "_batchId", "type": "uint256" }, { "internalType": "bytes32", "name": "_root", "type": "bytes32" }, { "internalType": "uint256", "name": "_leafCount", "type": "uint256" } ], "name": "anchorMerkleRoot", "outputs": [], "stateMutability": "nonpayable", "type": "function" }, { "inputs": [ { "internalType": "uint256", "name": "_batchId", "type": "uint256" } ], "name": "getMerkleRoot", "outputs": [ { "internalType": "bytes32", "name": "", "type": "bytes32" }, { "internalType": "uint256", "name": "", "type": "uint256" }, { "internalType": "uint256", "name": "", "type": "uint256" } ], "stateMutability": "view", "type": "function" }, { "inputs": [ { "internalType": "uint256", "name": "_batchId", "type": "uint256" }, { "internalType": "bytes32", "name": "_leaf", "type": "bytes32" }, { "internalType": "bytes32[]", "name": "_proof", "type": "bytes32[]" } ], "name": "verifyDiagnosisProof", "outputs": [ { "internalType": "bool", "name": "", "type": "bool" } ], "stateMutability": "view", "type": "function" }]
+
+contract = w3.eth.contract(address=DIAGNOSIS_CONTRACT_ADDRESS, abi=CONTRACT_ABI + MERKLE_BATCH_ABI)
+
+# Shared by every transaction sent from the account so concurrent sends get distinct nonces
+nonce_manager = NonceManager(w3, account)
+fee_oracle = FeeOracle(w3)
+gas_estimator = GasEstimator()
+
+def build_contract_transaction(function_name: str, args: list, nonce: int, fees: Optional[dict] = None) -> dict:
+    """
+    Builds an unsigned contract call for the given nonce, with fees from the fee oracle unless given
+    and a gas limit from the gas estimate cache
+    """
+    function = contract.get_function_by_name(function_name)(*args)
+    data = contract.encode_abi(function_name, args=args)
+    gas = gas_estimator.gas_limit(function_name, data, lambda: function.estimate_gas({"from": account}))
+    return function.build_transaction({
+        "from": account,
+        "nonce": nonce,
+        "gas": gas,
+        **(fees or fee_oracle.suggest_fees())
+    })
+
+def build_add_diagnosis_transaction(diagnosis: DiagnosisRequest, nonce: int, fees: Optional[dict] = None) -> dict:
+    """
+    Builds the unsigned addDiagnosis transaction for the given nonce
+    """
+    return build_contract_transaction("addDiagnosis", [
+        diagnosis.diagnosis_id,
+        diagnosis.condition1,
+        diagnosis.confidence1,
+        diagnosis.condition2,
+        diagnosis.confidence2,
+        diagnosis.condition3,
+        diagnosis.confidence3,
+        diagnosis.doctor_diagnosis,
+        diagnosis.patient_id,
+        diagnosis.doctor_id
+    ], nonce, fees)
+
+def build_anchor_merkle_root_transaction(batch_id: int, root: str, leaf_count: int, nonce: int, fees: Optional[dict] = None) -> dict:
+    """
+    Builds the unsigned anchorMerkleRoot transaction for the given nonce
+    """
+    return build_contract_transaction("anchorMerkleRoot", [batch_id, root, leaf_count], nonce, fees)
+
+def submit_transaction(build_transaction):
+    """
+    Signs and broadcasts a transaction built for a locally reserved nonce, without waiting for it to be mined.
+    Returns the transaction hash and the unsigned transaction.
+    """
+    return nonce_manager.send_transaction(build_transaction, private_key)
+
+def sign_transaction(build_transaction):
+    """
+    Signs a transaction built for a locally reserved nonce, without broadcasting it.
+    Returns the signed and the unsigned transaction.
+    """
+    return nonce_manager.sign_transaction(build_transaction, private_key)
+
+def broadcast_transaction(signed_tx):
+    """
+    Broadcasts a transaction signed by sign_transaction or sign_replacement. Returns its hash.
+    """
+    return nonce_manager.broadcast(signed_tx)
+
+def rebroadcast_raw_transaction(raw_tx: str) -> None:
+    """
+    Broadcasts a stored signed transaction again, e.g. after a restart. Nothing to do if the node
+    already has it or its nonce was already mined.
+    """
+    try:
+        w3.eth.send_raw_transaction(raw_tx)
+    except Exception as e:
+        if not (is_already_known(e) or is_nonce_too_low(e)):
+            raise
+
+def submit_diagnosis(diagnosis: DiagnosisRequest):
+    """
+    Signs and broadcasts an addDiagnosis transaction without waiting for it to be mined.
+    Returns the transaction hash and the unsigned transaction.
+    """
+    return submit_transaction(lambda nonce: build_add_diagnosis_transaction(diagnosis, nonce))
+
+def sign_replacement(tx: dict):
+    """
+    Signs a replacement of a pending transaction (same nonce, fees already bumped)
+    """
+    return w3.eth.account.sign_transaction(tx, private_key)
+
+def get_transaction_receipts(tx_hashes: list[str]) -> dict:
+    """
+    Fetches the receipts of several transactions in one JSON-RPC batch.
+    Returns a dict mapping each hash to {"status", "block_number", "gas_used", "effective_gas_price"}, or None while it is not mined.
+    """
+    if not tx_hashes:
+        return {}
+    try:
+        responses = w3.provider.make_batch_request(
+            [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes]
+        )
+        raw_receipts = [response.get("result") for response in responses]
+    except (NotImplementedError, AttributeError):
+        # Provider without batch support: one request per hash
+        raw_receipts = []
+        for tx_hash in tx_hashes:
+            try:
+                raw_receipts.append(w3.eth.get_transaction_receipt(tx_hash))
+            except TransactionNotFound:
+                raw_receipts.append(None)
+
+    # Raw batch responses are hex strings, formatted receipts are ints
+    as_int = lambda value: int(value, 16) if isinstance(value, str) else value
+    receipts = {}
+    for tx_hash, receipt in zip(tx_hashes, raw_receipts):
+        if receipt is None:
+            receipts[tx_hash] = None
+            continue
+        receipts[tx_hash] = {
+            "status": as_int(receipt["status"]),
+            "block_number": as_int(receipt["blockNumber"]),
+            "gas_used": as_int(receipt["gasUsed"]),
+            "effective_gas_price": as_int(receipt.get("effectiveGasPrice") or 0)
+        }
+    return receipts
 
 def add_diagnosis(diagnosis: DiagnosisRequest):
     """
     Adds a diagnosis to the blockchain
     """
     try:
-        # Build transaction for addDiagnosis with all required parameters
-        tx = contract.functions.addDiagnosis(
-            diagnosis.diagnosis_id,
-            diagnosis.condition1,
-            diagnosis.confidence1,
-            diagnosis.condition2,
-            diagnosis.confidence2,
-            diagnosis.condition3,
-            diagnosis.confidence3,
-            diagnosis.doctor_diagnosis,
-            diagnosis.patient_id,
-            diagnosis.doctor_id
-        ).build_transaction({
-            "from": account,
-            "nonce": w3.eth.get_transaction_count(account),
-            "gas": 2000000,
-            "gasPrice": w3.to_wei("50", "gwei")
-        })
-
-        # Sign and send transaction
-        signed_tx = w3.eth.account.sign_transaction(tx, private_key)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        # Sign and send transaction with a locally reserved nonce
+        tx_hash, tx = submit_diagnosis(diagnosis)
+        # Replace the transaction with higher fees if it stays pending too long
+        tx_receipt, tx_hash = nonce_manager.wait_or_replace(
+            tx_hash, tx, private_key,
+            timeout=BLOCKCHAIN_TX_TIMEOUT,
+            max_replacements=BLOCKCHAIN_MAX_REPLACEMENTS,
+            replacement_fees=fee_oracle.replacement_fees
+        )
 
         return {
             "transaction_hash": tx_hash.hex(),
@@ -54,27 +171,149 @@ def add_diagnosis(diagnosis: DiagnosisRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_diagnosis(diagnosis_id: int):
+def diagnosis_record(result) -> dict:
     """
-    Retrieves a diagnosis from the blockchain by diagnosis ID
+    Structures the getDiagnosisId output based on the ABI
+    """
+    return {
+        "diagnosis_id": result[0],
+        "condition1": result[1],
+        "confidence1": result[2],
+        "condition2": result[3],
+        "confidence2": result[4],
+        "condition3": result[5],
+        "confidence3": result[6],
+        "doctor_diagnosis": result[7],
+        "timestamp": result[8],
+        "patient_id": result[9],
+        "doctor_id": result[10]
+    }
+
+def merkle_root_record(batch_id: int, result) -> dict:
+    root, leaf_count, timestamp = result
+    return {
+        "batch_id": batch_id,
+        "root": Web3.to_hex(root),
+        "leaf_count": leaf_count,
+        "timestamp": timestamp
+    }
+
+def get_diagnosis(diagnosis_id: int, block_identifier="latest"):
+    """
+    Retrieves a diagnosis from the blockchain by diagnosis ID, as of the given block
     """
     try:
         # Call getDiagnosisId function
-        result = contract.functions.getDiagnosisId(diagnosis_id).call()
-        
-        # Structure the response based on the ABI output
-        return {
-            "diagnosis_id": result[0],
-            "condition1": result[1],
-            "confidence1": result[2],
-            "condition2": result[3],
-            "confidence2": result[4],
-            "condition3": result[5],
-            "confidence3": result[6],
-            "doctor_diagnosis": result[7],
-            "timestamp": result[8],
-            "patient_id": result[9],
-            "doctor_id": result[10]
-        }
+        result = contract.functions.getDiagnosisId(diagnosis_id).call(block_identifier=block_identifier)
+        return diagnosis_record(result)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_merkle_root(batch_id: int, block_identifier="latest"):
+    """
+    Retrieves the Merkle root anchored for a batch of diagnoses, as of the given block
+    """
+    try:
+        result = contract.functions.getMerkleRoot(batch_id).call(block_identifier=block_identifier)
+        return merkle_root_record(batch_id, result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_block_number() -> int:
+    return w3.eth.block_number
+
+def get_block_hash(block_number: int) -> str:
+    return Web3.to_hex(w3.eth.get_block(block_number)["hash"])
+
+# Topic (keccak of the signature) of every event the contract emits
+EVENT_TOPICS = {
+    Web3.to_hex(Web3.keccak(text=f"{item['name']}({','.join(i['type'] for i in item['inputs'])})")): item["name"]
+    for item in CONTRACT_ABI + MERKLE_BATCH_ABI if item["type"] == "event"
+}
+
+def get_contract_events(from_block: int, to_block: int) -> List[dict]:
+    """
+    Retrieves and decodes the contract's events emitted between two blocks (inclusive) with eth_getLogs
+
+    Raises:
+        Exception: If the node rejects the range (too many results, range too large, timeout).
+    """
+    logs = w3.eth.get_logs({
+        "address": contract.address,
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "topics": [list(EVENT_TOPICS)]
+    })
+    events = []
+    for log in logs:
+        event = getattr(contract.events, EVENT_TOPICS[Web3.to_hex(log["topics"][0])])().process_log(log)
+        events.append({
+            "event_name": event["event"],
+            "block_number": event["blockNumber"],
+            "block_hash": Web3.to_hex(event["blockHash"]),
+            "tx_hash": Web3.to_hex(event["transactionHash"]),
+            "log_index": event["logIndex"],
+            "args": {
+                key: Web3.to_hex(value) if isinstance(value, bytes) else value
+                for key, value in event["args"].items()
+            }
+        })
+    return events
+
+def call_many(function_name: str, args_list: List[list], block_identifier="latest") -> List[Optional[tuple]]:
+    """
+    Calls a view function of the contract once per argument list, sending the eth_calls
+    as JSON-RPC batches of BLOCKCHAIN_RPC_BATCH_SIZE over at most BLOCKCHAIN_RPC_MAX_WORKERS threads.
+
+    Returns:
+        The decoded outputs in the order of args_list, None for calls that reverted.
+    """
+    output_types = [output["type"] for output in contract.get_function_by_name(function_name).abi["outputs"]]
+    block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+
+    def call_chunk(chunk: List[list]) -> List[Optional[tuple]]:
+        try:
+            responses = w3.provider.make_batch_request([
+                ("eth_call", [{"to": contract.address, "data": contract.encode_abi(function_name, args=args)}, block])
+                for args in chunk
+            ])
+        except (NotImplementedError, AttributeError):
+            # Provider without batch support: one request per call
+            results = []
+            for args in chunk:
+                try:
+                    results.append(tuple(contract.get_function_by_name(function_name)(*args).call(block_identifier=block_identifier)))
+                except Exception:
+                    results.append(None)
+            return results
+        return [
+            w3.codec.decode(output_types, Web3.to_bytes(hexstr=response["result"]))
+            if response.get("result") not in (None, "0x") else None
+            for response in responses
+        ]
+
+    chunks = [args_list[i:i + BLOCKCHAIN_RPC_BATCH_SIZE] for i in range(0, len(args_list), BLOCKCHAIN_RPC_BATCH_SIZE)]
+    if len(chunks) <= 1:
+        return call_chunk(chunks[0]) if chunks else []
+    with ThreadPoolExecutor(max_workers=BLOCKCHAIN_RPC_MAX_WORKERS) as executor:
+        return [result for results in executor.map(call_chunk, chunks) for result in results]
+
+def get_diagnoses(diagnosis_ids: List[int], block_identifier="latest") -> Dict[int, Optional[dict]]:
+    """
+    Retrieves several diagnoses with batched calls, None for the IDs that are not on the blockchain
+    """
+    results = call_many("getDiagnosisId", [[diagnosis_id] for diagnosis_id in diagnosis_ids], block_identifier)
+    return {
+        diagnosis_id: diagnosis_record(result) if result is not None else None
+        for diagnosis_id, result in zip(diagnosis_ids, results)
+    }
+
+def get_merkle_roots(batch_ids: List[int], block_identifier="latest") -> Dict[int, Optional[dict]]:
+    """
+    Retrieves several anchored Merkle roots with batched calls, None for the batches that are not on the blockchain
+    """
+    results = call_many("getMerkleRoot", [[batch_id] for batch_id in batch_ids], block_identifier)
+    return {
+        batch_id: merkle_root_record(batch_id, result) if result is not None else None
+        for batch_id, result in zip(batch_ids, results)
+    }
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""Ingests the contract's events into MySQL (checkpointed eth_getLogs worker)"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+import models
+from dependencies.database import SessionLocal
+from dependencies.env import (
+    BLOCKCHAIN_FINALITY_DEPTH, BLOCKCHAIN_INDEXER_START_BLOCK, BLOCKCHAIN_INDEXER_POLL_INTERVAL,
+    BLOCKCHAIN_INDEXER_CHUNK_SIZE, BLOCKCHAIN_INDEXER_MAX_CHUNK_SIZE
+)
+from services.blockchain_consultation_service import get_block_number, get_block_hash, get_contract_events
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "diagnosis_contract"
+# Grow the range while a request returns fewer logs than this
+TARGET_LOGS_PER_REQUEST = 1000
+
+class EventIndexer:
+    """
+    Background worker that copies DiagnosisAdded, HashAdded and MerkleRootAnchored events into blockchain_events
+    and materializes the anchoring status of the consultations they concern.
+
+    - Only blocks at least BLOCKCHAIN_FINALITY_DEPTH deep are indexed, so ordinary reorgs never reach the tables.
+    - The checkpoint stores the hash of the last indexed block. If the chain no longer has that block
+      (a reorg deeper than the confirmation depth), the indexer rewinds by the confirmation depth,
+      deletes the events above it, puts their consultations and outbox entries back to SUBMITTED
+      and indexes that range again.
+    - The range of each eth_getLogs request adapts: halved when the node rejects it, doubled while results are small.
+    - Events, consultation updates and the checkpoint are committed together, one transaction per range.
+    """
+
+    def __init__(self, session_factory=SessionLocal, confirmations: int = BLOCKCHAIN_FINALITY_DEPTH,
+                 start_block: int = BLOCKCHAIN_INDEXER_START_BLOCK, poll_interval: float = BLOCKCHAIN_INDEXER_POLL_INTERVAL,
+                 chunk_size: int = BLOCKCHAIN_INDEXER_CHUNK_SIZE, max_chunk_size: int = BLOCKCHAIN_INDEXER_MAX_CHUNK_SIZE):
+        self.session_factory = session_factory
+        self.confirmations = confirmations
+        self.start_block = start_block
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self._task: Optional[asyncio.Task] = None
+
+    def _checkpoint(self, db: Session) -> models.IndexerCheckpoint:
+        checkpoint = db.get(models.IndexerCheckpoint, CHECKPOINT_NAME)
+        if checkpoint is None:
+            checkpoint = models.IndexerCheckpoint(name=CHECKPOINT_NAME, block_number=self.start_block - 1, block_hash="")
+            db.add(checkpoint)
+        return checkpoint
+
+    def _rewind_if_reorged(self, db: Session, checkpoint: models.IndexerCheckpoint) -> None:
+        if not checkpoint.block_hash or get_block_hash(checkpoint.block_number) == checkpoint.block_hash:
+            return
+        rewind_to = max(self.start_block - 1, checkpoint.block_number - self.confirmations)
+        logger.warning("Reorg detected at block %s, re-indexing from block %s", checkpoint.block_number, rewind_to + 1)
+
+        # Consultations confirmed by the dropped events go back to SUBMITTED until they are seen again
+        dropped = db.query(models.BlockchainEvent).filter(models.BlockchainEvent.block_number > rewind_to)
+        events = dropped.all()
+        diagnosis_ids = {event.diagnosis_id for event in events if event.event_name == "DiagnosisAdded"}
+        batch_ids = {event.batch_id for event in events if event.event_name == "MerkleRootAnchored"}
+        self._set_consultation_status(db, diagnosis_ids, batch_ids, models.BlockchainStatus.SUBMITTED)
+        self._rewind_outbox(db, diagnosis_ids, batch_ids)
+        dropped.delete(synchronize_session=False)
+
+        checkpoint.block_number = rewind_to
+        checkpoint.block_hash = get_block_hash(rewind_to) if rewind_to >= 0 else ""
+
+    def _rewind_outbox(self, db: Session, diagnosis_ids, batch_ids) -> None:
+        """
+        Puts the outbox entries of dropped events back to SUBMITTED without their receipt, so the anchor
+        worker polls their transactions again (and replaces them if they are not mined again)
+        """
+        conditions = []
+        if diagnosis_ids:
+            conditions.append(and_(
+                models.BlockchainOutbox.kind == models.AnchorKind.DIAGNOSIS,
+                models.BlockchainOutbox.consultation_id.in_(list(diagnosis_ids))
+            ))
+        if batch_ids:
+            # Merkle batch entries (their id is the on-chain batch id) and the diagnoses they anchor
+            conditions.append(models.BlockchainOutbox.id.in_(list(batch_ids)))
+            conditions.append(models.BlockchainOutbox.batch_id.in_(list(batch_ids)))
+        if not conditions:
+            return
+        for entry in db.query(models.BlockchainOutbox).filter(
+            or_(*conditions),
+            models.BlockchainOutbox.status == models.BlockchainStatus.CONFIRMED
+        ):
+            entry.status = models.BlockchainStatus.SUBMITTED
+            entry.gas_used = None
+            entry.effective_gas_price = None
+            entry.fee_paid = None
+            entry.confirmed_at = None
+            if entry.tx_hashes is not None:
+                # Time to be mined again before the worker replaces it
+                entry.submitted_at = datetime.utcnow()
+
+    def _set_consultation_status(self, db: Session, diagnosis_ids, batch_ids, status: models.BlockchainStatus, tx_hashes=None) -> None:
+        consultation_ids = set(diagnosis_ids)
+        if batch_ids:
+            consultation_ids |= {
+                proof.consultation_id for proof in
+                db.query(models.DiagnosisMerkleProof).filter(models.DiagnosisMerkleProof.batch_id.in_(list(batch_ids)))
+            }
+        if not consultation_ids:
+            return
+        for consultation in db.query(models.Consultation).filter(models.Consultation.id.in_(list(consultation_ids))):
+            consultation.blockchain_status = status
+            if tx_hashes and consultation.id in tx_hashes:
+                consultation.blockchain_tx_hash = tx_hashes[consultation.id]
+
+    def _store_events(self, db: Session, events: List[dict]) -> None:
+        diagnosis_tx_hashes = {}
+        batch_tx_hashes = {}
+        for event in events:
+            args = event["args"]
+            db.add(models.BlockchainEvent(
+                event_name=event["event_name"],
+                block_number=event["block_number"],
+                block_hash=event["block_hash"],
+                tx_hash=event["tx_hash"],
+                log_index=event["log_index"],
+                diagnosis_id=args.get("diagnosisId"),
+                patient_id=args.get("patientId"),
+                batch_id=args.get("batchId"),
+                data=json.dumps(args)
+            ))
+            if event["event_name"] == "DiagnosisAdded":
+                diagnosis_tx_hashes[args["diagnosisId"]] = event["tx_hash"]
+            elif event["event_name"] == "MerkleRootAnchored":
+                batch_tx_hashes[args["batchId"]] = event["tx_hash"]
+
+        # Materialize the anchoring status, with the transaction that anchored each consultation
+        tx_hashes = dict(diagnosis_tx_hashes)
+        if batch_tx_hashes:
+            for proof in db.query(models.DiagnosisMerkleProof).filter(models.DiagnosisMerkleProof.batch_id.in_(list(batch_tx_hashes))):
+                tx_hashes[proof.consultation_id] = batch_tx_hashes[proof.batch_id]
+        self._set_consultation_status(db, diagnosis_tx_hashes, batch_tx_hashes, models.BlockchainStatus.CONFIRMED, tx_hashes)
+
+    def index_once(self) -> int:
+        """
+        Indexes every confirmed block after the checkpoint
+
+        Returns:
+            The number of events ingested.
+        """
+        db = self.session_factory()
+        ingested = 0
+        try:
+            checkpoint = self._checkpoint(db)
+            self._rewind_if_reorged(db, checkpoint)
+            db.commit()
+
+            safe_head = get_block_number() - self.confirmations
+            while checkpoint.block_number < safe_head:
+                from_block = checkpoint.block_number + 1
+                to_block = min(safe_head, from_block + self.chunk_size - 1)
+                try:
+                    events = get_contract_events(from_block, to_block)
+                except Exception as e:
+                    if self.chunk_size == 1:
+                        raise
+                    # Too many results or range too large for the node: retry a smaller range
+                    self.chunk_size = max(1, self.chunk_size // 2)
+                    logger.info("eth_getLogs failed for blocks %s-%s (%s), chunk size now %s", from_block, to_block, e, self.chunk_size)
+                    continue
+
+                self._store_events(db, events)
+                checkpoint.block_number = to_block
+                checkpoint.block_hash = get_block_hash(to_block)
+                db.commit()
+                ingested += len(events)
+                if len(events) < TARGET_LOGS_PER_REQUEST:
+                    self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+            return ingested
+        except Exception:
+            db.rollback()
+            logger.exception("Blockchain event indexer iteration failed")
+            return ingested
+        finally:
+            db.close()
+
+    def lag(self, db: Session, head: int) -> dict:
+        """Last indexed block and how far it is behind the chain head (head, read by the caller)"""
+        checkpoint = db.get(models.IndexerCheckpoint, CHECKPOINT_NAME)
+        indexed = checkpoint.block_number if checkpoint else None
+        return {
+            "indexed_block": indexed,
+            "head_block": head,
+            "confirmations": self.confirmations,
+            "blocks_behind": head - indexed if indexed is not None else None
+        }
+
+    async def _run(self) -> None:
+        while True:
+            # web3 and SQLAlchemy calls are blocking: keep them off the event loop
+            await asyncio.to_thread(self.index_once)
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+event_indexer = EventIndexer()
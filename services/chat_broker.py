@@ -0,0 +1,67 @@
+"""In-process fan-out of consultation chat events to the open chat WebSockets"""
+import asyncio
+import threading
+from typing import Dict, Set, Tuple
+import models
+
+class ChatBroker:
+    """
+    Delivers events (doctor messages, consultation state changes) to every WebSocket subscribed to a consultation.
+
+    Each subscriber gets an asyncio.Queue bound to its event loop. publish() may be called from the
+    event loop or from a worker thread, events are handed over with call_soon_threadsafe.
+    Subscriptions live in the memory of one worker process: a socket only receives the events
+    published by the worker that holds it.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, consultation_id: int) -> asyncio.Queue:
+        """Registers a subscriber of the running event loop and returns its queue of events"""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(consultation_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, consultation_id: int, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(consultation_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(consultation_id, None)
+
+    def publish(self, consultation_id: int, event: dict) -> int:
+        """Sends an event to the subscribers of a consultation, returns how many were reached"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(consultation_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The loop of that subscriber was closed
+                self.unsubscribe(consultation_id, queue)
+        return len(subscribers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "consultations": len(self._subscribers),
+                "sockets": sum(len(subscribers) for subscribers in self._subscribers.values())
+            }
+
+def message_event(message: models.ChatMessage) -> dict:
+    return {
+        "type": "message",
+        "id": message.id,
+        "seq": message.seq,
+        "sender_type": message.sender_type.value,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+def etat_event(etat: models.EtatConsultation) -> dict:
+    return {"type": "etat", "etat": etat.value}
+
+chat_broker = ChatBroker()
@@ -0,0 +1,107 @@
+"""Chat histories of consultations: ordered storage of new messages, and an in-memory cache of the
+histories of active consultations in the {"role", "content"} form sent to the LLM"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+import models
+from dependencies.env import CHAT_HISTORY_CACHE_SIZE
+
+SENDER_ROLES = {
+    models.MessageSenderType.USER: "user",
+    models.MessageSenderType.ASSISTANT: "assistant",
+    models.MessageSenderType.DOCTOR: "doctor",
+    models.MessageSenderType.SYSTEM: "system",
+}
+
+def add_chat_messages(db: Session, consultation_id: int, *messages: models.ChatMessage) -> None:
+    """
+    Adds messages to the session with the next seq numbers of their consultation, in the given order.
+
+    Consultation.last_chat_seq is incremented with one atomic UPDATE, which locks the consultation row
+    until the caller commits: concurrent turns of the same consultation get consecutive, distinct numbers.
+    """
+    db.execute(
+        update(models.Consultation)
+        .where(models.Consultation.id == consultation_id)
+        .values(last_chat_seq=models.Consultation.last_chat_seq + len(messages))
+    )
+    last_seq = db.execute(
+        select(models.Consultation.last_chat_seq).where(models.Consultation.id == consultation_id)
+    ).scalar()
+    for offset, message in enumerate(messages):
+        message.seq = last_seq - len(messages) + 1 + offset
+        db.add(message)
+
+def load_chat_history(db: Session, consultation_id: int) -> List[Dict[str, str]]:
+    """Reads the chat history of a consultation with a Core select of the two needed columns (no ORM objects)"""
+    rows = db.execute(
+        select(models.ChatMessage.sender_type, models.ChatMessage.content)
+        .where(models.ChatMessage.consultation_id == consultation_id)
+        .order_by(models.ChatMessage.seq.asc())
+    ).all()
+    return [{"role": SENDER_ROLES.get(sender_type, "system"), "content": content} for sender_type, content in rows]
+
+class ChatHistoryCache:
+    """
+    Keeps the prepared chat history of up to CHAT_HISTORY_CACHE_SIZE EN_COURS consultations, least recently used first out.
+
+    - A miss loads the history once (load_chat_history), each successful chat turn then appends its two messages.
+    - A hit is checked against Consultation.last_chat_seq (one primary key lookup), which equals the number
+      of messages: a turn saved by another worker process makes them differ and the history is reloaded.
+    - Consultations leaving EN_COURS are invalidated by the endpoints changing their state.
+    """
+
+    def __init__(self, maxsize: int = CHAT_HISTORY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._histories: "OrderedDict[int, List[Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def history(self, db: Session, consultation_id: int) -> List[Dict[str, str]]:
+        """Returns a copy of the chat history of a consultation, which the caller may extend"""
+        with self._lock:
+            cached = self._histories.get(consultation_id)
+            cached = list(cached) if cached is not None else None
+
+        if cached is not None:
+            count = db.execute(
+                select(models.Consultation.last_chat_seq).where(models.Consultation.id == consultation_id)
+            ).scalar()
+            if count == len(cached):
+                with self._lock:
+                    self.hits += 1
+                    if consultation_id in self._histories:
+                        self._histories.move_to_end(consultation_id)
+                return cached
+            with self._lock:
+                self.stale += 1
+
+        history = load_chat_history(db, consultation_id)
+        with self._lock:
+            self.misses += 1
+            self._histories[consultation_id] = list(history)
+            self._histories.move_to_end(consultation_id)
+            while len(self._histories) > self.maxsize:
+                self._histories.popitem(last=False)
+        return history
+
+    def append(self, consultation_id: int, *messages: Dict[str, str]) -> None:
+        """Records messages saved for a consultation; nothing to do if its history is not cached"""
+        with self._lock:
+            cached = self._histories.get(consultation_id)
+            if cached is not None:
+                cached.extend(messages)
+
+    def invalidate(self, consultation_id: int) -> None:
+        """Drops a consultation, e.g. when it leaves EN_COURS"""
+        with self._lock:
+            self._histories.pop(consultation_id, None)
+
+    def stats(self) -> dict:
+        return {"consultations": len(self._histories), "hits": self.hits, "misses": self.misses, "stale": self.stale}
+
+chat_history_cache = ChatHistoryCache()
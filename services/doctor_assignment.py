@@ -0,0 +1,152 @@
+"""Assignment of new consultations to doctors, with per-doctor load counters maintained in the doctors table"""
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+import models
+from dependencies.env import DOCTOR_ASSIGNMENT_STRATEGY, NEXT_SLOTS_HORIZON_DAYS
+from services.availability_index import availability_index
+from services.reference_cache import DOCTORS, reference_cache
+
+# Doctor.pending_consultations counts the doctor's consultations waiting for a review (EN_ATTENTE):
+# incremented when the patient finishes the chat, decremented when the review takes the consultation out of EN_ATTENTE.
+# Chats that are started and never finished are not counted, so they cannot inflate a doctor's load.
+
+def record_pending(db: Session, doctor_id: int) -> None:
+    """Counts a consultation of the doctor entering EN_ATTENTE (atomic UPDATE, committed by the caller)"""
+    db.execute(
+        update(models.Doctor)
+        .where(models.Doctor.id == doctor_id)
+        .values(pending_consultations=models.Doctor.pending_consultations + 1)
+    )
+
+def record_reviewed(db: Session, doctor_id: int) -> None:
+    """Uncounts a consultation of the doctor leaving EN_ATTENTE (atomic UPDATE, committed by the caller)"""
+    db.execute(
+        update(models.Doctor)
+        .where(models.Doctor.id == doctor_id, models.Doctor.pending_consultations > 0)
+        .values(pending_consultations=models.Doctor.pending_consultations - 1)
+    )
+
+def recount_pending_consultations(db: Session) -> int:
+    """
+    Recomputes every doctor's counter from the consultations table. Run by dev_scripts/db_migrate.py,
+    which also repairs counters drifted by manual edits. Returns the number of doctors whose counter changed.
+    """
+    counts = dict(db.execute(
+        select(models.Consultation.doctor_id, func.count())
+        .where(models.Consultation.etat == models.EtatConsultation.EN_ATTENTE)
+        .group_by(models.Consultation.doctor_id)
+    ).all())
+    changed = 0
+    for doctor_id, pending in db.execute(select(models.Doctor.id, models.Doctor.pending_consultations)).all():
+        if pending != counts.get(doctor_id, 0):
+            db.execute(update(models.Doctor).where(models.Doctor.id == doctor_id)
+                       .values(pending_consultations=counts.get(doctor_id, 0)))
+            changed += 1
+    return changed
+
+class AssignmentStrategy(ABC):
+    """Chooses the doctor of a new consultation among the given doctor ids (never empty, sorted)"""
+    name = ""
+
+    @abstractmethod
+    def choose(self, db: Session, doctor_ids: List[int]) -> int:
+        ...
+
+class LeastPendingStrategy(AssignmentStrategy):
+    """
+    The doctor with the fewest consultations waiting for a review (lowest id on ties), one indexed query on the counters.
+    New consultations only count once their chat is finished: round_robin spreads a burst of new chats more evenly.
+    """
+    name = "least_pending"
+
+    def choose(self, db: Session, doctor_ids: List[int]) -> int:
+        doctor_id = db.execute(
+            select(models.Doctor.id)
+            .where(models.Doctor.id.in_(doctor_ids))
+            .order_by(models.Doctor.pending_consultations.asc(), models.Doctor.id.asc())
+            .limit(1)
+        ).scalar()
+        return doctor_id if doctor_id is not None else doctor_ids[0]
+
+class RoundRobinStrategy(AssignmentStrategy):
+    """
+    Each doctor in turn, without any query. The turn is kept per process,
+    so with several workers the rotation is only even overall.
+    """
+    name = "round_robin"
+
+    def __init__(self):
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self, db: Session, doctor_ids: List[int]) -> int:
+        with self._lock:
+            turn = next(self._turns)
+        return doctor_ids[turn % len(doctor_ids)]
+
+class EarliestFreeSlotStrategy(AssignmentStrategy):
+    """
+    The doctor with the earliest free working-hour slot (from the availability index),
+    the fewest pending consultations on ties. Doctors with no free slot within NEXT_SLOTS_HORIZON_DAYS come last.
+    """
+    name = "earliest_free_slot"
+
+    def choose(self, db: Session, doctor_ids: List[int]) -> int:
+        now = datetime.now()
+        pending = dict(db.execute(
+            select(models.Doctor.id, models.Doctor.pending_consultations).where(models.Doctor.id.in_(doctor_ids))
+        ).all())
+
+        def rank(doctor_id: int):
+            slots = availability_index.next_free_slots(db, doctor_id, now, 1, NEXT_SLOTS_HORIZON_DAYS)
+            return (slots[0] if slots else datetime.max, pending.get(doctor_id, 0), doctor_id)
+
+        return min(doctor_ids, key=rank)
+
+STRATEGIES: Dict[str, type] = {
+    strategy.name: strategy for strategy in (LeastPendingStrategy, RoundRobinStrategy, EarliestFreeSlotStrategy)
+}
+
+class DoctorAssigner:
+    """
+    Assigns new consultations with the configured strategy (DOCTOR_ASSIGNMENT_STRATEGY).
+
+    The ids of all doctors are kept in the reference data cache, invalidated when a doctor is created:
+    looking them up is not a query per request.
+    """
+
+    def __init__(self, strategy: AssignmentStrategy):
+        self.strategy = strategy
+
+    def doctor_ids(self, db: Session) -> List[int]:
+        """Sorted ids of all doctors"""
+        return reference_cache.get_or_load(DOCTORS, "ids", lambda: list(
+            db.execute(select(models.Doctor.id).order_by(models.Doctor.id.asc())).scalars()
+        ))
+
+    def default_doctor_id(self, db: Session) -> Optional[int]:
+        """The doctor shown when a patient does not pick one (the first doctor, as with the single-doctor model)"""
+        doctor_ids = self.doctor_ids(db)
+        return doctor_ids[0] if doctor_ids else None
+
+    def assign(self, db: Session) -> Optional[int]:
+        """
+        Chooses the doctor of a new consultation, None when there is no doctor.
+        The consultation is counted in their pending consultations when its chat is finished (record_pending).
+        """
+        doctor_ids = self.doctor_ids(db)
+        if not doctor_ids:
+            return None
+        return self.strategy.choose(db, doctor_ids)
+
+def create_strategy(name: str) -> AssignmentStrategy:
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown DOCTOR_ASSIGNMENT_STRATEGY {name!r}, expected one of {', '.join(STRATEGIES)}")
+    return STRATEGIES[name]()
+
+doctor_assigner = DoctorAssigner(create_strategy(DOCTOR_ASSIGNMENT_STRATEGY))
@@ -0,0 +1,97 @@
+"""Fee and gas limit estimation for the transactions sent from the backend account"""
+import statistics
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from web3 import Web3
+from dependencies.env import (
+    BLOCKCHAIN_FEE_PERCENTILE, BLOCKCHAIN_FEE_HISTORY_BLOCKS, BLOCKCHAIN_BASE_FEE_MULTIPLIER,
+    BLOCKCHAIN_MAX_FEE_GWEI, BLOCKCHAIN_FEE_CACHE_SECONDS, BLOCKCHAIN_GAS_MARGIN, BLOCKCHAIN_GAS_BUCKET_BYTES
+)
+from services.nonce_manager import bump_fees, REPLACEMENT_FEE_BUMP
+
+FEE_FIELDS = ("gasPrice", "maxFeePerGas", "maxPriorityFeePerGas")
+
+class FeeOracle:
+    """
+    Suggests EIP-1559 fees from eth_feeHistory over the last BLOCKCHAIN_FEE_HISTORY_BLOCKS blocks.
+
+    - The priority fee is the median, over those blocks, of the BLOCKCHAIN_FEE_PERCENTILE percentile of
+      the tips paid: a higher percentile pays more to be included sooner.
+    - maxFeePerGas leaves room for the base fee to rise (BLOCKCHAIN_BASE_FEE_MULTIPLIER x the next base fee)
+      and is capped at BLOCKCHAIN_MAX_FEE_GWEI. Only the base fee actually charged is paid.
+    - Chains without EIP-1559 get a legacy gasPrice from eth_gasPrice.
+    Suggestions are cached for BLOCKCHAIN_FEE_CACHE_SECONDS, about one block.
+    """
+
+    def __init__(self, w3: Web3, percentile: float = BLOCKCHAIN_FEE_PERCENTILE, history_blocks: int = BLOCKCHAIN_FEE_HISTORY_BLOCKS,
+                 base_fee_multiplier: float = BLOCKCHAIN_BASE_FEE_MULTIPLIER, max_fee_gwei: float = BLOCKCHAIN_MAX_FEE_GWEI,
+                 cache_seconds: float = BLOCKCHAIN_FEE_CACHE_SECONDS):
+        self.w3 = w3
+        self.percentile = percentile
+        self.history_blocks = history_blocks
+        self.base_fee_multiplier = base_fee_multiplier
+        self.max_fee = Web3.to_wei(max_fee_gwei, "gwei")
+        self.cache_seconds = cache_seconds
+        self._lock = threading.Lock()
+        self._cached: Optional[Tuple[float, Dict[str, int]]] = None
+
+    def _estimate(self) -> Dict[str, int]:
+        history = self.w3.eth.fee_history(self.history_blocks, "latest", [self.percentile])
+        base_fees = history.get("baseFeePerGas") or []
+        if not base_fees or not any(base_fees):
+            return {"gasPrice": min(self.w3.eth.gas_price, self.max_fee)}
+
+        tips = [reward[0] for reward in history.get("reward") or [] if reward and reward[0] > 0]
+        priority_fee = int(statistics.median(tips)) if tips else self.w3.eth.max_priority_fee
+        # The last entry is the base fee of the next block
+        max_fee = min(int(base_fees[-1] * self.base_fee_multiplier) + priority_fee, self.max_fee)
+        return {"maxFeePerGas": max_fee, "maxPriorityFeePerGas": min(priority_fee, max_fee)}
+
+    def suggest_fees(self) -> Dict[str, int]:
+        """Returns the fee fields to set on a new transaction"""
+        with self._lock:
+            if self._cached is not None and time.monotonic() - self._cached[0] < self.cache_seconds:
+                return dict(self._cached[1])
+        fees = self._estimate()
+        with self._lock:
+            self._cached = (time.monotonic(), fees)
+        return dict(fees)
+
+    def replacement_fees(self, previous_fees: Dict[str, int]) -> Dict[str, int]:
+        """
+        Fees for a replace-by-fee of a stuck transaction: at least REPLACEMENT_FEE_BUMP above the previous
+        fees (the minimum nodes accept), or the current suggestion when fees rose more than that
+        """
+        bumped = bump_fees(previous_fees, REPLACEMENT_FEE_BUMP)
+        current = self.suggest_fees()
+        return {field: max(value, current.get(field, 0)) for field, value in bumped.items()}
+
+class GasEstimator:
+    """
+    Caches eth_estimateGas results per function and calldata size bucket of BLOCKCHAIN_GAS_BUCKET_BYTES.
+
+    The gas used by a diagnosis mostly depends on the length of its strings (storage slots written),
+    so transactions with similar calldata sizes share one estimate, raised by BLOCKCHAIN_GAS_MARGIN.
+    """
+
+    def __init__(self, margin: float = BLOCKCHAIN_GAS_MARGIN, bucket_bytes: int = BLOCKCHAIN_GAS_BUCKET_BYTES):
+        self.margin = margin
+        self.bucket_bytes = bucket_bytes
+        self._lock = threading.Lock()
+        self._limits: Dict[Tuple[str, int], int] = {}
+
+    def bucket(self, data: str) -> int:
+        size = len(Web3.to_bytes(hexstr=data))
+        return -(-size // self.bucket_bytes)
+
+    def gas_limit(self, function_name: str, data: str, estimate: Callable[[], int]) -> int:
+        """Returns the cached gas limit of the bucket, calling estimate() on a miss"""
+        key = (function_name, self.bucket(data))
+        with self._lock:
+            if key in self._limits:
+                return self._limits[key]
+        limit = int(estimate() * self.margin)
+        with self._lock:
+            self._limits[key] = max(limit, self._limits.get(key, 0))
+            return self._limits[key]
@@ -0,0 +1,130 @@
+"""Verifies that consultations stored in the database match what was anchored on the blockchain"""
+import json
+from typing import Iterator, List
+from sqlalchemy.orm import Session, joinedload
+from web3 import Web3
+import models
+from dependencies.env import BULK_VERIFY_CHUNK_SIZE
+from services.blockchain_anchor_service import build_diagnosis_request
+from services.merkle_service import diagnosis_leaf, verify_merkle_proof
+from services.onchain_cache import onchain_cache
+
+def matches_onchain_diagnosis(consultation: models.Consultation, blockchain_diagnosis: dict) -> bool:
+    """
+    Compares a consultation with the diagnosis record read back from the blockchain
+    """
+    is_valid = (
+        consultation.diagnosis == blockchain_diagnosis["doctor_diagnosis"] and
+        consultation.patient_id == blockchain_diagnosis["patient_id"] and
+        consultation.doctor_id == blockchain_diagnosis["doctor_id"]
+    )
+
+    # Compare hypotheses (up to 3)
+    for i, hypo in enumerate(consultation.hypotheses[:3]):
+        condition_field = f"condition{i+1}"
+        confidence_field = f"confidence{i+1}"
+        if (hypo.condition != blockchain_diagnosis[condition_field] or
+            hypo.confidence != blockchain_diagnosis[confidence_field]):
+            is_valid = False
+            break
+
+    return is_valid
+
+def matches_merkle_proof(db: Session, consultation: models.Consultation, proof: models.DiagnosisMerkleProof) -> bool:
+    """
+    Recomputes the consultation's leaf from the database, folds it with the stored proof
+    and compares the result with the root anchored on the blockchain for its batch
+    """
+    return proof_matches_root(consultation, proof, onchain_cache.get_merkle_root(db, proof.batch_id)["root"])
+
+async def verify_consultation_async(db: Session, consultation: models.Consultation) -> bool:
+    """
+    Same as verify_consultation, awaiting the chain reads instead of blocking the event loop
+    """
+    proof = db.get(models.DiagnosisMerkleProof, consultation.id)
+    if proof is not None:
+        anchored = await onchain_cache.aget_merkle_root(db, proof.batch_id)
+        return proof_matches_root(consultation, proof, anchored["root"])
+    return matches_onchain_diagnosis(consultation, await onchain_cache.aget_diagnosis(db, consultation.id))
+
+def proof_matches_root(consultation: models.Consultation, proof: models.DiagnosisMerkleProof, root: str) -> bool:
+    leaf = diagnosis_leaf(build_diagnosis_request(consultation))
+    siblings = [Web3.to_bytes(hexstr=node) for node in json.loads(proof.proof)]
+    return verify_merkle_proof(leaf, siblings, Web3.to_bytes(hexstr=root))
+
+def verify_consultation(db: Session, consultation: models.Consultation) -> bool:
+    """
+    Verifies a consultation against the blockchain: with its Merkle proof when it was anchored
+    in a batch, otherwise by reading its diagnosis record back from the contract.
+    Final on-chain records are served from the on-chain cache.
+    """
+    proof = db.get(models.DiagnosisMerkleProof, consultation.id)
+    if proof is not None:
+        return matches_merkle_proof(db, consultation, proof)
+    return matches_onchain_diagnosis(consultation, onchain_cache.get_diagnosis(db, consultation.id))
+
+def verify_consultations_bulk(db: Session, consultation_ids: List[int], chunk_size: int = BULK_VERIFY_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Verifies many consultations, chunk by chunk so results can be streamed as soon as a chunk is done.
+
+    Each chunk costs one query for the consultations and their hypotheses, one for the Merkle proofs,
+    and batched contract calls for the on-chain records missing from the on-chain cache
+    (which stores them without committing db, so the loaded consultations and hypotheses stay loaded).
+
+    Yields:
+        One result per consultation ID, in request order: consultation_id, is_valid and error.
+    """
+    for start in range(0, len(consultation_ids), chunk_size):
+        chunk = consultation_ids[start:start + chunk_size]
+
+        # Step 1: Load the consultations with their hypotheses, and their Merkle proofs
+        consultations = {
+            consultation.id: consultation
+            for consultation in db.query(models.Consultation)
+            .options(joinedload(models.Consultation.hypotheses))
+            .filter(models.Consultation.id.in_(chunk))
+            .all()
+        }
+        proofs = {
+            proof.consultation_id: proof
+            for proof in db.query(models.DiagnosisMerkleProof)
+            .filter(models.DiagnosisMerkleProof.consultation_id.in_(list(consultations)))
+            .all()
+        } if consultations else {}
+
+        # Step 2: Fetch the anchored records (cache first, then batched calls)
+        batch_ids = sorted({proof.batch_id for proof in proofs.values()})
+        diagnosis_ids = [consultation_id for consultation_id in consultations if consultation_id not in proofs]
+        chain_error = None
+        try:
+            roots = onchain_cache.get_merkle_roots(db, batch_ids) if batch_ids else {}
+            diagnoses = onchain_cache.get_diagnoses(db, diagnosis_ids) if diagnosis_ids else {}
+        except Exception as e:
+            chain_error = f"Failed to read the blockchain: {str(e)}"
+
+        # Step 3: Compare each consultation with its record
+        for consultation_id in chunk:
+            consultation = consultations.get(consultation_id)
+            result = {"consultation_id": consultation_id, "is_valid": None, "error": None}
+            if consultation is None:
+                result["error"] = "Consultation not found"
+            elif not consultation.hypotheses:
+                result["error"] = "No hypotheses found"
+            elif chain_error:
+                result["error"] = chain_error
+            elif consultation_id in proofs:
+                root = roots.get(proofs[consultation_id].batch_id)
+                if root is None:
+                    result["error"] = "Merkle root not found on the blockchain"
+                else:
+                    result["is_valid"] = proof_matches_root(consultation, proofs[consultation_id], root["root"])
+            else:
+                blockchain_diagnosis = diagnoses.get(consultation_id)
+                if blockchain_diagnosis is None:
+                    result["error"] = "Diagnosis not found on the blockchain"
+                else:
+                    result["is_valid"] = matches_onchain_diagnosis(consultation, blockchain_diagnosis)
+            yield result
+
+        # Drop the chunk's objects so memory stays flat over large requests
+        db.expunge_all()
\ No newline at end of file
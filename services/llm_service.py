@@ -1,9 +1,9 @@
 """Contains the methods that communicate with the LLM FastAPI"""
 import requests
-from dependencies.env import BASE_URL
-from typing import List, Dict
+from dependencies.env import BASE_URL, LLM_BATCH_CHUNK_SIZE
+from typing import List, Dict, Iterator
 
-from schemas.llm_service_schemas import DiagnosisResponse, CombinedResponse
+from schemas.llm_service_schemas import DiagnosisResponse, CombinedResponse, SymptomRequest, BatchDiagnosisItem, BatchDiagnosisResponse
 
 def diagnose_patient_en(symptoms: List[str], additional_details: str = "None") -> DiagnosisResponse:
     url = f"{BASE_URL}/diagnose-en"
@@ -27,6 +27,56 @@ def diagnose_patient_fr(symptoms: List[str], additional_details: str = "None") -
 
     return DiagnosisResponse(**response.json())
 
+def diagnose_patients_batch(items: List[SymptomRequest], language: str = "en", chunk_size: int = LLM_BATCH_CHUNK_SIZE) -> List[BatchDiagnosisItem]:
+    """
+    Sends many symptom sets to the Colab server in chunks, one HTTP round trip per chunk.
+
+    Args:
+        items: The symptom sets to diagnose.
+        language: 'en' or 'fr', selects the /diagnose-batch-<language> endpoint.
+        chunk_size: Maximum number of symptom sets sent per request.
+    
+    Returns:
+        One BatchDiagnosisItem per input, in input order. Items that failed carry an error
+        instead of a diagnosis; a failed chunk marks all of its items as failed.
+    
+    Raises:
+        ValueError: If the language is not supported or chunk_size is less than 1.
+    """
+    if language not in ("en", "fr"):
+        raise ValueError(f"Unsupported language: {language}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1 (LLM_BATCH_CHUNK_SIZE), got {chunk_size}")
+
+    url = f"{BASE_URL}/diagnose-batch-{language}"
+    results: List[BatchDiagnosisItem] = []
+
+    # Reuse one connection through the tunnel for all chunks
+    with requests.Session() as session:
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            data = {"items": [item.model_dump() for item in chunk]}
+
+            try:
+                response = session.post(url, json=data)
+                if response.status_code != 200:
+                    raise Exception(f"Error: {response.status_code}, {response.text}")
+                chunk_results = {item.index: item for item in BatchDiagnosisResponse(**response.json()).results}
+                chunk_error = "Missing result from LLM backend"
+            except Exception as e:
+                chunk_results = {}
+                chunk_error = str(e)
+
+            # Re-index to the position in the full input list
+            for offset in range(len(chunk)):
+                item = chunk_results.get(offset)
+                if item is None:
+                    results.append(BatchDiagnosisItem(index=start + offset, error=chunk_error))
+                else:
+                    results.append(BatchDiagnosisItem(index=start + offset, diagnosis=item.diagnosis, error=item.error))
+
+    return results
+
 def process_chat_history(chat_history: List[Dict[str, str]]) -> CombinedResponse:
     """
     Sends the chat history to the Colab server to extract symptoms, conditions, and summarize the chat in a single request.
@@ -73,6 +123,30 @@ def chat_with_model(chat_history: List[Dict[str, str]]) -> str:
 
     return response.json()["response"]
 
+def chat_with_model_stream(chat_history: List[Dict[str, str]]) -> Iterator[str]:
+    """
+    Sends the chat history to the model and yields its response as it is generated.
+
+    Args:
+        chat_history: List of messages, each with 'role' and 'content' keys, including the user's latest prompt.
+    
+    Yields:
+        Consecutive pieces of the model's response; joined, they give the full response.
+    
+    Raises:
+        Exception: If the request fails or the server returns an error.
+    """
+    url = f"{BASE_URL}/chat_stream"
+    data = {"chat_history": chat_history}
+
+    with requests.post(url, json=data, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Error: {response.status_code}, {response.text}")
+        response.encoding = response.encoding or "utf-8"
+        for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+            if chunk:
+                yield chunk
+
 def improve_doctor_note(etat: str, doctor_note: str, chat_history: List[Dict[str, str]]) -> str:
     """
     Sends the consultation status, doctor’s note, and chat history to the Colab server to generate an improved version of the note.
@@ -0,0 +1,57 @@
+"""Merkle tree helpers for batch anchoring of diagnoses
+Hashing matches verifyDiagnosisProof in blockchain_smart_contracts/SmartContract_Diagnosis_V4_MerkleBatch.sol:
+leaves are keccak256(0x00 || canonical JSON), nodes are keccak256(0x01 || sorted pair)."""
+import json
+from typing import List
+from web3 import Web3
+from schemas.blockchain_consultation_schemas import DiagnosisRequest
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+def canonical_diagnosis(diagnosis: DiagnosisRequest) -> bytes:
+    """Serializes a diagnosis deterministically (sorted keys, no whitespace, UTF-8)"""
+    return json.dumps(diagnosis.model_dump(), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+def diagnosis_leaf(diagnosis: DiagnosisRequest) -> bytes:
+    return Web3.keccak(LEAF_PREFIX + canonical_diagnosis(diagnosis))
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    if right < left:
+        left, right = right, left
+    return Web3.keccak(NODE_PREFIX + left + right)
+
+def build_merkle_tree(leaves: List[bytes]) -> List[List[bytes]]:
+    """
+    Builds every level of the tree, from the leaves up to the root.
+    An odd node at the end of a level is carried up unchanged.
+    """
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([
+            hash_pair(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ])
+    return levels
+
+def merkle_root(levels: List[List[bytes]]) -> bytes:
+    return levels[-1][0]
+
+def merkle_proof(levels: List[List[bytes]], index: int) -> List[bytes]:
+    """Returns the sibling hashes needed to recompute the root from the leaf at index"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        index //= 2
+    return proof
+
+def verify_merkle_proof(leaf: bytes, proof: List[bytes], root: bytes) -> bool:
+    computed = leaf
+    for sibling in proof:
+        computed = hash_pair(computed, sibling)
+    return computed == root
@@ -0,0 +1,213 @@
+"""Process-wide nonce allocation for the transactions sent from the backend account"""
+import heapq
+import threading
+from typing import Callable, List, Optional, Tuple
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.exceptions import TimeExhausted, TransactionNotFound
+
+# Minimum fee increase accepted by nodes for a replacement transaction is 10%
+REPLACEMENT_FEE_BUMP = 1.125
+
+def is_nonce_too_low(error: Exception) -> bool:
+    message = str(error).lower()
+    return "nonce too low" in message or "nonce is too low" in message
+
+def is_already_known(error: Exception) -> bool:
+    message = str(error).lower()
+    return "already known" in message or "known transaction" in message
+
+def is_rejected(error: Exception) -> bool:
+    """
+    Whether the node refused a transaction for certain (nonce too low, underpriced, invalid, insufficient funds).
+    Any other error, e.g. a timeout, may have happened after the node accepted it.
+    """
+    message = str(error).lower()
+    return is_nonce_too_low(error) or any(
+        reason in message for reason in ("underpriced", "fee too low", "insufficient funds", "invalid")
+    )
+
+def bump_fees(tx: dict, factor: float = REPLACEMENT_FEE_BUMP) -> dict:
+    """
+    Returns a copy of the transaction with its fees raised by factor, for replace-by-fee.
+    Handles both legacy (gasPrice) and EIP-1559 (maxFeePerGas/maxPriorityFeePerGas) transactions.
+    """
+    bumped = dict(tx)
+    for field in ("gasPrice", "maxFeePerGas", "maxPriorityFeePerGas"):
+        if field in bumped:
+            bumped[field] = int(bumped[field] * factor) + 1
+    return bumped
+
+class NonceManager:
+    """
+    Reserves nonces locally so concurrent transactions from one account never share a nonce.
+
+    - The counter is synced lazily from the node's pending transaction count.
+    - Nonces reserved but never broadcast are released and handed out again first,
+      so a failed send does not leave a gap that blocks every later transaction.
+    - A "nonce too low" error re-syncs the counter (another sender used the account).
+
+    The allocator is process-wide: transactions must be sent from a single process
+    for the account, otherwise processes compete for the same nonces.
+    """
+
+    def __init__(self, w3: Web3, account: str):
+        self.w3 = w3
+        self.account = account
+        self._lock = threading.Lock()
+        self._next_nonce: Optional[int] = None
+        self._released: List[int] = []
+
+    def _sync_locked(self) -> None:
+        chain_nonce = self.w3.eth.get_transaction_count(self.account, "pending")
+        # Keep the local counter when it is ahead: our transactions may still be propagating
+        if self._next_nonce is None or chain_nonce > self._next_nonce:
+            self._next_nonce = chain_nonce
+        self._released = [nonce for nonce in self._released if nonce >= chain_nonce]
+        heapq.heapify(self._released)
+
+    def sync(self) -> None:
+        """Re-syncs the local counter with the node"""
+        with self._lock:
+            self._sync_locked()
+
+    def reserve(self) -> int:
+        """Reserves the lowest free nonce"""
+        with self._lock:
+            if self._next_nonce is None:
+                self._sync_locked()
+            if self._released:
+                return heapq.heappop(self._released)
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            return nonce
+
+    def release(self, nonce: int) -> None:
+        """Gives back a nonce whose transaction was never broadcast"""
+        with self._lock:
+            if self._next_nonce is not None and nonce == self._next_nonce - 1:
+                self._next_nonce -= 1
+            else:
+                heapq.heappush(self._released, nonce)
+
+    def broadcast(self, signed_tx) -> HexBytes:
+        """Broadcasts a signed transaction, returning its hash"""
+        try:
+            return self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        except Exception as e:
+            # The node already has this exact transaction, e.g. a retried broadcast
+            if is_already_known(e):
+                return HexBytes(signed_tx.hash)
+            raise
+
+    def _send_signed(self, tx: dict, private_key: str) -> HexBytes:
+        return self.broadcast(self.w3.eth.account.sign_transaction(tx, private_key))
+
+    def sign_transaction(self, build_tx: Callable[[int], dict], private_key: str):
+        """
+        Reserves a nonce, builds and signs a transaction without broadcasting it, so the caller can
+        persist it first. Returns the signed and the unsigned transaction.
+        If it is never broadcast, the caller gives the nonce back with abandon().
+        """
+        nonce = self.reserve()
+        try:
+            tx = build_tx(nonce)
+            return self.w3.eth.account.sign_transaction(tx, private_key), tx
+        except Exception:
+            self.release(nonce)
+            raise
+
+    def abandon(self, nonce: int, error: Exception) -> None:
+        """Frees the nonce of a transaction whose broadcast failed with error"""
+        if is_nonce_too_low(error):
+            # Already used on chain: re-sync instead of handing it out again
+            self.sync()
+        else:
+            self.release(nonce)
+
+    def send_transaction(self, build_tx: Callable[[int], dict], private_key: str, max_attempts: int = 3) -> Tuple[HexBytes, dict]:
+        """
+        Reserves a nonce, builds, signs and broadcasts a transaction without waiting for it to be mined.
+
+        Args:
+            build_tx: Builds the unsigned transaction for a given nonce.
+            private_key: Key used to sign the transaction.
+            max_attempts: Number of re-syncs allowed on "nonce too low".
+
+        Returns:
+            The transaction hash and the unsigned transaction (needed to replace it later).
+
+        Raises:
+            Exception: If the transaction cannot be built or broadcast.
+        """
+        last_error: Optional[Exception] = None
+        for _ in range(max_attempts):
+            nonce = self.reserve()
+            try:
+                tx = build_tx(nonce)
+                return self._send_signed(tx, private_key), tx
+            except Exception as e:
+                if is_nonce_too_low(e):
+                    # The nonce is already used on chain: do not release it, re-sync and retry
+                    last_error = e
+                    self.sync()
+                    continue
+                self.release(nonce)
+                raise
+        raise RuntimeError(f"Could not allocate a valid nonce after {max_attempts} attempts: {last_error}")
+
+    def _find_receipt(self, tx_hashes: List[HexBytes]):
+        for tx_hash in tx_hashes:
+            try:
+                return self.w3.eth.get_transaction_receipt(tx_hash), tx_hash
+            except TransactionNotFound:
+                continue
+        return None, None
+
+    def wait_or_replace(self, tx_hash: HexBytes, tx: dict, private_key: str, timeout: float, max_replacements: int = 3,
+                        replacement_fees: Optional[Callable[[dict], dict]] = None):
+        """
+        Waits for a transaction receipt and replaces the transaction (same nonce, higher fees)
+        every time it stays unconfirmed for timeout seconds.
+
+        Args:
+            tx_hash: Hash of the broadcast transaction.
+            tx: The unsigned transaction that was broadcast.
+            private_key: Key used to sign replacements.
+            timeout: Seconds to wait before each replacement.
+            max_replacements: Number of fee bumps before giving up.
+            replacement_fees: Returns the fees of a replacement from the previous fee fields
+                              (defaults to bump_fees, REPLACEMENT_FEE_BUMP above them).
+
+        Returns:
+            The receipt and the hash of the transaction that was mined.
+
+        Raises:
+            TimeExhausted: If no version of the transaction is mined in time.
+        """
+        sent_hashes = [tx_hash]
+        for replacement in range(max_replacements + 1):
+            try:
+                return self.w3.eth.wait_for_transaction_receipt(sent_hashes[-1], timeout=timeout), sent_hashes[-1]
+            except TimeExhausted:
+                # An earlier version may have been mined in the meantime
+                receipt, mined_hash = self._find_receipt(sent_hashes)
+                if receipt is not None:
+                    return receipt, mined_hash
+                if replacement == max_replacements:
+                    raise
+                if replacement_fees is None:
+                    tx = bump_fees(tx)
+                else:
+                    previous_fees = {field: tx[field] for field in ("gasPrice", "maxFeePerGas", "maxPriorityFeePerGas") if field in tx}
+                    tx = {**tx, **replacement_fees(previous_fees)}
+                try:
+                    sent_hashes.append(self._send_signed(tx, private_key))
+                except Exception as e:
+                    if not is_nonce_too_low(e):
+                        raise
+                    # The nonce got mined while replacing: one of the sent versions has a receipt
+                    receipt, mined_hash = self._find_receipt(sent_hashes)
+                    if receipt is not None:
+                        return receipt, mined_hash
+        raise TimeExhausted(f"Transaction {tx_hash.hex()} was not mined")
@@ -0,0 +1,227 @@
+"""Read-through cache of final on-chain records (in-memory LRU backed by the onchain_record_cache table)"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+from dependencies.database import SessionLocal
+from dependencies.env import BLOCKCHAIN_FINALITY_DEPTH, ONCHAIN_CACHE_SIZE
+from services.async_blockchain_client import blockchain_client
+from services.blockchain_consultation_service import get_diagnosis, get_merkle_root, get_diagnoses, get_merkle_roots, get_block_number
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with a maximum number of entries"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class OnChainRecordCache:
+    """
+    Caches decoded contract reads that can no longer change.
+
+    A record is read at block (head - BLOCKCHAIN_FINALITY_DEPTH): if it already exists there,
+    it is final and stored in memory and in the database, so later reads cost no RPC call.
+    A record that only exists in recent blocks is returned from a "latest" read and not cached.
+    Cache rows are written with a session of their own: the caller's session is only read from,
+    its transaction and loaded objects are left untouched.
+    """
+
+    def __init__(self, maxsize: int = ONCHAIN_CACHE_SIZE, finality_depth: int = BLOCKCHAIN_FINALITY_DEPTH,
+                 session_factory=SessionLocal):
+        self.memory = LRUCache(maxsize)
+        self.finality_depth = finality_depth
+        self.session_factory = session_factory
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _lookup(self, db: Session, key: Tuple[str, int]) -> Optional[dict]:
+        record = self.memory.get(key)
+        if record is not None:
+            self.hits += 1
+            return record
+        row = db.get(models.OnChainRecordCache, key)
+        if row is not None:
+            self.db_hits += 1
+            record = json.loads(row.payload)
+            self.memory.put(key, record)
+            return record
+        return None
+
+    def _persist(self, rows: List[models.OnChainRecordCache]) -> None:
+        """Writes cache rows in their own session and transaction"""
+        db = self.session_factory()
+        try:
+            db.add_all(rows)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Some rows were cached concurrently by another request: write the others one by one
+                db.rollback()
+                for row in rows:
+                    db.merge(row)
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        db.rollback()
+        finally:
+            db.close()
+
+    def _store(self, key: Tuple[str, int], record: dict, block_number: int) -> None:
+        self.memory.put(key, record)
+        self._persist([models.OnChainRecordCache(
+            record_type=key[0],
+            record_id=key[1],
+            payload=json.dumps(record),
+            block_number=block_number
+        )])
+
+    def get(self, db: Session, record_type: str, record_id: int, fetch: Callable[[object], dict]) -> dict:
+        """
+        Returns the record from the cache, or fetches it with fetch(block_identifier).
+
+        Raises:
+            HTTPException: If the record cannot be read from the blockchain.
+        """
+        key = (record_type, record_id)
+        record = self._lookup(db, key)
+        if record is not None:
+            return record
+
+        self.misses += 1
+        final_block = get_block_number() - self.finality_depth
+        if final_block >= 0:
+            try:
+                record = fetch(final_block)
+            except HTTPException:
+                record = None  # Not final yet (or missing): fall through to the latest state
+            if record is not None:
+                self._store(key, record, final_block)
+                return record
+        return fetch("latest")
+
+    async def aget(self, db: Session, record_type: str, record_id: int, fetch: Callable[[object], Awaitable[dict]]) -> dict:
+        """
+        Same as get, for the async endpoints: the chain reads are awaited through the async blockchain client
+        """
+        key = (record_type, record_id)
+        record = self._lookup(db, key)
+        if record is not None:
+            return record
+
+        self.misses += 1
+        final_block = await blockchain_client.get_block_number() - self.finality_depth
+        if final_block >= 0:
+            try:
+                record = await fetch(final_block)
+            except HTTPException:
+                record = None  # Not final yet (or missing): fall through to the latest state
+            if record is not None:
+                self._store(key, record, final_block)
+                return record
+        return await fetch("latest")
+
+    def get_many(self, db: Session, record_type: str, record_ids: List[int],
+                 fetch_many: Callable[[List[int], object], Dict[int, Optional[dict]]]) -> Dict[int, Optional[dict]]:
+        """
+        Bulk version of get: one database query for the records missing from memory, then
+        fetch_many(ids, block_identifier) for the rest, at the final block and at latest for those not final yet.
+
+        Returns:
+            A dict mapping each ID to its record, None when it is not on the blockchain.
+        """
+        records: Dict[int, Optional[dict]] = {}
+        missing = []
+        for record_id in dict.fromkeys(record_ids):
+            record = self.memory.get((record_type, record_id))
+            if record is not None:
+                self.hits += 1
+                records[record_id] = record
+            else:
+                missing.append(record_id)
+        if not missing:
+            return records
+
+        rows = db.query(models.OnChainRecordCache).filter(
+            models.OnChainRecordCache.record_type == record_type,
+            models.OnChainRecordCache.record_id.in_(missing)
+        ).all()
+        for row in rows:
+            self.db_hits += 1
+            records[row.record_id] = json.loads(row.payload)
+            self.memory.put((record_type, row.record_id), records[row.record_id])
+        missing = [record_id for record_id in missing if record_id not in records]
+        if not missing:
+            return records
+
+        self.misses += len(missing)
+        final_block = get_block_number() - self.finality_depth
+        if final_block >= 0:
+            final_records = fetch_many(missing, final_block)
+            rows = []
+            for record_id, record in final_records.items():
+                if record is not None:
+                    records[record_id] = record
+                    self.memory.put((record_type, record_id), record)
+                    rows.append(models.OnChainRecordCache(
+                        record_type=record_type,
+                        record_id=record_id,
+                        payload=json.dumps(record),
+                        block_number=final_block
+                    ))
+            if rows:
+                # Not in the caller's session: committing it would expire the objects it loaded
+                self._persist(rows)
+            missing = [record_id for record_id in missing if record_id not in records]
+        if missing:
+            records.update(fetch_many(missing, "latest"))
+        return records
+
+    def get_diagnosis(self, db: Session, diagnosis_id: int) -> dict:
+        return self.get(db, "diagnosis", diagnosis_id, lambda block: get_diagnosis(diagnosis_id, block))
+
+    def get_merkle_root(self, db: Session, batch_id: int) -> dict:
+        return self.get(db, "merkle_root", batch_id, lambda block: get_merkle_root(batch_id, block))
+
+    async def aget_diagnosis(self, db: Session, diagnosis_id: int) -> dict:
+        return await self.aget(db, "diagnosis", diagnosis_id, lambda block: blockchain_client.get_diagnosis(diagnosis_id, block))
+
+    async def aget_merkle_root(self, db: Session, batch_id: int) -> dict:
+        return await self.aget(db, "merkle_root", batch_id, lambda block: blockchain_client.get_merkle_root(batch_id, block))
+
+    def get_diagnoses(self, db: Session, diagnosis_ids: List[int]) -> Dict[int, Optional[dict]]:
+        return self.get_many(db, "diagnosis", diagnosis_ids, get_diagnoses)
+
+    def get_merkle_roots(self, db: Session, batch_ids: List[int]) -> Dict[int, Optional[dict]]:
+        return self.get_many(db, "merkle_root", batch_ids, get_merkle_roots)
+
+    def stats(self) -> dict:
+        return {"memory_hits": self.hits, "db_hits": self.db_hits, "misses": self.misses, "memory_entries": len(self.memory)}
+
+onchain_cache = OnChainRecordCache()
@@ -0,0 +1,94 @@
+"""Profile photo pipeline: bounded chunked reads of uploads, and renditions rendered in a process pool off the event loop"""
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from fastapi import UploadFile
+from PIL import Image
+from dependencies.env import PHOTO_MAX_BYTES, PHOTO_UPLOAD_CHUNK_SIZE, PHOTO_RENDITION_SIZES, PHOTO_RENDITION_FORMATS, PHOTO_WORKERS
+
+# Pillow format name, file extension and encoder options of each rendition format
+RENDITION_FORMATS = {
+    "jpeg": ("JPEG", "jpg", {"quality": 85}),
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 4}),
+}
+
+class PhotoTooLarge(Exception):
+    """The upload is larger than the allowed number of bytes"""
+
+async def read_upload_limited(file: UploadFile, max_bytes: int = PHOTO_MAX_BYTES, chunk_size: int = PHOTO_UPLOAD_CHUNK_SIZE) -> bytes:
+    """
+    Reads an upload chunk by chunk and stops as soon as it exceeds max_bytes (PhotoTooLarge),
+    so an oversized file is never held in memory. A size announced by the client is checked before reading.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise PhotoTooLarge()
+    buffer = bytearray()
+    while chunk := await file.read(chunk_size):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise PhotoTooLarge()
+    return bytes(buffer)
+
+def rendition_path(directory: str, stem: str, size: int, image_format: str) -> str:
+    return os.path.join(directory, f"{stem}_{size}.{RENDITION_FORMATS[image_format][1]}")
+
+def render_renditions(contents: bytes, directory: str, stem: str, sizes: List[int], formats: List[str]) -> Dict[str, str]:
+    """
+    Decodes an image once and saves it fitted in a size x size box for every size and format.
+    Runs in a worker process: returns the written paths by "{size}.{format}".
+
+    - draft() lets the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding (never below the largest size),
+      which skips most of the decoding work for camera photos.
+    - Each size is resized (LANCZOS) from the next larger one rather than from the full image.
+    - Files are written under a temporary name and renamed, so readers never see a partial file.
+    """
+    image = Image.open(io.BytesIO(contents))
+    largest = max(sizes)
+    image.draft("RGB", (largest, largest))
+    # Convert to RGB (required for JPEG)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    paths = {}
+    current = image
+    for size in sorted(sizes, reverse=True):
+        current = current.copy()
+        current.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for image_format in formats:
+            pillow_format, _, options = RENDITION_FORMATS[image_format]
+            path = rendition_path(directory, stem, size, image_format)
+            temporary_path = f"{path}.tmp"
+            current.save(temporary_path, format=pillow_format, **options)
+            os.replace(temporary_path, path)
+            paths[f"{size}.{image_format}"] = path
+    return paths
+
+class PhotoRenderer:
+    """
+    Renders profile photo renditions (PHOTO_RENDITION_SIZES x PHOTO_RENDITION_FORMATS) in a pool of
+    PHOTO_WORKERS processes, started on first use: decoding and resizing never block the event loop.
+    """
+
+    def __init__(self, workers: int = PHOTO_WORKERS, sizes: List[int] = PHOTO_RENDITION_SIZES, formats: List[str] = PHOTO_RENDITION_FORMATS):
+        unknown = set(formats) - set(RENDITION_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown PHOTO_RENDITION_FORMATS {', '.join(sorted(unknown))}, expected {', '.join(RENDITION_FORMATS)}")
+        self.workers = workers
+        self.sizes = sorted(sizes)
+        self.formats = formats
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def render(self, contents: bytes, directory: str, stem: str) -> Dict[str, str]:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, render_renditions, contents, directory, stem, self.sizes, self.formats)
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+photo_renderer = PhotoRenderer()
@@ -0,0 +1,143 @@
+"""Cache of rarely changing reference data (doctor profiles), shareable across worker processes through its backend"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from dependencies.env import REFERENCE_CACHE_URL, REFERENCE_CACHE_TTL, REFERENCE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Namespace of the doctor profiles and of the list of doctor ids
+DOCTORS = "doctors"
+
+class MemoryBackend:
+    """Backend local to the process: entries expire after their ttl, at most maxsize are kept (least recently stored first out)"""
+    name = "memory"
+
+    def __init__(self, maxsize: int = REFERENCE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[0]:
+                self._entries.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+class RedisBackend:
+    """Backend shared by all worker processes (and servers) using the same Redis database. Needs the redis package."""
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("REFERENCE_CACHE_URL is a Redis URL but the redis package is not installed (pip install redis)") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def get_counter(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+class ReferenceCache:
+    """
+    Read-through cache of JSON-serializable values grouped in namespaces, each with a version number.
+
+    - Entries are stored under "ref:{namespace}:v{version}:{key}" for REFERENCE_CACHE_TTL seconds.
+    - invalidate(namespace) increments the version after a write: entries of older versions are never read
+      again (they expire on their own), so every process sharing the backend sees the change on its next lookup.
+    - Backend errors are logged and counted, and the value is loaded from the database.
+    With the memory backend, other worker processes see a write only when their entries expire.
+    """
+
+    def __init__(self, backend, ttl: float = REFERENCE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_or_load(self, namespace: str, key: Any, load: Callable[[], Any]) -> Any:
+        """Returns the cached value of key in namespace, or calls load() and caches its result (None is not cached)"""
+        try:
+            version = self.backend.get_counter(f"ref:{namespace}:version")
+            entry_key = f"ref:{namespace}:v{version}:{key}"
+            cached = self.backend.get(entry_key)
+        except Exception:
+            logger.exception("Reference cache backend unavailable, loading %s %s from the database", namespace, key)
+            self._count("errors")
+            return load()
+
+        if cached is not None:
+            self._count("hits")
+            return json.loads(cached)
+
+        self._count("misses")
+        value = load()
+        if value is not None:
+            try:
+                self.backend.set(entry_key, json.dumps(value), self.ttl)
+            except Exception:
+                logger.exception("Reference cache backend unavailable, %s %s not cached", namespace, key)
+                self._count("errors")
+        return value
+
+    def invalidate(self, namespace: str) -> None:
+        """Drops every entry of namespace, to be called after committing a write to its data"""
+        try:
+            self.backend.incr(f"ref:{namespace}:version")
+        except Exception:
+            logger.exception("Reference cache backend unavailable, %s entries expire after %s seconds", namespace, self.ttl)
+            self._count("errors")
+            return
+        self._count("invalidations")
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.name, "hits": self.hits, "misses": self.misses,
+                "errors": self.errors, "invalidations": self.invalidations}
+
+def create_backend(url: str):
+    """Backend of REFERENCE_CACHE_URL: empty for the memory backend, redis://... for a shared Redis backend"""
+    if not url:
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported REFERENCE_CACHE_URL {url!r}, expected a redis:// URL or nothing")
+
+reference_cache = ReferenceCache(create_backend(REFERENCE_CACHE_URL))